@@ -0,0 +1,346 @@
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+
+import batchrunner
+import datamanager as dm
+import plotmaker
+import sessionmanager
+import statsmanager as sm
+import tweetplot
+
+logger = logging.getLogger()
+
+# The local port the service listens on. Set TTVIZ_SERVICE_PORT to change it
+service_port = int(os.getenv('TTVIZ_SERVICE_PORT', '8765'))
+
+# How many jobs the service runs at the same time. Later jobs wait for a free slot
+SERVICE_CONCURRENCY = 2
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Stands in for sys.stdout so what a job prints is sent to that job's client instead of the terminal. Only threads
+    that set a sink are redirected. Everything else, including threads a job starts itself, still prints normally.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def set_sink(self, sink):
+        """
+        Sends what the current thread prints to a function instead of the terminal
+        :param sink: A function that takes one line of output, or None to print to the terminal again
+        """
+
+        self._local.sink = sink
+        self._local.buffer = ''
+
+    def write(self, text: str) -> int:
+        sink = getattr(self._local, 'sink', None)
+
+        if sink is None:
+            return self.stream.write(text)
+
+        lines = (self._local.buffer + text).split('\n')
+        self._local.buffer = lines.pop()
+
+        for line in lines:
+            sink(line)
+
+        return len(text)
+
+    def flush(self):
+        sink = getattr(self._local, 'sink', None)
+
+        if sink is not None and self._local.buffer != '':
+            sink(self._local.buffer)
+            self._local.buffer = ''
+
+        self.stream.flush()
+
+
+class AnalysisService:
+    """
+    Keeps the tagger, API session, and caches loaded in one process so jobs start working right away. Jobs are the
+    same as batchrunner jobs. Jobs that share a save name run one at a time, in the order they arrived.
+    """
+
+    def __init__(self, concurrency=SERVICE_CONCURRENCY, workers=None):
+        self.workers = workers
+        self.started_at = time.time()
+        self.warm_seconds = None
+        self.jobs_received = 0
+        self.jobs_run = 0
+        self.output = ThreadOutput(sys.stdout)
+
+        self._slots = threading.BoundedSemaphore(max(concurrency, 1))
+        self._name_locks = {}
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Logs in and loads everything a job would otherwise load the first time it is needed
+        """
+
+        start_time = time.perf_counter()
+
+        tweetplot.login(tweetplot.load_account_data())
+        dm.get_tag_cache()
+        dm.get_user_cache()
+        dm.get_summary_cache()
+
+        try:
+            dm.tag_tweet_batch(['Warming up the tagger'])
+        except LookupError as error:
+            print(f'Could not load the NLTK models because {error}')
+            logger.warning('Could not load the NLTK models! Jobs that tag tweets will fail until they are installed')
+
+        # The first plot of a process loads matplotlib's fonts and the PNG writer
+        figure = plotmaker.Figure()
+        figure.add_subplot().plot([0, 1])
+        figure.savefig(io.BytesIO(), format='png')
+
+        # The first comparison loads scipy's distributions
+        summary = sm.InteractionStats().update(pd.DataFrame({'favorites': [1, 2, 3], 'retweets': [0, 1, 1]})).summary()
+        sm.welch_pairwise(pd.DataFrame([summary, summary]))
+
+        # Jobs run in threads, where windows cannot be shown, so plots are only saved
+        plotmaker.use_headless_plots()
+        self.warm_seconds = time.perf_counter() - start_time
+        logger.info(f'Analysis service warmed up in {round(self.warm_seconds, 3)}s')
+
+    def _get_name_locks(self, names: [str]) -> []:
+        """
+        Gets the locks of some save names
+        :param names: The save names
+        :return: The locks, sorted by name so jobs always take them in the same order
+        """
+
+        with self._lock:
+            return [self._name_locks.setdefault(name, threading.Lock()) for name in sorted(set(names))]
+
+    def run_job(self, job: dict, send) -> batchrunner.JobResult:
+        """
+        Runs a job, sending its output and plots to a client as they happen
+        :param job: The job dictionary [See batchrunner.load_jobs()]
+        :param send: A function that takes an event dictionary
+        :return: The job's JobResult
+        """
+
+        with self._lock:
+            index = self.jobs_received
+            self.jobs_received += 1
+
+        with ExitStack() as stack:
+            # The slot is taken last, so a job waiting for another job with the same save name never holds a slot
+            # that an unrelated job could use
+            for lock in self._get_name_locks(batchrunner.get_job_names(job)):
+                stack.enter_context(lock)
+
+            stack.enter_context(self._slots)
+
+            send({'event': 'started'})
+            self.output.set_sink(lambda line: send({'event': 'output', 'line': line}))
+
+            try:
+                with plotmaker.watch_saved_plots(lambda path: send({'event': 'plot', 'path': path})):
+                    result = batchrunner.run_job(index, job, self.workers, metrics=True)
+            finally:
+                self.output.flush()
+                self.output.set_sink(None)
+
+        with self._lock:
+            self.jobs_run += 1
+
+        return result
+
+    def get_status(self) -> dict:
+        """
+        Gets the state of the service
+        :return: A dictionary of the service's uptime, warm up time, and how many jobs it has run
+        """
+
+        return {'uptime': round(time.time() - self.started_at, 3), 'jobs_run': self.jobs_run,
+                'warm_seconds': round(self.warm_seconds, 3) if self.warm_seconds is not None else None}
+
+
+def make_handler(service: AnalysisService):
+    """
+    Creates the request handler class of a service
+    :param service: The AnalysisService that runs the jobs
+    :return: A BaseHTTPRequestHandler subclass
+    """
+
+    class ServiceHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 is needed to send events in chunks as they happen
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path != '/status':
+                self.send_error(404)
+                return
+
+            body = json.dumps(service.get_status()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != '/jobs':
+                self.send_error(404)
+                return
+
+            try:
+                job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                job = None
+
+            if not isinstance(job, dict):
+                self.send_error(400, 'The job must be a JSON object')
+                return
+
+            try:
+                # Invalid jobs are rejected before the response starts, since a streamed response cannot change its
+                # status later
+                batchrunner.make_job_args(job)
+            except ValueError as error:
+                self.send_error(400, str(error))
+                return
+
+            # Events are sent one JSON object per line as they happen, and the response ends when the job does
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            def send(event: dict):
+                data = (json.dumps(event) + '\n').encode('utf-8')
+
+                try:
+                    self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                    self.wfile.flush()
+                except OSError:
+                    # The client stopped listening. The job still finishes
+                    pass
+
+            try:
+                result = service.run_job(job, send)
+            except Exception as error:
+                # The client is always sent a done event, even if the job could not be started
+                logger.error(f'Analysis service could not run {job} because {type(error).__name__}: {error}')
+                result = batchrunner.JobResult(-1, str(job.get('command')), '', 'failed', 0.0,
+                                               f'{type(error).__name__}: {error}')
+
+            send(dict(result._asdict(), event='done'))
+
+            try:
+                self.wfile.write(b'0\r\n\r\n')
+            except OSError:
+                pass
+
+        def log_message(self, format, *args):
+            logger.debug('Analysis service: ' + format % args)
+
+    return ServiceHandler
+
+
+def serve(port=None, concurrency=SERVICE_CONCURRENCY, workers=None):
+    """
+    Warms up an analysis service and answers jobs on localhost until interrupted
+    :param port: The port to listen on. Defaults to the TTVIZ_SERVICE_PORT setting
+    :param concurrency: How many jobs run at the same time. Default is SERVICE_CONCURRENCY
+    :param workers: How many processes each job uses to tag tweets. Defaults to the TTVIZ_WORKERS setting
+    """
+
+    service = AnalysisService(concurrency=concurrency, workers=workers)
+    service.warm_up()
+
+    server = ThreadingHTTPServer(('127.0.0.1', port if port is not None else service_port), make_handler(service))
+    real_stdout = sys.stdout
+    sys.stdout = service.output
+
+    print(f'Analysis service ready at http://127.0.0.1:{server.server_address[1]} after '
+          f'{round(service.warm_seconds, 3)}s')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sys.stdout = real_stdout
+        sessionmanager.get_scheduler().log_stats()
+        dm.get_user_cache().log_stats()
+
+
+def submit_job(job: dict, url=None):
+    """
+    Sends a job to a running analysis service
+    :param job: The job dictionary [See batchrunner.load_jobs()]
+    :param url: The service's address. Defaults to localhost on the TTVIZ_SERVICE_PORT port
+    :return: A generator of the job's events, ending with its done event
+    """
+
+    url = url if url is not None else f'http://127.0.0.1:{service_port}'
+
+    with requests.post(url + '/jobs', json=job, stream=True) as response:
+        response.raise_for_status()
+
+        # chunk_size=None hands over each event as soon as it arrives
+        for line in response.iter_lines(chunk_size=None):
+            if line:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs ttViz as a local service that keeps its models and login '
+                                                 'loaded, or sends a job to one.')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Start the service')
+    serve_parser.add_argument('--port', type=int, default=None, help=f'Default is {service_port}')
+    serve_parser.add_argument('--concurrency', type=int, default=SERVICE_CONCURRENCY,
+                              help='How many jobs run at the same time')
+    serve_parser.add_argument('--workers', type=int, default=None, help='Processes each job uses to tag tweets')
+
+    submit_parser = subparsers.add_parser('submit', help='Send a job to a running service and print its events')
+    submit_parser.add_argument('job', help='The job as a JSON object, such as {"command": "network", '
+                                           '"username": "jack"}')
+    submit_parser.add_argument('--url', default=None, help=f'Default is http://127.0.0.1:{service_port}')
+    options = parser.parse_args()
+
+    if options.action == 'serve':
+        tweetplot.setup_logging()
+        serve(options.port, options.concurrency, options.workers)
+    else:
+        status = 'failed'
+
+        for event in submit_job(json.loads(options.job), url=options.url):
+            if event['event'] == 'output':
+                print(event['line'])
+            elif event['event'] == 'plot':
+                print(f'Saved plot {event["path"]}')
+            elif event['event'] == 'done':
+                status = event['status']
+                print(f'Job {status} in {event["seconds"]}s {event["error"]}'.strip())
+
+        if status != 'done':
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import datamanager as dm
+import metricsmanager
+import plotmaker
+import sessionmanager
+import tweetplot
+
+logger = logging.getLogger()
+
+# How many jobs run at the same time when no limit is given. Set TTVIZ_BATCH_CONCURRENCY to change it
+batch_concurrency = int(os.getenv('TTVIZ_BATCH_CONCURRENCY', '4'))
+
+# The fields of each kind of job that answer the command's prompts, in the order the command asks for them
+JOB_PROMPTS = {'topic': ['topic', 'limit'], 'user': ['username'], 'network': ['username'], 'tweet': ['text', 'image'],
+               'stats': ['user1', 'user2'], 'time': ['searches', 'bucket']}
+
+# The fields each kind of job must have
+REQUIRED_FIELDS = {'topic': ['topic'], 'user': ['username', 'mode'], 'network': ['username'],
+                   'tweet': ['text', 'image'], 'stats': ['user1', 'user2'], 'time': ['searches']}
+
+# How one job of a batch went. status is done or failed, and error is the reason a job failed
+JobResult = namedtuple('JobResult', ['index', 'command', 'target', 'status', 'seconds', 'error'])
+
+
+def load_jobs(file_name: str) -> []:
+    """
+    Loads the jobs of a batch from a JSON file holding a list of jobs, or an object with the list under jobs. Each job
+    is an object with a command (topic, user, network, tweet, stats, or time) and the command's fields, for example
+    {"command": "user", "username": "jack", "mode": "3", "plot": true}
+    :param file_name: The path of the job file
+    :return: A list of job dictionaries
+    """
+
+    with open(file_name) as file:
+        jobs = json.load(file)
+
+    if isinstance(jobs, dict):
+        jobs = jobs.get('jobs', [])
+
+    return jobs
+
+
+def make_job_args(job: dict) -> tuple:
+    """
+    Turns a job into the arguments of tweetplot.run_command
+    :param job: The job dictionary
+    :return: A tuple of the command, its args, and the answers to its prompts in order
+    """
+
+    command = job.get('command')
+
+    if command not in JOB_PROMPTS:
+        raise ValueError(f'Unknown command {command}! Valid commands are {", ".join(JOB_PROMPTS.keys())}')
+
+    missing = [field for field in REQUIRED_FIELDS[command] if field not in job]
+
+    if len(missing) > 0:
+        raise ValueError(f'{command} jobs need the fields {", ".join(missing)}')
+
+    should_plot = bool(job.get('plot', False))
+    answers = [str(job.get(field, '')) for field in JOB_PROMPTS[command]]
+
+    if command == 'time':
+        # The searches of a time job can be a list or a comma separated string
+        if isinstance(job['searches'], list):
+            answers[0] = ', '.join(str(name) for name in job['searches'])
+        elif not isinstance(job['searches'], str):
+            raise ValueError('The searches of time jobs must be a list or a comma separated string')
+
+    if command == 'topic':
+        args = [should_plot, str(job.get('name', ''))]
+    elif command == 'user':
+        args = [str(job['mode']), should_plot, bool(job.get('sync', False))]
+    elif command == 'stats':
+        args = [should_plot, bool(job.get('reuse', False))]
+    elif command == 'network' or command == 'time':
+        args = [should_plot]
+    else:
+        args = []
+
+    return command, args, answers
+
+
+def get_job_names(job: dict) -> [str]:
+    """
+    Gets the names a job saves or reads tweets under. Jobs sharing a name depend on each other. Never raises, so the
+    names of invalid jobs can be found before make_job_args() rejects them
+    :param job: The job dictionary
+    :return: A list of lowercased save names
+    """
+
+    if job.get('command') == 'topic':
+        names = [job.get('name') or job.get('topic')]
+    elif job.get('command') == 'time':
+        searches = job.get('searches') or []
+
+        if isinstance(searches, str):
+            names = searches.split(',')
+        else:
+            names = searches if isinstance(searches, list) else []
+
+        names = [str(name).strip() for name in names]
+    else:
+        names = [job.get(field) for field in ('username', 'user1', 'user2', 'image')]
+
+    return [str(name).lower() for name in names if name]
+
+
+def run_job(index: int, job: dict, workers=None, after=[], metrics=False) -> JobResult:
+    """
+    Runs one job of a batch. Errors are caught so one failed job does not stop the others
+    :param index: The position of the job in the batch
+    :param job: The job dictionary
+    :param workers: How many processes should tag tweets. Defaults to the TTVIZ_WORKERS setting
+    :param after: Futures of earlier jobs that must finish first
+    :param metrics: Should the job be recorded as its own metrics run? Default is False (Part of the caller's run)
+    :return: The job's JobResult
+    """
+
+    wait(after)
+
+    command = str(job.get('command'))
+    target = ', '.join(get_job_names(job))
+    start_time = time.perf_counter()
+    status = 'done'
+    error_text = ''
+
+    try:
+        command, args, answers = make_job_args(job)
+        prompts = iter(answers)
+        run = tweetplot.process_command if metrics else tweetplot.run_command
+        run(command, args, workers, ask=lambda prompt='': next(prompts, ''))
+    except Exception as error:
+        status = 'failed'
+        error_text = f'{type(error).__name__}: {error}'
+        print(f'Job {index} ({command} {target}) failed because {error_text}')
+        logger.error(f'Batch job {index} ({command} {target}) failed because {error_text}')
+
+    return JobResult(index, command, target, status, round(time.perf_counter() - start_time, 3), error_text)
+
+
+def run_batch(jobs: [], concurrency=None, workers=None) -> [JobResult]:
+    """
+    Runs the jobs of a batch, several at a time. Jobs that share a save name run one after another in the order they
+    are listed, so a stats job can use the tweets saved by an earlier user job
+    :param jobs: A list of job dictionaries
+    :param concurrency: How many jobs run at the same time. Defaults to the TTVIZ_BATCH_CONCURRENCY setting
+    :param workers: How many processes each job uses to tag tweets. Defaults to the TTVIZ_WORKERS setting
+    :return: A list of every job's JobResult, in the order of the jobs
+    """
+
+    if concurrency is None:
+        concurrency = batch_concurrency
+
+    last_jobs = {}
+    futures = []
+
+    # Jobs run in threads, where windows cannot be shown, so plots are only saved
+    plotmaker.use_headless_plots()
+
+    with metricsmanager.start_run('batch'), ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        for index, job in enumerate(jobs):
+            names = get_job_names(job)
+            # Earlier jobs were queued first, so they are already running by the time this job waits on them
+            after = [last_jobs[name] for name in names if name in last_jobs]
+            future = executor.submit(metricsmanager.bind_run(run_job), index, job, workers, after)
+
+            for name in names:
+                last_jobs[name] = future
+
+            futures.append(future)
+
+        results = [future.result() for future in futures]
+
+    return results
+
+
+def print_summary(results: [JobResult]):
+    """
+    Prints and logs the status of every job of a batch
+    :param results: The JobResults of the batch
+    """
+
+    done = len([result for result in results if result.status == 'done'])
+
+    print(f'{done} of {len(results)} jobs done')
+
+    for result in results:
+        line = f'{result.index}: {result.command} {result.target} - {result.status} in {result.seconds}s'
+
+        if result.error != '':
+            line += f' ({result.error})'
+
+        print(line)
+        logger.info(f'Batch job {line}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a file of ttViz jobs in one process with a single login.')
+    parser.add_argument('job_file', help='JSON file with a list of jobs')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help=f'How many jobs run at the same time. Default is {batch_concurrency}')
+    parser.add_argument('--workers', type=int, default=None, help='Processes each job uses to tag tweets')
+    options = parser.parse_args()
+
+    tweetplot.setup_logging()
+
+    jobs = load_jobs(options.job_file)
+
+    tweetplot.login(tweetplot.load_account_data())
+    results = run_batch(jobs, concurrency=options.concurrency, workers=options.workers)
+
+    print_summary(results)
+    sessionmanager.get_scheduler().log_stats()
+    dm.get_user_cache().log_stats()
+
+    if any(result.status == 'failed' for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import matplotlib
+
+# Plots are only saved while benchmarking, never shown
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+import datamanager as dm
+import statsmanager as sm
+import storemanager
+import timemanager as tm
+from fakeapi import VOCABULARY
+from plotmaker import PlotJob, PlotMaker, render_plots
+
+# Corpus sizes benchmarked when none are given
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+# A benchmark is reported as a regression when it is this much slower than in the baseline results
+REGRESSION_THRESHOLD = 1.2
+
+# How many users the tweets of a synthetic corpus are spread across
+CORPUS_USERS = 100
+
+# How many bar plots are rendered in the render_plots benchmark
+PLOT_BATCH = 48
+
+# The slowest acceptable rate of the render_plots benchmark, in plots per second for each worker
+PLOT_THROUGHPUT_TARGET = 5
+
+# The slowest acceptable time to import datamanager in a fresh interpreter, in seconds
+IMPORT_BUDGET = 1.0
+
+# Modules that importing datamanager must not load, since they are only needed to tag tweets, run tests, or plot
+LAZY_MODULES = ['matplotlib', 'nltk', 'scipy', 'tweetplot']
+
+# Lazily imported modules that are loaded before the benchmarks, so their import is not timed as part of a benchmark
+PRELOAD_MODULES = ['scipy.stats', 'nltk.tag.perceptron', 'nltk.tokenize.casual']
+
+
+def make_corpus(size: int, seed=0) -> []:
+    """
+    Builds synthetic tweets with the attributes datamanager reads from tweepy statuses
+    :param size: The number of tweets
+    :param seed: Seed for the random text and counts. The same seed always builds the same corpus
+    :return: An array of tweets
+    """
+
+    rng = random.Random(seed)
+    start_time = datetime(2020, 1, 1)
+    users = [SimpleNamespace(screen_name=f'user{index}') for index in range(CORPUS_USERS)]
+    tweets = []
+
+    for index in range(size):
+        text = ' '.join(rng.choices(VOCABULARY, k=rng.randint(4, 20)))
+        tweets.append(SimpleNamespace(id=10 ** 9 + index, full_text=text, user=rng.choice(users),
+                                      favorite_count=int(rng.paretovariate(1.5)) - 1,
+                                      retweet_count=int(rng.paretovariate(2)) - 1,
+                                      created_at=start_time + timedelta(minutes=7 * index)))
+
+    return tweets
+
+
+def measure(func, *args, repeat=1, trace_memory=True, **kwargs) -> dict:
+    """
+    Times a function and measures the peak memory it allocates. Memory is traced in a separate run, since tracing
+    slows the function down
+    :param func: The function to benchmark
+    :param args: Positional arguments for func
+    :param repeat: How many timed runs to make. The fastest is reported. Default is 1
+    :param trace_memory: Should peak memory be measured? Default is True
+    :param kwargs: Keyword arguments for func
+    :return: A dictionary with the fastest time in seconds and the peak memory in megabytes (None if not traced)
+    """
+
+    times = []
+
+    for run in range(repeat):
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start_time)
+        plt.close('all')
+
+    peak_mb = None
+
+    if trace_memory:
+        tracemalloc.start()
+
+        try:
+            func(*args, **kwargs)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+            plt.close('all')
+
+    return {'seconds': round(min(times), 6), 'peak_mb': round(peak_mb, 3) if peak_mb is not None else None}
+
+
+def upsert_new_store(store_dir: str, frame: pd.DataFrame, tag=None) -> int:
+    """
+    Adds tweets to a new tweet store, so every run of the benchmark measures inserts instead of updates
+    :param store_dir: The directory to create the store in
+    :param frame: A dataframe of tweets
+    :param tag: The name of the search that found the tweets. Default is None (No tag)
+    :return: How many tweets were added
+    """
+
+    handle, path = tempfile.mkstemp(suffix='.sqlite', dir=store_dir)
+    os.close(handle)
+
+    return storemanager.TweetStore(path).upsert(frame, tag=tag)
+
+
+def measure_import(module='datamanager', repeat=1) -> dict:
+    """
+    Times importing a module in a fresh interpreter, as the command line tools do when they start
+    :param module: The module to import. Default is datamanager
+    :param repeat: How many interpreters to time. The fastest is reported. Default is 1
+    :return: A dictionary with the benchmark's name, the fastest time in seconds, and which of LAZY_MODULES the import
+    loaded
+    """
+
+    code = f'import sys, time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)\n' \
+           f'print(" ".join(name for name in {LAZY_MODULES} if name in sys.modules))'
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    loaded = []
+
+    for run in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env,
+                                check=True).stdout.splitlines()
+        times.append(float(output[0]))
+        loaded = output[1].split() if len(output) > 1 else []
+
+    return {'name': f'import_{module}', 'size': 0, 'seconds': round(min(times), 6), 'peak_mb': None, 'loaded': loaded}
+
+
+def check_import(result: dict) -> [str]:
+    """
+    Checks an import benchmark against IMPORT_BUDGET and LAZY_MODULES
+    :param result: A result from measure_import
+    :return: A description of each problem found. Empty if the import is within budget
+    """
+
+    problems = []
+
+    if result['seconds'] > IMPORT_BUDGET:
+        problems.append(f'{result["name"]} took {result["seconds"]}s, over the budget of {IMPORT_BUDGET}s')
+
+    if len(result['loaded']) > 0:
+        problems.append(f'{result["name"]} loaded {", ".join(result["loaded"])}, which should only load when used')
+
+    return problems
+
+
+def run_benchmarks(sizes: [int], repeat=1, trace_memory=True, workers=1, storage='csv', skip=[]) -> []:
+    """
+    Benchmarks the text analysis, counting, storage, statistics, time analysis, and plotting paths on synthetic corpora
+    :param sizes: The corpus sizes to benchmark
+    :param repeat: How many timed runs to make of each benchmark. Default is 1
+    :param trace_memory: Should peak memory be measured? Default is True
+    :param workers: How many processes select_pos_words and render_plots use. Default is 1
+    :param storage: The storage format for the save and load benchmarks. Default is csv
+    :param skip: Names of benchmarks to leave out
+    :return: A list of results, each with the benchmark's name, corpus size, seconds, and peak_mb
+    """
+
+    results = []
+
+    if 'import_datamanager' not in skip:
+        result = measure_import(repeat=repeat)
+        results.append(result)
+        print(f'import_datamanager: {result["seconds"]}s')
+
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+
+    # save_tweets only measures writing the search file. The tweet store has its own benchmarks, which use stores in a
+    # temporary directory so nothing is left behind
+    use_tweet_store = dm.use_tweet_store
+    dm.use_tweet_store = False
+    store_dir = tempfile.mkdtemp(prefix='ttviz_store_')
+
+    try:
+        for size in sizes:
+            print(f'Building a corpus of {size} tweets...')
+            tweets = make_corpus(size)
+            frame = dm.tweets_to_frame(tweets)
+            text = frame['text'].tolist()
+            words = [word for tweet in text for word in tweet.split()]
+            freq_frame = dm.build_frequency_frame(words)
+            summaries = sm.summarize_interactions(frame, by='screen_name')
+            slope = float(frame['retweets'].mean()) / max(float(frame['favorites'].mean()), 1.0)
+            save_name = f'benchmark_{size}'
+            save_file = dm.make_file_name_for_search(save_name, extension=dm.STORAGE_FORMATS[storage])
+            store = storemanager.TweetStore(os.path.join(store_dir, f'{save_name}.sqlite'))
+            store.upsert(frame, tag=save_name)
+
+            # save_tweets must run before get_dataframe_from_file, so there is something to load
+            benchmarks = [('select_pos_words', dm.select_pos_words, [text], {'workers': workers}),
+                          ('build_frequency_frame', dm.build_frequency_frame, [words], {}),
+                          ('save_tweets', dm.save_tweets, [save_name, tweets], {'storage': storage}),
+                          ('get_dataframe_from_file', dm.get_dataframe_from_file, [save_file], {}),
+                          ('tweet_store_upsert', upsert_new_store, [store_dir, frame], {'tag': save_name}),
+                          ('tweet_store_query', store.query, [], {'screen_name': 'user0', 'tag': save_name}),
+                          ('calculate_resids', sm.calculate_resids,
+                           [slope, 0.0, frame['retweets'].tolist()], {'x_vals': frame['favorites'].tolist()}),
+                          ('summarize_regression', sm.summarize_regression,
+                           [frame['favorites'], frame['retweets']], {}),
+                          ('summarize_interactions', sm.summarize_interactions, [frame], {'by': 'screen_name'}),
+                          ('welch_pairwise', sm.welch_pairwise, [summaries], {}),
+                          ('bucket_activity', tm.bucket_activity, [frame],
+                           {'bucket': 'hour', 'by': 'screen_name', 'fill': False}),
+                          ('rolling_activity', tm.rolling_activity, [frame], {'by': 'screen_name'}),
+                          ('weekly_profile', tm.weekly_profile, [frame], {}),
+                          ('build_bar_plot', PlotMaker('Benchmark', freq_frame, headless=True).build_bar_plot,
+                           ['word', 'freq', save_name], {}),
+                          ('build_scatter_plot', PlotMaker('Benchmark', frame, headless=True).build_scatter_plot,
+                           ['favorites', 'retweets', save_name], {}),
+                          ('build_boxplot', PlotMaker('Benchmark', frame[['favorites', 'retweets']],
+                                                      headless=True).build_boxplot,
+                           [save_name], {'xlabels': ['Favorites', 'Retweets']}),
+                          ('render_plots', render_plots,
+                           [[PlotJob('bar', 'Benchmark', freq_frame, ['word', 'freq', f'{save_name}_{index}'], {})
+                             for index in range(PLOT_BATCH)]], {'workers': workers})]
+
+            for name, func, args, kwargs in benchmarks:
+                if name in skip:
+                    continue
+
+                result = measure(func, *args, repeat=repeat, trace_memory=trace_memory, **kwargs)
+                result.update({'name': name, 'size': size})
+                results.append(result)
+                print(f'{name} ({size} tweets): {result["seconds"]}s, peak {result["peak_mb"]} MB')
+
+                if name == 'render_plots' and result['seconds'] > 0:
+                    result['plots_per_sec'] = round(PLOT_BATCH / result['seconds'], 2)
+
+                    if result['plots_per_sec'] < PLOT_THROUGHPUT_TARGET * workers:
+                        print(f'render_plots made {result["plots_per_sec"]} plots/sec, below the target of '
+                              f'{PLOT_THROUGHPUT_TARGET * workers}')
+    finally:
+        dm.use_tweet_store = use_tweet_store
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+    return results
+
+
+def get_commit() -> str:
+    """
+    Gets the git commit the benchmarks ran on
+    :return: The short commit hash, or unknown if it could not be found
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_results(results: [], file_name: str, commit: str):
+    """
+    Saves benchmark results as JSON
+    :param results: The results from run_benchmarks
+    :param file_name: The path of the JSON file
+    :param commit: The git commit the benchmarks ran on
+    """
+
+    report = {'commit': commit, 'time': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'pandas': pd.__version__, 'results': results}
+
+    with open(file_name, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+
+
+def compare_results(baseline_file: str, results: []) -> []:
+    """
+    Compares benchmark results against a saved baseline and prints the change in time and memory of each benchmark
+    :param baseline_file: The path of a JSON file saved by save_results
+    :param results: The new results from run_benchmarks
+    :return: The names and sizes of the benchmarks that got slower by more than REGRESSION_THRESHOLD
+    """
+
+    with open(baseline_file) as results_file:
+        baseline = json.load(results_file)
+
+    old_results = {(result['name'], result['size']): result for result in baseline['results']}
+    regressions = []
+
+    print(f'Compared to {baseline["commit"]}:')
+
+    for result in results:
+        old = old_results.get((result['name'], result['size']))
+
+        if old is None or old['seconds'] == 0:
+            continue
+
+        ratio = result['seconds'] / old['seconds']
+        line = f'{result["name"]} ({result["size"]} tweets): {old["seconds"]}s -> {result["seconds"]}s ' \
+               f'({round(ratio, 2)}x)'
+
+        if old['peak_mb'] is not None and result['peak_mb'] is not None:
+            line += f', peak {old["peak_mb"]} MB -> {result["peak_mb"]} MB'
+
+        if ratio > REGRESSION_THRESHOLD:
+            line += ' REGRESSION'
+            regressions.append((result['name'], result['size']))
+
+        print(line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks ttViz\'s text analysis, counting, storage, statistics, '
+                                                 'and plotting on synthetic tweet corpora.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Corpus sizes in tweets')
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per benchmark. The fastest is reported')
+    parser.add_argument('--workers', type=int, default=1, help='Processes used by select_pos_words and render_plots')
+    parser.add_argument('--storage', default='csv', choices=list(dm.STORAGE_FORMATS.keys()),
+                        help='Storage format for the save and load benchmarks')
+    parser.add_argument('--skip', nargs='+', default=[], help='Names of benchmarks to leave out')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure peak memory')
+    parser.add_argument('--output', default=None, help='JSON file for the results. Default is '
+                                                       'benchmarks/<commit>.json')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--import-only', action='store_true', help='Only check the time it takes to import '
+                                                                      'datamanager against its budget')
+    options = parser.parse_args()
+
+    if options.import_only:
+        problems = check_import(measure_import(repeat=options.repeat))
+
+        for problem in problems:
+            print(problem)
+
+        if len(problems) > 0:
+            raise SystemExit(1)
+
+        print(f'Importing datamanager is within its budget of {IMPORT_BUDGET}s')
+        return
+
+    commit = get_commit()
+    output = options.output
+
+    if output is None:
+        results_dir = os.getcwd() + '/benchmarks/'
+
+        if os.path.exists(results_dir) is False:
+            os.mkdir(results_dir)
+
+        output = results_dir + f'{commit}.json'
+
+    output = os.path.abspath(output)
+    compare = os.path.abspath(options.compare) if options.compare is not None else None
+
+    # Saved tweets and plots go to a scratch directory instead of the working directory
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        start_dir = os.getcwd()
+        os.chdir(scratch_dir)
+
+        try:
+            results = run_benchmarks(options.sizes, repeat=options.repeat, trace_memory=not options.no_memory,
+                                     workers=options.workers, storage=options.storage, skip=options.skip)
+        finally:
+            os.chdir(start_dir)
+
+    save_results(results, output, commit)
+    print(f'Saved results to {output}')
+
+    problems = [problem for result in results if result['name'] == 'import_datamanager'
+                for problem in check_import(result)]
+
+    for problem in problems:
+        print(problem)
+
+    if compare is not None:
+        regressions = compare_results(compare, results)
+
+        if len(regressions) > 0:
+            raise SystemExit(1)
+
+    if len(problems) > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import closing
+
+logger = logging.getLogger()
+
+# SQLite limits the number of parameters in a single query, so lookups are split into groups of this size
+QUERY_CHUNK = 500
+
+
+def make_cache_path(file_name: str) -> str:
+    """
+    Generates the path to a cache file in the cache directory, creating the directory if needed
+    :param file_name: The name of the cache file
+    :return: The path to the cache file as a string
+    """
+
+    cache_dir = os.getcwd() + '/cache/'
+
+    if os.path.exists(cache_dir) is False:
+        try:
+            os.mkdir(cache_dir)
+        except IOError:
+            print('Could not create directory: ' + cache_dir)
+            logger.warning(f'Could not create cache directory {cache_dir}!')
+
+    return cache_dir + file_name
+
+
+class TagCache:
+    """
+    On-disk cache of tagged tweet tokens. Entries are keyed by a hash of the tweet's text and the tagger version, so
+    the same text is only ever tagged once per tagger.
+    """
+
+    def __init__(self, tagger_version: str, path=''):
+        self.tagger_version = tagger_version
+        self.path = path if path != '' else make_cache_path('tag_cache.sqlite')
+        self.hits = 0
+        self.misses = 0
+
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS tagged_tweets (text_hash TEXT NOT NULL, '
+                         'tagger_version TEXT NOT NULL, tokens TEXT NOT NULL, '
+                         'PRIMARY KEY (text_hash, tagger_version))')
+            conn.commit()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        """
+        Hashes the text of a tweet into a cache key
+        :param text: The text of the tweet
+        :return: The SHA-1 hex digest of the text
+        """
+
+        return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+
+    def get_many(self, tweets: [str]) -> dict:
+        """
+        Looks up the tagged tokens of several tweets at once
+        :param tweets: The text of the tweets to look up
+        :return: A dictionary mapping the text of every cached tweet to its list of (word, tag) pairs
+        """
+
+        keys = {self.make_key(text): text for text in tweets}
+        key_list = list(keys.keys())
+        found = {}
+
+        with closing(sqlite3.connect(self.path)) as conn:
+            for start in range(0, len(key_list), QUERY_CHUNK):
+                chunk = key_list[start:start + QUERY_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(f'SELECT text_hash, tokens FROM tagged_tweets WHERE tagger_version = ? '
+                                    f'AND text_hash IN ({placeholders})', [self.tagger_version] + chunk)
+
+                for text_hash, tokens in rows:
+                    found[keys[text_hash]] = [tuple(pair) for pair in json.loads(tokens)]
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+
+        return found
+
+    def put_many(self, tagged: dict):
+        """
+        Stores the tagged tokens of several tweets
+        :param tagged: A dictionary mapping the text of each tweet to its list of (word, tag) pairs
+        """
+
+        rows = [(self.make_key(text), self.tagger_version, json.dumps(tokens)) for text, tokens in tagged.items()]
+
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.executemany('INSERT OR REPLACE INTO tagged_tweets VALUES (?, ?, ?)', rows)
+            conn.commit()
+
+
+# The fields of a user that are kept in the user cache
+CachedUser = namedtuple('CachedUser', ['id', 'screen_name', 'protected'])
+
+
+class UserCache:
+    """
+    Cache of user profiles keyed by both numeric ID and lowercased screen name. Recently used profiles are kept in
+    memory, and if a path is given, profiles are also stored on disk and expire after ttl seconds.
+    """
+
+    def __init__(self, max_size=4096, ttl=24 * 60 * 60, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.path is not None:
+            with closing(sqlite3.connect(self.path)) as conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS users (user_key TEXT PRIMARY KEY, id INTEGER NOT NULL, '
+                             'screen_name TEXT NOT NULL, protected INTEGER NOT NULL, cached_at REAL NOT NULL)')
+                conn.execute('DELETE FROM users WHERE cached_at < ?', (time.time() - self.ttl,))
+                conn.commit()
+
+    @staticmethod
+    def make_key(identifier) -> str:
+        """
+        Turns a user identifier into a cache key. Integers and all-digit strings, such as an ID typed at a prompt, are
+        treated as IDs and other strings as screen names
+        :param identifier: A user ID or screen name
+        :return: The cache key
+        """
+
+        if isinstance(identifier, int) or str(identifier).isdigit():
+            return f'id:{int(identifier)}'
+
+        return UserCache.make_name_key(identifier)
+
+    @staticmethod
+    def make_name_key(screen_name: str) -> str:
+        """
+        Turns a screen name into a cache key, even if it is all digits
+        :param screen_name: The screen name
+        :return: The cache key
+        """
+
+        return f'name:{str(screen_name).lower()}'
+
+    def get(self, identifier):
+        """
+        Looks up a user, first in memory and then on disk
+        :param identifier: A user ID or screen name
+        :return: The CachedUser, or None if the user is not cached or has expired
+        """
+
+        key = self.make_key(identifier)
+        user = None
+
+        with self._lock:
+            if key in self._memory:
+                user, cached_at = self._memory[key]
+
+                if time.time() - cached_at > self.ttl:
+                    user = None
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+
+        if user is None and self.path is not None:
+            with closing(sqlite3.connect(self.path)) as conn:
+                row = conn.execute('SELECT id, screen_name, protected, cached_at FROM users WHERE user_key = ? '
+                                   'AND cached_at >= ?', (key, time.time() - self.ttl)).fetchone()
+
+            if row is not None:
+                user = CachedUser(row[0], row[1], bool(row[2]))
+                self._remember(user, row[3])
+
+        with self._lock:
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return user
+
+    def put(self, user) -> CachedUser:
+        """
+        Caches a user under both its ID and its screen name
+        :param user: A tweepy User or a CachedUser
+        :return: The CachedUser that was stored
+        """
+
+        return self.put_many([user])[0]
+
+    def put_many(self, users: []) -> [CachedUser]:
+        """
+        Caches several users at once, writing them to disk in a single transaction
+        :param users: A list of tweepy Users or CachedUsers
+        :return: The CachedUsers that were stored, in the same order as users
+        """
+
+        cached_users = [CachedUser(int(user.id), str(user.screen_name), bool(user.protected)) for user in users]
+        cached_at = time.time()
+
+        for cached in cached_users:
+            self._remember(cached, cached_at)
+
+        if self.path is not None and len(cached_users) > 0:
+            rows = [(key, cached.id, cached.screen_name, int(cached.protected), cached_at)
+                    for cached in cached_users
+                    for key in (self.make_key(cached.id), self.make_name_key(cached.screen_name))]
+
+            with closing(sqlite3.connect(self.path)) as conn:
+                conn.executemany('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)', rows)
+                conn.commit()
+
+        return cached_users
+
+    def _remember(self, user: CachedUser, cached_at: float):
+        """
+        Adds a user to the in-memory layer, dropping the least recently used users if it is full
+        :param user: The user to add
+        :param cached_at: When the user was fetched, as a UNIX timestamp
+        """
+
+        with self._lock:
+            for key in (self.make_key(user.id), self.make_name_key(user.screen_name)):
+                self._memory[key] = (user, cached_at)
+                self._memory.move_to_end(key)
+
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def log_stats(self):
+        """
+        Writes the cache's hit and miss counts to the log
+        """
+
+        lookups = self.hits + self.misses
+
+        if lookups > 0:
+            logger.info(f'User cache: {self.hits} hits, {self.misses} misses '
+                        f'({round(100 * self.hits / lookups, 1)}% hit rate)')
+
+
+class SummaryCache:
+    """
+    On-disk cache of the summary statistics of saved tweet files. Entries are keyed by the file's path and are only
+    used while the file's modification time and size are unchanged, so a file is only ever summarized once per save.
+    """
+
+    def __init__(self, path=''):
+        self.path = path if path != '' else make_cache_path('summary_cache.sqlite')
+        self.hits = 0
+        self.misses = 0
+
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS summaries (file_name TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, '
+                         'size INTEGER NOT NULL, stats TEXT NOT NULL)')
+            conn.commit()
+
+    @staticmethod
+    def make_key(file_name: str, subset='') -> tuple:
+        """
+        Identifies the current version of a saved file
+        :param file_name: The path of the file
+        :param subset: Names the part of the file that was summarized. Default is '' (The whole file)
+        :return: A tuple of the absolute path (Followed by #subset if given), modification time in nanoseconds, and
+        size in bytes
+        """
+
+        file_stat = os.stat(file_name)
+        path = os.path.abspath(file_name) + (f'#{subset}' if subset != '' else '')
+
+        return path, file_stat.st_mtime_ns, file_stat.st_size
+
+    def get(self, file_name: str, subset=''):
+        """
+        Looks up the summary of a saved file
+        :param file_name: The path of the file
+        :param subset: Names the part of the file that was summarized. Default is '' (The whole file)
+        :return: A dictionary of the summary statistics, or None if the file was never summarized or has changed since
+        """
+
+        path, mtime_ns, size = self.make_key(file_name, subset)
+
+        with closing(sqlite3.connect(self.path)) as conn:
+            row = conn.execute('SELECT stats FROM summaries WHERE file_name = ? AND mtime_ns = ? AND size = ?',
+                               (path, mtime_ns, size)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, file_name: str, stats: dict, subset=''):
+        """
+        Stores the summary of a saved file, replacing the summary of any earlier version of it
+        :param file_name: The path of the file
+        :param stats: A dictionary of the summary statistics
+        :param subset: Names the part of the file that was summarized. Default is '' (The whole file)
+        """
+
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)',
+                         self.make_key(file_name, subset) + (json.dumps(stats),))
+            conn.commit()
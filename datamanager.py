@@ -1,21 +1,81 @@
+import heapq
+import importlib.util
+import itertools
+import json
+import logging
 import os
+import sqlite3
+import time
+from collections import Counter, namedtuple
+from importlib.metadata import version
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-import nltk
 import pandas as pd
-from nltk.tokenize.casual import TweetTokenizer
+import tweepy as tw
 
-import tweetplot
+import cachemanager
+import metricsmanager
+import ratemanager
+import sessionmanager
+import statsmanager
+import storemanager
+import timemanager
 
-tw = tweetplot.tw
-api = tweetplot.api
-logger = tweetplot.logger
+logger = logging.getLogger()
 
+# The most user IDs that can be resolved by one users/lookup request
+LOOKUP_BATCH_SIZE = 100
 
-def make_file_name_for_search(search: str, type='tweets') -> str:
+# The API error code of a users/lookup request where none of the IDs belong to an account
+NO_USER_MATCHES = 17
+
+# How many timelines search_network requests at the same time
+NETWORK_THREADS = 8
+
+# How long cached user profiles are trusted, in seconds
+USER_CACHE_TTL = 24 * 60 * 60
+
+# Twitter only returns about this many of the most recent tweets of a user's timeline
+HISTORY_LIMIT = 3200
+
+# How many tweets are held in memory at a time when streaming a user's history
+CHUNK_SIZE = 200
+
+# File extension used for each format tweets can be stored in
+STORAGE_FORMATS = {'csv': 'csv', 'parquet': 'parquet', 'feather': 'feather'}
+
+# Format for saved tweet datasets. Set TTVIZ_STORAGE to parquet or feather for large datasets
+storage_format = os.getenv('TTVIZ_STORAGE', 'csv')
+
+# Column types of saved tweet datasets. tweet_times is parsed separately into naive UTC datetimes
+TWEET_DTYPES = {'tweet_ID': 'int64', 'favorites': 'int64', 'retweets': 'int64', 'screen_name': 'category'}
+
+# Should saved tweets also be added to the shared tweet store? Set TTVIZ_TWEET_STORE to 0 to only write search files
+use_tweet_store = os.getenv('TTVIZ_TWEET_STORE', '1') != '0'
+
+# Tag of the stored tweets that came from fetching a user's timeline from the newest tweet back. Only these are complete
+# enough for a first sync to treat as the user's history
+TIMELINE_TAG = 'timeline:{}'
+
+# Tag prefixes for each part of speech accepted by select_pos_words
+POS_PREFIXES = {'noun': ('NN',), 'adj': ('JJ',), 'both': ('JJ', 'NN')}
+
+# Identifies the tagger in the tag cache. Entries made by a different NLTK version are not reused
+TAGGER_VERSION = f'nltk-{version("nltk")}-perceptron'
+
+_tagger = None
+_tag_cache = None
+_user_cache = None
+_summary_cache = None
+_tweet_store = None
+
+
+def make_file_name_for_search(search: str, type='tweets', extension='csv') -> str:
     """
     Generates a file name in the search_terms_type.csv format
     :param search: The name of the query. Can also be the desired name of the file
     :param type: The type of data in this search. Is appended as _type to the end of the file.
+    :param extension: The file extension without the leading dot. Default is csv
     :return: The path to the file as a string
     """
 
@@ -38,9 +98,9 @@ def make_file_name_for_search(search: str, type='tweets') -> str:
                         save_file = search_dir + word.lower()
                     else:
                         save_file = save_file + f'_{word.lower()}'
-                save_file = save_file + '_{0}.csv'.format(type)
+                save_file = save_file + '_{0}.{1}'.format(type, extension)
             else:
-                save_file = '{0}_{1}.csv'.format(search.lower(), type)
+                save_file = '{0}_{1}.{2}'.format(search.lower(), type, extension)
 
     else:
         if len(search.split(' ')) >= 2:
@@ -49,9 +109,9 @@ def make_file_name_for_search(search: str, type='tweets') -> str:
                     save_file = search_dir + word.lower()
                 else:
                     save_file = save_file + f'_{word.lower()}'
-            save_file = save_file + '_{0}.csv'.format(type)
+            save_file = save_file + '_{0}.{1}'.format(type, extension)
         else:
-            save_file = search_dir + '{0}_{1}.csv'.format(search.lower(), type)
+            save_file = search_dir + '{0}_{1}.{2}'.format(search.lower(), type, extension)
 
     return save_file
 
@@ -63,21 +123,66 @@ def search_tweets_for_query(query: str, limit=100):
     :param limit: How many tweets should be searched
     :return: An array of tweets generated from the query
     """
-    tweets = tw.Cursor(api.search, q=query + ' -filter:retweets', lang='en', result_type='mixed',
-                       tweet_mode='extended').items(limit)
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+    tweets = tw.Cursor(scheduler.wrap('/search/tweets', api.search), q=query + ' -filter:retweets', lang='en',
+                       result_type='mixed', tweet_mode='extended').items(limit)
 
     ret_list = [tweet for tweet in tweets]
+    metricsmanager.add_items('fetch', len(ret_list))
 
     return ret_list
 
 
-def save_tweets(save_name: str, to_save=[]):
+def get_storage_format(storage=None) -> str:
     """
-    Saves tweets to a CSV file named after their topic
-    :param save_name: The name of the file to be saved
-    :param do_search: Whether or not this function should search twitter first. Default is True
-    :param to_save: An array of tweets to save if do_search is False.
-    :return:
+    Decides which file format tweet datasets are stored in. Parquet and Feather need pyarrow, so CSV is used instead if
+    it is not installed.
+    :param storage: The requested format. Valid inputs are csv, parquet, or feather. Defaults to TTVIZ_STORAGE
+    :return: The storage format to use
+    """
+
+    if storage is None:
+        storage = storage_format
+
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f'Unknown storage format {storage}! Valid inputs are {", ".join(STORAGE_FORMATS)}')
+
+    # Only whether pyarrow is installed matters here, so it is not imported until a file is written
+    if storage != 'csv' and importlib.util.find_spec('pyarrow') is None:
+        print(f'pyarrow is not installed, so tweets cannot be stored as {storage}! Using csv instead')
+        logger.warning(f'pyarrow is not installed! Falling back to csv storage instead of {storage}')
+        storage = 'csv'
+
+    return storage
+
+
+def type_tweet_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Applies the column types of a saved tweet dataset to whichever of its columns are present in the frame
+    :param frame: A dataframe of tweets, such as one loaded from a file
+    :return: The dataframe with typed columns
+    """
+
+    frame = frame.drop(columns=[column for column in frame.columns if str(column).startswith('Unnamed')])
+
+    for column, dtype in TWEET_DTYPES.items():
+        if column in frame.columns:
+            frame[column] = frame[column].astype(dtype)
+
+    if 'tweet_times' in frame.columns:
+        # Times are parsed as naive UTC in one place, so saves with mixed UTC offsets can still be loaded
+        frame['tweet_times'] = timemanager.parse_tweet_times(frame['tweet_times'])
+
+    return frame
+
+
+def tweets_to_frame(tweets: []) -> pd.DataFrame:
+    """
+    Builds a typed dataframe out of tweets
+    :param tweets: An array of tweets
+    :return: A dataframe with the columns tweet_ID, text, favorites, retweets, screen_name, and tweet_times
     """
 
     tweet_text = []
@@ -86,10 +191,12 @@ def save_tweets(save_name: str, to_save=[]):
     tweet_retweets = []
     tweet_screen_names = []
     tweet_times = []
-    save_file = make_file_name_for_search(save_name)
 
-    for tweet in to_save:
-        tweet_text.append(tweet.full_text)
+    for tweet in tweets:
+        if hasattr(tweet, 'full_text'):
+            tweet_text.append(tweet.full_text)
+        else:
+            tweet_text.append(tweet.text)
         tweet_ids.append(tweet.id)
         tweet_favorites.append(int(tweet.favorite_count))
         tweet_retweets.append(int(tweet.retweet_count))
@@ -99,48 +206,417 @@ def save_tweets(save_name: str, to_save=[]):
     tweet_frame = pd.DataFrame(data={'tweet_ID': tweet_ids, 'text': tweet_text, 'favorites': tweet_favorites,
                                      'retweets': tweet_retweets, 'screen_name': tweet_screen_names,
                                      'tweet_times': tweet_times})
+
+    return type_tweet_frame(tweet_frame)
+
+
+def csv_columns_match(file_name: str, columns: []) -> bool:
+    """
+    Checks whether a CSV file has exactly the given columns, in the same order, so rows can be appended to it
+    :param file_name: The path of the CSV file
+    :param columns: The columns of the rows to append
+    :return: True if the header of the file matches the columns, False otherwise
+    """
+
+    try:
+        return list(pd.read_csv(file_name, nrows=0).columns) == [str(column) for column in columns]
+    except (IOError, pd.errors.EmptyDataError):
+        return False
+
+
+def write_tweet_frame(frame: pd.DataFrame, file_name: str, storage='csv', append=False):
+    """
+    Writes a dataframe of tweets to a file in the given storage format
+    :param frame: The dataframe of tweets to write
+    :param file_name: The path of the file to write
+    :param storage: The storage format. Valid inputs are csv, parquet, or feather. Default is csv
+    :param append: Should the tweets be added to the file's existing tweets? Default is False
+    """
+
+    appending = append and os.path.exists(file_name)
+    stats = load_interaction_stats(file_name) if appending else statsmanager.InteractionStats()
+
+    with metricsmanager.start_stage('save', items=len(frame)):
+        if stats is not None:
+            # Only the new rows are added to the running statistics
+            stats.update(frame)
+
+        if appending and storage == 'csv' and csv_columns_match(file_name, frame.columns):
+            frame.to_csv(file_name, mode='a', header=False, index=False)
+        else:
+            if appending:
+                # Parquet and Feather files cannot be extended in place, and rows appended to a CSV file with other
+                # columns (Such as the index column of older saves) would be misaligned, so the file is rewritten
+                saved_frame = get_dataframe_from_file(file_name)
+
+                if saved_frame is None:
+                    raise IOError(f'Could not load the saved tweets in {file_name}, so no tweets were appended')
+
+                frame = type_tweet_frame(pd.concat([saved_frame, frame], ignore_index=True))
+
+            if storage == 'parquet':
+                frame.to_parquet(file_name, index=False)
+            elif storage == 'feather':
+                frame.reset_index(drop=True).to_feather(file_name)
+            else:
+                frame.to_csv(file_name, index=False)
+
+        if stats is None:
+            # The saved statistics were missing or out of date, so they are rebuilt from the whole file
+            saved_frame = get_dataframe_from_file(file_name, columns=statsmanager.INTERACTION_COLUMNS)
+
+            if saved_frame is None:
+                return
+
+            stats = statsmanager.InteractionStats().update(saved_frame)
+
+        save_interaction_stats(file_name, stats)
+
+
+def make_stats_file_name(file_name: str) -> str:
+    """
+    Generates the path of the file holding the running interaction statistics of a saved tweet dataset
+    :param file_name: The path of the tweet dataset
+    :return: The path of its statistics file, next to the dataset
+    """
+
+    return os.path.splitext(file_name)[0] + '_stats.json'
+
+
+def load_interaction_stats(file_name: str):
+    """
+    Loads the running interaction statistics of a saved tweet dataset
+    :param file_name: The path of the tweet dataset
+    :return: The InteractionStats, or None if there are none or the dataset was changed without updating them
+    """
+
+    stats_file = make_stats_file_name(file_name)
+
+    if os.path.exists(stats_file) is False or os.path.exists(file_name) is False:
+        return None
+
+    try:
+        with open(stats_file) as file:
+            state = json.load(file)
+    except (IOError, ValueError) as error:
+        print(f'Could not read interaction statistics for {file_name} because {error}')
+        logger.warning(f'Could not read interaction statistics file {stats_file}! They will be rebuilt')
+        return None
+
+    file_stat = os.stat(file_name)
+
+    if state.get('mtime_ns') != file_stat.st_mtime_ns or state.get('size') != file_stat.st_size:
+        logger.info(f'{file_name} changed since its interaction statistics were saved')
+        return None
+
+    return statsmanager.InteractionStats.from_dict(state['stats'])
+
+
+def save_interaction_stats(file_name: str, stats: statsmanager.InteractionStats):
+    """
+    Saves the running interaction statistics of a tweet dataset. Must be called after the dataset is written, since
+    the statistics are only trusted while the dataset is unchanged
+    :param file_name: The path of the tweet dataset
+    :param stats: The dataset's InteractionStats
+    """
+
+    stats_file = make_stats_file_name(file_name)
+    file_stat = os.stat(file_name)
+
+    try:
+        with open(stats_file, 'w') as file:
+            json.dump({'mtime_ns': file_stat.st_mtime_ns, 'size': file_stat.st_size, 'stats': stats.to_dict()}, file)
+    except IOError as error:
+        print(f'Could not save interaction statistics because {error}')
+        logger.error(f'Could not save interaction statistics to {stats_file} because {error}')
+
+
+class TweetFileWriter:
+    """
+    Writes a tweet dataset one chunk at a time. CSV chunks are appended to the file and Parquet and Feather chunks are
+    streamed into the file as row groups/record batches, so the whole dataset never has to be in memory. The file is
+    replaced by the first chunk and is complete once close() is called, which also saves the file's running
+    interaction statistics.
+    """
+
+    def __init__(self, file_name: str, storage='csv'):
+        self.file_name = file_name
+        self.storage = storage
+        self.rows = 0
+        self.stats = statsmanager.InteractionStats()
+        self._writer = None
+
+    def write(self, frame: pd.DataFrame):
+        """
+        Writes a chunk of tweets to the file
+        :param frame: A typed dataframe of tweets [See datamanager.tweets_to_frame()]
+        """
+
+        if frame.empty:
+            return
+
+        with metricsmanager.start_stage('save', items=len(frame)):
+            if self.storage == 'csv':
+                frame.to_csv(self.file_name, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+            else:
+                import pyarrow as pa
+
+                # Every chunk has its own categories, so screen names are written as plain strings to keep one schema
+                table = pa.Table.from_pandas(frame.astype({'screen_name': 'str'}), preserve_index=False)
+
+                if self._writer is None:
+                    if self.storage == 'parquet':
+                        from pyarrow import parquet
+
+                        self._writer = parquet.ParquetWriter(self.file_name, table.schema)
+                    else:
+                        self._writer = pa.ipc.new_file(self.file_name, table.schema)
+
+                self._writer.write_table(table)
+
+            self.stats.update(frame)
+
+        self.rows += len(frame)
+
+    def close(self):
+        """
+        Finishes the file
+        """
+
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+        if self.rows > 0:
+            save_interaction_stats(self.file_name, self.stats)
+
+
+def save_tweets(save_name: str, to_save=[], storage=None, append=False) -> str:
+    """
+    Saves tweets to a file named after their topic
+    :param save_name: The name of the file to be saved
+    :param to_save: An array of tweets to save
+    :param storage: The storage format. Valid inputs are csv, parquet, or feather. Defaults to TTVIZ_STORAGE
+    :param append: Should the tweets be added to an existing save instead of replacing it? Default is False
+    :return: The path to the saved file
+    """
+
+    storage = get_storage_format(storage)
+    save_file = make_file_name_for_search(save_name, extension=STORAGE_FORMATS[storage])
+    tweet_frame = tweets_to_frame(to_save)
+
     print(tweet_frame)
-    tweet_frame.to_csv(save_file)
+    write_tweet_frame(tweet_frame, save_file, storage=storage, append=append)
+    store_tweets(tweet_frame, tag=save_name)
+
+    return save_file
+
+
+def store_tweets(frame: pd.DataFrame, tag=None) -> int:
+    """
+    Adds tweets to the shared tweet store, unless it is turned off with TTVIZ_TWEET_STORE. The search files are still
+    the main copy of the tweets, so errors are logged instead of raised
+    :param frame: A dataframe of tweets [See tweets_to_frame()]
+    :param tag: The name of the search that found the tweets, or a list of names. Default is None (No tag)
+    :return: How many tweets were added or updated
+    """
+
+    if use_tweet_store is False or len(frame) == 0:
+        return 0
+
+    try:
+        with metricsmanager.start_stage('save', items=len(frame)):
+            return get_tweet_store().upsert(frame, tag=tag)
+    except sqlite3.Error as error:
+        logger.error(f'Could not add {len(frame)} tweets to the tweet store because {error}')
+        return 0
+
+
+def query_tweet_store(screen_name=None, tag=None, since=None, until=None, columns=None, limit=None) -> pd.DataFrame:
+    """
+    Loads tweets from the shared tweet store with an indexed query instead of reading search files
+    :param screen_name: Only tweets by this user. Not case sensitive. Default is None (Any user)
+    :param tag: Only tweets found by this search, such as a topic or username. Default is None (Any search)
+    :param since: Only tweets posted at or after this time. Default is None
+    :param until: Only tweets posted before this time. Default is None
+    :param columns: Optional list of columns to load. Default is None (All columns)
+    :param limit: The most tweets to load, newest first. Default is None (No limit)
+    :return: A typed dataframe of the matching tweets, newest first
+    """
+
+    with metricsmanager.start_stage('load') as timer:
+        frame = type_tweet_frame(get_tweet_store().query(screen_name=screen_name, tag=tag, since=since, until=until,
+                                                         columns=columns, limit=limit))
+        timer.add(len(frame))
+
+    return frame
+
+
+def export_tweets_csv(save_name: str, storage=None) -> str:
+    """
+    Exports a saved tweet dataset to a CSV file for use in other software
+    :param save_name: The name the tweets were saved under
+    :param storage: The format the tweets were saved in. Defaults to TTVIZ_STORAGE
+    :return: The path to the CSV file
+    """
+
+    storage = get_storage_format(storage)
+    csv_file = make_file_name_for_search(save_name)
+
+    if storage != 'csv':
+        load_tweet_frame(save_name, storage=storage).to_csv(csv_file, index=False)
+
+    return csv_file
 
 
-def load_tweet_text(topic: str, from_file=True, frame=pd.DataFrame) -> [str]:
+def load_tweet_frame(save_name: str, columns=None, storage=None) -> pd.DataFrame:
     """
-    Loads tweets from CSV and returns an array of the tweets' text
-    :param topic: Name of the file without .csv
+    Loads a saved tweet dataset
+    :param save_name: The name the tweets were saved under
+    :param columns: Optional list of columns to load. Other columns are not read. Default is None (All columns)
+    :param storage: The format the tweets were saved in. Defaults to TTVIZ_STORAGE
+    :return: A typed dataframe of the saved tweets
+    """
+
+    storage = get_storage_format(storage)
+
+    return get_dataframe_from_file(make_file_name_for_search(save_name, extension=STORAGE_FORMATS[storage]),
+                                   columns=columns)
+
+
+def select_own_tweets(frame: pd.DataFrame, username: str) -> pd.DataFrame:
+    """
+    Keeps the tweets a user posted themselves. A user's saved tweets can also hold their retweets and the tweets they
+    liked, such as the ones saved by stream_user_tweets()
+    :param frame: A dataframe of tweets with screen_name and text columns
+    :param username: The screen name of the user. Not case sensitive
+    :return: The tweets written by the user that are not retweets
+    """
+
+    own = frame['screen_name'].astype(str).str.lower() == str(username).lower()
+    own &= ~frame['text'].astype(str).str.startswith('RT')
+
+    return frame[own]
+
+
+def get_interaction_summary(save_name: str, storage=None, user=None):
+    """
+    Gets the summary statistics of the favorites and retweets of a saved tweet dataset. The running statistics saved
+    with the dataset are used when they are up to date. Otherwise the file is summarized once and cached until it
+    changes
+    :param save_name: The name the tweets were saved under
+    :param storage: The format the tweets were saved in. Defaults to TTVIZ_STORAGE
+    :param user: Only summarize the tweets this user posted themselves [See select_own_tweets()]. Default is None
+    (Every saved tweet)
+    :return: A dictionary of the summary statistics [See statsmanager.summarize_interactions()], or None if no tweets
+    are saved under save_name
+    """
+
+    storage = get_storage_format(storage)
+    save_file = make_file_name_for_search(save_name, extension=STORAGE_FORMATS[storage])
+
+    if os.path.exists(save_file) is False:
+        return None
+
+    # The running statistics cover every saved tweet, so they cannot be used for one user's own tweets
+    stats = load_interaction_stats(save_file) if user is None else None
+
+    if stats is not None:
+        return stats.summary()
+
+    # Datasets saved without running statistics, or changed outside of ttViz, are summarized from the file
+    summary_cache = get_summary_cache()
+    subset = f'own:{str(user).lower()}' if user is not None else ''
+    summary = summary_cache.get(save_file, subset=subset)
+
+    if summary is None:
+        columns = statsmanager.INTERACTION_COLUMNS + (['screen_name', 'text'] if user is not None else [])
+        frame = get_dataframe_from_file(save_file, columns=columns)
+
+        if frame is None:
+            return None
+
+        if user is not None:
+            frame = select_own_tweets(frame, user)
+
+            if len(frame) == 0:
+                return None
+
+        summary = statsmanager.summarize_interactions(frame).iloc[0].to_dict()
+        summary_cache.put(save_file, summary, subset=subset)
+
+    return summary
+
+
+def load_interaction_summaries(save_names: [str], storage=None, own_tweets=False) -> pd.DataFrame:
+    """
+    Gets the summary statistics of several saved tweet datasets for statsmanager.welch_pairwise()
+    :param save_names: The names the tweets were saved under, such as usernames
+    :param storage: The format the tweets were saved in. Defaults to TTVIZ_STORAGE
+    :param own_tweets: Are the save names usernames whose own tweets should be summarized, leaving out their retweets
+    and liked tweets? Default is False
+    :return: A dataframe of summary statistics indexed by save name. Names with no saved tweets are left out
+    """
+
+    summaries = {}
+
+    for save_name in save_names:
+        summary = get_interaction_summary(save_name, storage=storage, user=save_name if own_tweets else None)
+
+        if summary is None:
+            print(f'No saved tweets for {save_name}!')
+            logger.warning(f'Could not summarize {save_name} because no tweets are saved under that name')
+        else:
+            summaries[save_name] = summary
+
+    return pd.DataFrame.from_dict(summaries, orient='index')
+
+
+def load_tweet_text(topic: str, from_file=True, frame=pd.DataFrame, storage=None) -> [str]:
+    """
+    Loads tweets from a saved dataset and returns an array of the tweets' text
+    :param topic: Name of the file without its extension
     :param from_file: Whether the tweets should be loaded from a file. Default True
     :param frame: The dataframe to load the tweets from if from_file is False
+    :param storage: The format the tweets were saved in. Defaults to TTVIZ_STORAGE
     :return: An array of the tweet's text as a string
     """
 
-    tweet_text = []
-    file_name = make_file_name_for_search(topic)
-
     if from_file:
-        tweet_frame = get_dataframe_from_file(file_name)
+        # Only the text column is read from the file
+        frame = load_tweet_frame(topic, columns=['text'], storage=storage)
 
-        for text in tweet_frame.text:
-            tweet_text.append(text)
-    else:
-        for text in frame.text:
-            tweet_text.append(text)
+    return frame.text.tolist() if frame is not None else []
 
-    return tweet_text
 
-
-def get_dataframe_from_file(file_name: str) -> pd.DataFrame:
+def get_dataframe_from_file(file_name: str, columns=None) -> pd.DataFrame:
     """
-    Tries to create a pandas dataframe from a CSV file path.
+    Tries to create a pandas dataframe from a CSV, Parquet, or Feather file path.
     :param file_name: The path of the file to be loaded.
-    :return: A pandas dataframe containing the information in the CSV file
+    :param columns: Optional list of columns to load. Default is None (All columns)
+    :return: A pandas dataframe containing the information in the file, or None if it could not be loaded
     """
 
     ret_frame = None
 
-    try:
-        ret_frame = pd.read_csv(file_name)
-    except IOError as error:
-        print(f'An error occured loading dataframe with name: {file_name}! (Wrong name?)')
-        print(error)
+    with metricsmanager.start_stage('load') as timer:
+        try:
+            if file_name.endswith('.parquet'):
+                ret_frame = pd.read_parquet(file_name, columns=columns, memory_map=True)
+            elif file_name.endswith('.feather'):
+                from pyarrow import feather
+
+                ret_frame = feather.read_table(file_name, columns=columns, memory_map=True).to_pandas()
+            else:
+                ret_frame = pd.read_csv(file_name, usecols=columns)
+
+            ret_frame = type_tweet_frame(ret_frame)
+            timer.add(len(ret_frame))
+        except (IOError, ValueError) as error:
+            # ValueError covers missing columns and values that cannot be parsed or cast, such as NaN in an int column
+            print(f'An error occured loading dataframe with name: {file_name}! (Wrong name?)')
+            print(error)
+            ret_frame = None
 
     return ret_frame
 
@@ -153,58 +629,372 @@ def get_tweets_for_user(username: str, filter_retweets=True) -> []:
     :return: An array of the tweets appearing on the user's profile
     """
 
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+
     user = None
     tweets = []
 
     try:
-        user = api.get_user(username)
+        user = get_user(username, priority=ratemanager.PRIORITY_HIGH)
     except tw.TweepError as error:
         print(f'Could not find user with username: {username} because {error.reason}')
         print(error.api_code)
-        tweetplot.repeat_menu()
+        raise
 
     if user.protected is not True:
         if filter_retweets:
-            for tweet in api.user_timeline(user.id, count=100, tweet_mode='extended'):
+            for tweet in scheduler.call('/statuses/user_timeline', api.user_timeline, user.id, count=100,
+                                        tweet_mode='extended'):
                 if str(tweet.full_text).startswith('RT') is False:
                     tweets.append(tweet)
 
             return tweets
         else:
-            return api.user_timeline(user.id, count=100)
+            return scheduler.call('/statuses/user_timeline', api.user_timeline, user.id, count=100)
     else:
         print(f'{username} has a private account!')
         logger.info(f'{username} has a private account! Data will not be gathered from this account!')
         return 'PRIVATE'
 
 
-def build_frequency_frame(data: []) -> pd.DataFrame:
+def load_since_id(username: str, save_file: str):
     """
-    Assembles a pandas dataframe out of the frequency of specific words.
-    :param data: A list of words
-    :return: A dataframe with columns 'word' and 'freq' containg the word and its frequency
+    Loads the ID of the newest tweet saved by the last sync of a user. The ID is only trusted while the user's saved
+    tweets are exactly as the sync left them, since other searches of the user rewrite the same file
+    :param username: The screen name the user's tweets are saved under
+    :param save_file: The path of the user's saved tweets
+    :return: The ID as an int, or None if the user has not been synced before or the saved tweets changed since
+    """
+
+    sync_file = make_file_name_for_search(username, type='sync', extension='json')
+
+    if os.path.exists(sync_file) is False or os.path.exists(save_file) is False:
+        return None
+
+    try:
+        with open(sync_file) as file:
+            state = json.load(file)
+    except (IOError, ValueError) as error:
+        print(f'Could not read sync state for {username} because {error}')
+        logger.warning(f'Could not read sync state file {sync_file}! The next sync will start from scratch')
+        return None
+
+    file_stat = os.stat(save_file)
+
+    if state.get('mtime_ns') != file_stat.st_mtime_ns or state.get('size') != file_stat.st_size:
+        logger.info(f'{save_file} changed since {username} was last synced! The next sync will start from scratch')
+        return None
+
+    return state.get('since_id')
+
+
+def save_since_id(username: str, since_id: int, save_file: str):
+    """
+    Saves the ID of the newest tweet saved for a user so the next sync only fetches newer tweets. The modification time
+    and size of the saved tweets are kept with it, so a later rewrite of the file by another search is noticed
+    :param username: The screen name the user's tweets are saved under
+    :param since_id: The ID of the newest saved tweet
+    :param save_file: The path of the user's saved tweets, which must already be written
+    """
+
+    sync_file = make_file_name_for_search(username, type='sync', extension='json')
+    file_stat = os.stat(save_file)
+
+    with open(sync_file, 'w') as file:
+        json.dump({'since_id': int(since_id), 'synced_at': time.time(), 'mtime_ns': file_stat.st_mtime_ns,
+                   'size': file_stat.st_size}, file)
+
+
+def refresh_interactions(frame: pd.DataFrame, tweet_ids: []) -> pd.DataFrame:
+    """
+    Updates the favorite and retweet counts of some tweets in a frame by looking them up 100 at a time
+    :param frame: A dataframe of tweets with tweet_ID, favorites, and retweets columns
+    :param tweet_ids: The IDs of the tweets to update
+    :return: The dataframe with updated counts. Tweets that could not be found keep their old counts
+    """
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+
+    favorites = {}
+    retweets = {}
+
+    for start in range(0, len(tweet_ids), LOOKUP_BATCH_SIZE):
+        batch = [int(tweet_id) for tweet_id in tweet_ids[start:start + LOOKUP_BATCH_SIZE]]
+
+        try:
+            for tweet in scheduler.call('/statuses/lookup', api.statuses_lookup, batch):
+                favorites[tweet.id] = int(tweet.favorite_count)
+                retweets[tweet.id] = int(tweet.retweet_count)
+        except tw.TweepError as error:
+            print(f'Could not refresh the counts of {len(batch)} tweets because {error.reason}')
+            logger.warning(f'Could not refresh the counts of {len(batch)} tweets. Error code: {error.api_code}')
+
+    found = frame['tweet_ID'].isin(list(favorites.keys()))
+    frame.loc[found, 'favorites'] = frame.loc[found, 'tweet_ID'].map(favorites)
+    frame.loc[found, 'retweets'] = frame.loc[found, 'tweet_ID'].map(retweets)
+
+    return frame
+
+
+def sync_user_tweets(username: str, filter_retweets=True, refresh=100, limit=100, storage=None):
     """
+    Adds a user's new tweets to their saved tweets. Only tweets newer than the last sync are fetched, and the counts of
+    the most recent saved tweets are refreshed. If the user's timeline was already fetched by a stream or sync, the
+    first sync reuses those tweets from the tweet store and only fetches newer ones. Otherwise it fetches the user's
+    latest tweets and adds any tweets of theirs that other searches stored.
+    :param username: The screen name of the user
+    :param filter_retweets: Whether or not retweets should be filtered. Default is True
+    :param refresh: How many of the most recent saved tweets should have their counts refreshed. Default is 100
+    :param limit: How many tweets to get the first time a user is synced. Default is 100
+    :param storage: The format the tweets are saved in. Defaults to TTVIZ_STORAGE
+    :return: A dataframe of all of the user's saved tweets, or 'PRIVATE' if the account is private
+    """
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+
+    user = get_user(username, priority=ratemanager.PRIORITY_HIGH)
+
+    if user.protected is True:
+        print(f'{username} has a private account!')
+        logger.info(f'{username} has a private account! Data will not be gathered from this account!')
+        return 'PRIVATE'
+
+    storage = get_storage_format(storage)
+    save_file = make_file_name_for_search(username, extension=STORAGE_FORMATS[storage])
+    timeline_tag = TIMELINE_TAG.format(user.screen_name)
+    since_id = load_since_id(username, save_file)
+    # Stored tweets that are not part of a timeline fetch are only added after the first fetch
+    stored_frame = tweets_to_frame([])
+
+    if since_id is None or os.path.exists(save_file) is False:
+        since_id = None
+        saved_frame = tweets_to_frame([])
+
+        if use_tweet_store:
+            # A timeline an earlier stream or sync already stored does not have to be fetched again
+            saved_frame = query_tweet_store(screen_name=user.screen_name, tag=timeline_tag)
+
+            if len(saved_frame) > 0:
+                since_id = int(saved_frame['tweet_ID'].max())
+                logger.info(f'Reusing {len(saved_frame)} stored timeline tweets of {username}')
+            else:
+                stored_frame = query_tweet_store(screen_name=user.screen_name)
+
+            if filter_retweets:
+                saved_frame = saved_frame[~saved_frame['text'].astype(str).str.startswith('RT')]
+                stored_frame = stored_frame[~stored_frame['text'].astype(str).str.startswith('RT')]
+    else:
+        saved_frame = get_dataframe_from_file(save_file)
+
+        if saved_frame is None:
+            # The saved tweets could not be read, so the user's latest tweets are fetched as if it were a first sync
+            since_id = None
+            saved_frame = tweets_to_frame([])
+
+    if since_id is None:
+        timeline = tw.Cursor(scheduler.wrap('/statuses/user_timeline', api.user_timeline), user_id=user.id,
+                             count=limit, tweet_mode='extended').items(limit)
+    else:
+        # No limit, so every tweet since the last sync is fetched
+        timeline = tw.Cursor(scheduler.wrap('/statuses/user_timeline', api.user_timeline), user_id=user.id,
+                             since_id=since_id, count=200, tweet_mode='extended').items()
 
-    word_counter = {}
-    word_list = []
-    freq_list = []
+    new_tweets = [tweet for tweet in timeline
+                  if not filter_retweets or str(tweet.full_text).startswith('RT') is False]
+    new_frame = tweets_to_frame(new_tweets)
+    metricsmanager.add_items('fetch', len(new_tweets))
 
-    for word in data:
+    merged = pd.concat([stored_frame, saved_frame, new_frame], ignore_index=True)
+    merged = merged.drop_duplicates(subset='tweet_ID', keep='last').sort_values(by='tweet_ID', ascending=False)
+    merged = type_tweet_frame(merged.reset_index(drop=True))
 
-        if word in word_counter.keys():
-            new_count = int(word_counter[word]) + 1
-            word_counter[word] = new_count
+    # New tweets already have current counts
+    stale_ids = merged.loc[~merged['tweet_ID'].isin(new_frame['tweet_ID']), 'tweet_ID'].head(refresh).tolist()
+
+    if len(stale_ids) > 0:
+        merged = refresh_interactions(merged, stale_ids)
+
+    write_tweet_frame(merged, save_file, storage=storage)
+    store_tweets(merged, tag=username)
+    # Only the fetched tweets are known to be part of the timeline. Merged tweets from other searches may have gaps
+    store_tweets(new_frame, tag=timeline_tag)
+
+    if len(merged) > 0:
+        save_since_id(username, merged['tweet_ID'].max(), save_file)
+
+    logger.info(f'Synced {username}: {len(new_frame)} new tweets since {since_id}, {len(stale_ids)} counts refreshed, '
+                f'{len(merged)} tweets saved')
+
+    return merged
+
+
+class FrequencyAggregator:
+    """
+    Counts word frequencies incrementally. Words are lowercased before counting so capitalization variants share a
+    count. Aggregators from several batches or workers can be combined with merge(). If a capacity is given, only that
+    many words are tracked using the space-saving algorithm, which keeps memory bounded while still finding the most
+    frequent words. Counts in that mode may overestimate a word's frequency by at most its recorded error.
+    """
+
+    def __init__(self, capacity=None):
+        if capacity is not None and capacity < 1:
+            raise ValueError('The capacity of a frequency aggregator must be at least 1!')
+
+        self.capacity = capacity
+        self.counts = Counter()
+        self.errors = {}
+        self.total = 0
+        # Min-heap of (count, word) used to find the word to evict. Entries can be stale and are fixed when popped
+        self._heap = []
+
+    def update(self, words):
+        """
+        Adds words to the running counts
+        :param words: Any iterable of words, such as a list or a generator
+        :return: This aggregator, so calls can be chained
+        """
+
+        lowered = (str(word).lower() for word in words)
+        total = self.total
+
+        with metricsmanager.start_stage('count') as timer:
+            if self.capacity is None:
+                batch = Counter(lowered)
+                self.total += sum(batch.values())
+                self.counts.update(batch)
+            else:
+                for word in lowered:
+                    self._offer(word)
+
+            timer.add(self.total - total)
+
+        return self
+
+    def _offer(self, word: str):
+        """
+        Counts one word in bounded mode, evicting the least frequent tracked word if the aggregator is full
+        :param word: The lowercased word to count
+        """
+
+        self.total += 1
+
+        if word in self.counts:
+            self.counts[word] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[word] = 1
+            self.errors[word] = 0
+            heapq.heappush(self._heap, (1, word))
         else:
-            # Accounts for capitalization variations
-            word_counter[word.lower()] = 1
+            min_count, min_word = self._pop_min()
+            del self.counts[min_word]
+            del self.errors[min_word]
+
+            self.counts[word] = min_count + 1
+            self.errors[word] = min_count
+            heapq.heappush(self._heap, (min_count + 1, word))
+
+    def _pop_min(self) -> tuple:
+        """
+        Removes the least frequent tracked word from the heap
+        :return: A tuple of the word's count and the word
+        """
+
+        while True:
+            count, word = heapq.heappop(self._heap)
+            current = self.counts.get(word)
+
+            if current == count:
+                return count, word
+            elif current is not None:
+                heapq.heappush(self._heap, (current, word))
+
+    def merge(self, other):
+        """
+        Adds the counts of another aggregator to this one
+        :param other: The FrequencyAggregator to merge in
+        :return: This aggregator, so calls can be chained
+        """
+
+        if self.capacity is None:
+            self.total += other.total
+            self.counts.update(other.counts)
+
+            return self
+
+        # A word a full aggregator does not track may have been counted up to its smallest count before being evicted,
+        # so that count is added to the word's count and error. This keeps every count an overestimate
+        self_min = self._min_count()
+        other_min = other._min_count()
+        counts = Counter()
+        errors = {}
+
+        for word in self.counts.keys() | other.counts.keys():
+            count, error = (self.counts[word], self.errors[word]) if word in self.counts else (self_min, self_min)
+
+            if word in other.counts:
+                count += other.counts[word]
+                error += other.errors.get(word, 0)
+            else:
+                count += other_min
+                error += other_min
 
-    for word, freq in zip(word_counter.keys(), word_counter.values()):
-        word_list.append(word)
-        freq_list.append(freq)
+            counts[word] = count
+            errors[word] = error
 
-    ret_frame = pd.DataFrame({'word': word_list, 'freq': freq_list}).sort_values(by=['freq'], ascending=False)
+        self.total += other.total
+        self.counts = Counter(dict(counts.most_common(self.capacity)))
+        self.errors = {word: errors[word] for word in self.counts}
+        self._heap = [(count, word) for word, count in self.counts.items()]
+        heapq.heapify(self._heap)
 
-    return ret_frame
+        return self
+
+    def _min_count(self) -> int:
+        """
+        Finds the most times a word this aggregator does not track could have been seen
+        :return: The smallest tracked count if the aggregator is full, otherwise 0
+        """
+
+        if self.capacity is None or len(self.counts) < self.capacity:
+            return 0
+
+        return min(self.counts.values())
+
+    def top(self, k=None) -> [tuple]:
+        """
+        Gets the most frequent words
+        :param k: How many words to return. Default is None (All tracked words)
+        :return: A list of (word, freq) tuples ordered from most to least frequent
+        """
+
+        return self.counts.most_common(k)
+
+    def to_frame(self, k=None) -> pd.DataFrame:
+        """
+        Builds a frequency dataframe out of the most frequent words
+        :param k: How many words to include. Default is None (All tracked words)
+        :return: A dataframe with columns 'word' and 'freq' sorted by frequency
+        """
+
+        top_words = self.top(k)
+
+        return pd.DataFrame({'word': [word for word, freq in top_words], 'freq': [freq for word, freq in top_words]})
+
+
+@metricsmanager.timed('count')
+def build_frequency_frame(data: [], top_k=None, capacity=None) -> pd.DataFrame:
+    """
+    Assembles a pandas dataframe out of the frequency of specific words.
+    :param data: A list of words. Can also be a generator of words
+    :param top_k: Only include this many of the most frequent words. Default is None (All words)
+    :param capacity: Bound memory by tracking at most this many words. Default is None (Exact counts)
+    :return: A dataframe with columns 'word' and 'freq' containg the word and its frequency
+    """
+
+    return FrequencyAggregator(capacity=capacity).update(data).to_frame(top_k)
 
 
 # Removes 'RT' and '#' from tweets and selects for meaningful words - Currently unused
@@ -225,82 +1015,276 @@ def build_frequency_frame(data: []) -> pd.DataFrame:
 #     return stripped_tweet
 
 
-def search_network(root_user: str, should_save=True) -> pd.DataFrame:
+def lookup_user_batch(user_ids: [], failed=None) -> dict:
+    """
+    Looks up to 100 user IDs with a single request and caches the users that were found
+    :param user_ids: A list of at most 100 user IDs
+    :param failed: A list the IDs are added to if the request fails, so they are not mistaken for missing accounts
+    :return: A dictionary mapping the ID of every user found to their CachedUser. Empty if the request failed
+    """
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+
+    users = []
+
+    try:
+        users = scheduler.call('/users/lookup', api.lookup_users, user_ids=user_ids)
+    except tw.TweepError as error:
+        # Twitter answers with an error instead of an empty list when none of the IDs exist
+        if error.api_code != NO_USER_MATCHES:
+            print(f'An error occurred trying to look up {len(user_ids)} users because {error.reason}')
+            logger.warning(f'Could not look up {len(user_ids)} users. Error code: {error.api_code}')
+
+            if failed is not None:
+                failed.extend(user_ids)
+
+    return {cached.id: cached for cached in get_user_cache().put_many(users)}
+
+
+def lookup_users(user_ids: [], threads=NETWORK_THREADS, failed=None) -> []:
+    """
+    Resolves user IDs into users with as few requests as possible by looking up to 100 IDs at a time. Several lookups
+    are made at once, and the scheduler keeps them within the rate limit
+    :param user_ids: A list of user IDs
+    :param threads: How many lookups to make at the same time. Default is NETWORK_THREADS
+    :param failed: A list the IDs of lookups that failed are added to. Default is None (Failures are only logged)
+    :return: A list of the users that could be found. Suspended or deleted accounts are left out
+    """
+
+    user_cache = get_user_cache()
+    found = {}
+
+    for user_id in user_ids:
+        cached = user_cache.get(int(user_id))
+
+        if cached is not None:
+            found[cached.id] = cached
+
+    missing_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids if int(user_id) not in found))
+    batches = [missing_ids[start:start + LOOKUP_BATCH_SIZE] for start in range(0, len(missing_ids), LOOKUP_BATCH_SIZE)]
+
+    if len(batches) > 1 and threads > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(batches))) as executor:
+            lookup = metricsmanager.bind_run(lambda batch: lookup_user_batch(batch, failed=failed))
+
+            for batch_found in executor.map(lookup, batches):
+                found.update(batch_found)
+    else:
+        for batch in batches:
+            found.update(lookup_user_batch(batch, failed=failed))
+
+    return [found[int(user_id)] for user_id in user_ids if int(user_id) in found]
+
+
+def get_timeline_text(user_id) -> [str]:
+    """
+    Gets the text of the tweets on a user's timeline, leaving out retweets
+    :param user_id: The ID of the user
+    :return: A list of the text of the user's tweets. Empty if the timeline could not be read
+    """
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+
+    tweet_text = []
+
+    try:
+        timeline = scheduler.call('/statuses/user_timeline', api.user_timeline, user_id,
+                                  priority=ratemanager.PRIORITY_LOW)
+    except tw.TweepError as error:
+        print(f'Could not get the timeline of user with ID: {user_id} because {error.reason}')
+        logger.warning(f'Could not get the timeline of user with ID: {user_id}. Error code: {error.api_code}')
+        return tweet_text
+
+    for tweet in timeline:
+        text = tweet.full_text if hasattr(tweet, 'full_text') else tweet.text
+
+        if str(text).startswith('RT') is False:
+            tweet_text.append(text)
+
+    return tweet_text
+
+
+def get_timelines_text(user_ids: [], threads=NETWORK_THREADS) -> [[str]]:
+    """
+    Gets the text of several users' timelines at once using a pool of threads
+    :param user_ids: A list of user IDs
+    :param threads: How many timelines can be requested at the same time
+    :return: A list with the text of each user's tweets, in the same order as user_ids
+    """
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(metricsmanager.bind_run(get_timeline_text), user_ids))
+
+
+def search_network(root_user: str, should_save=True, workers=1, cache=None, threads=NETWORK_THREADS) -> pd.DataFrame:
     """
     Searches for a user, then selects 100 of that user's followers and builds a frequency map
     :param root_user: An identifier for the user whose followers should be searched as well
     :param should_save: Should the tweets be saved to a .csv file. Default is True
+    :param workers: How many processes should tag the network's tweets. Default is 1
+    :param cache: An optional TagCache used when tagging the network's tweets. Default is None
+    :param threads: How many timelines can be requested at the same time
     :return: A frequency frame [See datamanager.build_frequency_frame()] for the network
     """
 
-    network_ids = []
-    network_tweets = []
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
 
     try:
-        user = api.get_user(root_user)
+        user = get_user(root_user, priority=ratemanager.PRIORITY_HIGH)
     except tw.TweepError as error:
         print(f'Could not find user with username: {root_user} because {error.reason}')
         print(error.api_code)
         logger.warning(f'Could not find account with username: {root_user}! Received API code {error.api_code}')
+        return build_frequency_frame([])
 
-    network_ids.append(user.id)
-
-    followers = tw.Cursor(api.followers_ids, id=root_user, tweet_mode='extended').items(100)
-    friends = tw.Cursor(api.friends_ids, id=root_user, tweet_mode='extended').items(100)
-
-    for follower_id, friend_id in zip(followers, friends):
-        try:
-            follower = api.get_user(follower_id)
-            friend = api.get_user(friend_id)
+    followers = tw.Cursor(scheduler.wrap('/followers/ids', api.followers_ids), id=root_user,
+                          tweet_mode='extended').items(100)
+    friends = tw.Cursor(scheduler.wrap('/friends/ids', api.friends_ids), id=root_user,
+                        tweet_mode='extended').items(100)
 
-            if follower.protected is not True:
-                network_ids.append(follower_id)
-            if friend.protected is not True:
-                network_ids.append(friend_id)
-        except tw.TweepError as error:
-            print(f'An error occurred trying to find a user because {error.reason}')
-            logger.warning(f'Could not find account with username. Error code: {error.api_code}')
+    # Followers and friends are taken in pairs. Accounts that are both are only searched once
+    candidate_ids = list(dict.fromkeys(id_ for pair in zip(followers, friends) for id_ in pair))
+    public_ids = {member.id for member in lookup_users(candidate_ids) if member.protected is not True}
+    network_ids = [user.id] + [id_ for id_ in candidate_ids if id_ in public_ids and id_ != user.id]
 
-    for id_ in network_ids:
-        net_user_tl = api.user_timeline(id_)
+    start_time = time.perf_counter()
+    network_tweets = [text for timeline in get_timelines_text(network_ids, threads=threads) for text in timeline]
+    logger.info(f'Fetched {len(network_ids)} timelines for the network of {root_user} with {threads} thread(s) '
+                f'in {round(time.perf_counter() - start_time, 3)}s')
 
-        for tweet in net_user_tl:
-            if hasattr(tweet, 'full_text'):
-                if str(tweet.full_text).startswith('RT') is False:
-                    network_tweets.append(tweet.full_text)
-            else:
-                if str(tweet.text).startswith('RT') is False:
-                    network_tweets.append(tweet.text)
-
-    network_words = select_pos_words(network_tweets)
+    network_words = select_pos_words(network_tweets, workers=workers, cache=cache)
     network_frame = build_frequency_frame(network_words)
 
     if should_save:
-        network_frame.to_csv(make_file_name_for_search(search=root_user, type='network'))
+        with metricsmanager.start_stage('save', items=len(network_frame)):
+            network_frame.to_csv(make_file_name_for_search(search=root_user, type='network'))
 
     return network_frame
 
 
+# The result of resolve_screen_names(). names maps the ID of every public account to its screen name in the order the
+# IDs were given, protected lists the IDs of private accounts, missing lists the IDs Twitter did not return, such as
+# suspended or deleted accounts, and failed lists the IDs whose lookup failed, so they may still exist
+NameResolution = namedtuple('NameResolution', ['names', 'protected', 'missing', 'failed'])
+
+
+def resolve_screen_names(user_ids: [], threads=NETWORK_THREADS) -> NameResolution:
+    """
+    Turns user IDs into screen names with lookups of up to 100 IDs made several at a time
+    :param user_ids: A list of user IDs. Repeated IDs are resolved once
+    :param threads: How many lookups to make at the same time. Default is NETWORK_THREADS
+    :return: A NameResolution of the screen names and the IDs that were private, could not be found, or failed
+    """
+
+    failed_ids = []
+    users = {user.id: user for user in lookup_users(user_ids, threads=threads, failed=failed_ids)}
+    failed_ids = set(failed_ids)
+    names = {}
+    protected = []
+    missing = []
+    failed = []
+
+    for user_id in dict.fromkeys(int(user_id) for user_id in user_ids):
+        user = users.get(user_id)
+
+        if user_id in failed_ids:
+            failed.append(user_id)
+        elif user is None:
+            missing.append(user_id)
+        elif user.protected is True:
+            protected.append(user_id)
+        else:
+            names[user_id] = user.screen_name
+
+    if len(missing) > 0 or len(protected) > 0 or len(failed) > 0:
+        logger.info(f'Resolved {len(names)} screen names. {len(protected)} accounts are private, {len(missing)} '
+                    f'could not be found, and {len(failed)} could not be looked up')
+
+    return NameResolution(names, protected, missing, failed)
+
+
 def screen_names_from_ids(id_list: []) -> [str]:
     """
     Takes a list of user IDs and turns them into screen names
     :param id_list: A list of user IDs to process
-    :return: A list of user screen names
+    :return: A list of the screen names of public users, in the order of their IDs. Private accounts and IDs that
+    could not be found or looked up are left out [See datamanager.resolve_screen_names()]
     """
 
-    name_list = []
+    return list(resolve_screen_names(id_list).names.values())
 
-    for user_id in id_list:
-        try:
-            user = api.get_user(user_id)
 
-            if user.protected is not True:
-                name_list.append(user.screen_name)
-        except tw.TweepError as error:
-            print(f'Could not find user with ID: {user_id} because {error.reason}')
-            logger.warning(f'Could not find user with ID: {user_id} because {error.reason}')
+def iter_tweet_chunks(tweets, chunk_size=CHUNK_SIZE):
+    """
+    Groups tweets into dataframes of a fixed size as they arrive
+    :param tweets: Any iterable of tweets, such as a tweepy Cursor
+    :param chunk_size: How many tweets go in each dataframe
+    :return: A generator of typed tweet dataframes [See datamanager.tweets_to_frame()]
+    """
+
+    tweets = iter(tweets)
+
+    while True:
+        chunk = list(itertools.islice(tweets, chunk_size))
 
-    return name_list
+        if len(chunk) == 0:
+            return
+
+        yield tweets_to_frame(chunk)
+
+
+def stream_user_tweets(identifier: str, limit=HISTORY_LIMIT, favorites_limit=HISTORY_LIMIT, chunk_size=CHUNK_SIZE,
+                       save=True, storage=None):
+    """
+    Pages through a user's timeline (Including retweets) and then their liked tweets, yielding the tweets in
+    fixed-size chunks and writing each chunk to the user's saved tweets as it arrives. Only one chunk is held in memory
+    at a time no matter how many tweets the user has.
+    :param identifier: An identifier such as a screen name or ID for the user
+    :param limit: How many timeline tweets to get. Twitter returns at most about 3200. Default is 3200
+    :param favorites_limit: How many liked tweets to get. Default is 3200
+    :param chunk_size: How many tweets are in each chunk. Default is 200
+    :param save: Should the chunks be saved? Default is True
+    :param storage: The storage format. Valid inputs are csv, parquet, or feather. Defaults to TTVIZ_STORAGE
+    :return: A generator of typed tweet dataframes
+    """
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
+
+    user = get_user(identifier, priority=ratemanager.PRIORITY_HIGH)
+
+    if user.protected is True:
+        print(f'{identifier} has a private account!')
+        logger.info(f'{identifier} has a private account! Data will not be gathered from this account!')
+        return
+
+    timeline = tw.Cursor(scheduler.wrap('/statuses/user_timeline', api.user_timeline), user_id=user.id, count=200,
+                         tweet_mode='extended').items(limit)
+    favorites = tw.Cursor(scheduler.wrap('/favorites/list', api.favorites), user_id=user.id, count=200,
+                          tweet_mode='extended').items(favorites_limit)
+
+    storage = get_storage_format(storage)
+    writer = TweetFileWriter(make_file_name_for_search(identifier, extension=STORAGE_FORMATS[storage]), storage)
+
+    # Liked tweets were posted by other users, so only the timeline is tagged as one
+    tags = {'timeline': [identifier, TIMELINE_TAG.format(user.screen_name)], 'favorites': identifier}
+
+    try:
+        for source, tweets in (('timeline', timeline), ('favorites', favorites)):
+            for chunk in iter_tweet_chunks(tweets, chunk_size=chunk_size):
+                metricsmanager.add_items('fetch', len(chunk))
+
+                if save:
+                    writer.write(chunk)
+                    store_tweets(chunk, tag=tags[source])
+
+                yield chunk
+    finally:
+        writer.close()
+        logger.info(f'Streamed {writer.rows} tweets for {identifier}')
 
 
 def build_user_frame(identifier: str, limit=100) -> pd.DataFrame:
@@ -311,63 +1295,257 @@ def build_user_frame(identifier: str, limit=100) -> pd.DataFrame:
     :return: A dataframe containing the user's tweets, retweets, and liked tweets
     """
 
-    tl_tweets = get_tweets_for_user(identifier, filter_retweets=False)
-    favorited_tweets = tw.Cursor(api.favorites, id=identifier).items(limit)
+    chunks = list(stream_user_tweets(identifier, limit=100, favorites_limit=limit))
 
-    tweet_text = []
-    tweet_ids = []
-    tweet_screen_names = []
+    if len(chunks) == 0:
+        return tweets_to_frame([])
 
-    for tweet in tl_tweets:
-        if hasattr(tweet, 'full_text'):
-            tweet_text.append(tweet.full_text)
-        else:
-            tweet_text.append(tweet.text)
-        tweet_ids.append(tweet.id)
-        tweet_screen_names.append(tweet.user.screen_name)
-    for tweet in favorited_tweets:
-        if hasattr(tweet, 'full_text'):
-            tweet_text.append(tweet.full_text)
-        else:
-            tweet_text.append(tweet.text)
-        tweet_ids.append(tweet.id)
-        tweet_screen_names.append(tweet.user.screen_name)
+    return type_tweet_frame(pd.concat(chunks, ignore_index=True))
 
-    frame_data = {'tweet_id': tweet_ids, 'text': tweet_text, 'screen_name': tweet_screen_names}
-    ret_frame = pd.DataFrame(frame_data)
 
-    ret_frame.to_csv(make_file_name_for_search(identifier))
+def get_tagger():
+    """
+    Loads NLTK's perceptron tagger once and reuses it for every later call in this process
+    :return: A loaded PerceptronTagger
+    """
 
-    return ret_frame
+    global _tagger
+
+    if _tagger is None:
+        # NLTK takes about a second to import, so it is only loaded once tweets are tagged
+        from nltk.tag.perceptron import PerceptronTagger
+
+        _tagger = PerceptronTagger()
+
+    return _tagger
+
+
+def get_tag_cache() -> cachemanager.TagCache:
+    """
+    Opens the on-disk tag cache for the current tagger once and reuses it for later calls
+    :return: The shared TagCache
+    """
+
+    global _tag_cache
+
+    if _tag_cache is None:
+        _tag_cache = cachemanager.TagCache(TAGGER_VERSION)
+
+    return _tag_cache
+
+
+def get_user_cache() -> cachemanager.UserCache:
+    """
+    Opens the user profile cache once and reuses it for later calls
+    :return: The shared UserCache
+    """
+
+    global _user_cache
+
+    if _user_cache is None:
+        _user_cache = cachemanager.UserCache(ttl=USER_CACHE_TTL, path=cachemanager.make_cache_path('user_cache.sqlite'))
+
+    return _user_cache
+
+
+def get_summary_cache() -> cachemanager.SummaryCache:
+    """
+    Opens the on-disk summary cache once and reuses it for later calls
+    :return: The shared SummaryCache
+    """
+
+    global _summary_cache
+
+    if _summary_cache is None:
+        _summary_cache = cachemanager.SummaryCache()
+
+    return _summary_cache
+
+
+def get_tweet_store() -> storemanager.TweetStore:
+    """
+    Opens the shared tweet store once and reuses it for later calls
+    :return: The shared TweetStore
+    """
+
+    global _tweet_store
+
+    if _tweet_store is None:
+        _tweet_store = storemanager.TweetStore()
+
+    return _tweet_store
+
+
+def get_user(identifier, priority=ratemanager.PRIORITY_NORMAL):
+    """
+    Gets a user's profile, only sending a request if the user is not in the user cache
+    :param identifier: A user ID (As an int or a string of digits) or screen name
+    :param priority: The priority of the request if one is needed. Default is PRIORITY_NORMAL
+    :return: A CachedUser with the user's id, screen_name, and protected flag
+    """
+
+    api = sessionmanager.get_api()
+    scheduler = sessionmanager.get_scheduler()
 
+    user_cache = get_user_cache()
+    user = user_cache.get(identifier)
 
-def select_pos_words(tweets: [], pos='both') -> [str]:
+    if user is None:
+        user = user_cache.put(scheduler.call('/users/show', api.get_user, identifier, priority=priority))
+
+    return user
+
+
+def make_pos_filter(pos='both'):
+    """
+    Builds the word filter used by select_pos_words so the part of speech check is decided once instead of per word
+    :param pos: The part of speech to select. Valid inputs are noun, adj, or both. Default is both
+    :return: A function taking a word and its POS tag that returns True if the word should be kept
+    """
+
+    try:
+        prefixes = POS_PREFIXES[pos]
+    except KeyError:
+        raise ValueError(f'Unknown part of speech {pos}! Valid inputs are noun, adj, or both')
+
+    def keep_word(word: str, code: str) -> bool:
+        return code.startswith(prefixes) and word.isalnum() and len(word) > 1 and word != 'https'
+
+    return keep_word
+
+
+def tokenize_tweet(text: str, tweet_tokenizer=None) -> [[str]]:
+    """
+    Splits a tweet into the token lists that are tagged by select_pos_words. Every token from the tweet tokenizer is
+    split again with nltk.word_tokenize and kept as its own sentence so each token is tagged on its own.
+    :param text: The text of the tweet
+    :param tweet_tokenizer: An optional TweetTokenizer to reuse
+    :return: A list of token lists, one per tweet token
+    """
+
+    import nltk
+
+    if tweet_tokenizer is None:
+        tweet_tokenizer = nltk.TweetTokenizer()
+
+    return [nltk.word_tokenize(str(token)) for token in tweet_tokenizer.tokenize(text)]
+
+
+def tag_tweet_batch(tweets: [str]) -> [[(str, str)]]:
+    """
+    Tokenizes and POS tags a batch of tweets with a single tagger call for the whole batch
+    :param tweets: The text of the tweets to tag
+    :return: A list with the (word, tag) pairs of each tweet, in the same order as tweets
+    """
+
+    from nltk.tokenize.casual import TweetTokenizer
+
+    tweet_tokenizer = TweetTokenizer()
+    sentences = []
+    sentence_counts = []
+
+    for text in tweets:
+        token_sentences = tokenize_tweet(text, tweet_tokenizer)
+        sentences.extend(token_sentences)
+        sentence_counts.append(len(token_sentences))
+
+    tagged_sentences = get_tagger().tag_sents(sentences)
+    tagged_tweets = []
+    position = 0
+
+    for count in sentence_counts:
+        tagged_tweets.append([pair for sentence in tagged_sentences[position:position + count] for pair in sentence])
+        position += count
+
+    return tagged_tweets
+
+
+def _init_tag_worker():
+    """
+    Process pool initializer that loads the tagger once per worker process
+    """
+
+    get_tagger()
+
+
+def make_tag_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Starts a pool of worker processes that each load the tagger once. Pass it to select_pos_words() to tag many
+    batches of tweets, such as the chunks of a stream, without starting a new pool for every batch
+    :param workers: How many processes should tag tweets
+    :return: The pool. Shut it down when done
+    """
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_tag_worker)
+
+
+def tag_tweets(tweets: [str], batch_size=500, workers=1, executor=None) -> [[(str, str)]]:
+    """
+    Tags tweets batch by batch, optionally spreading the batches over a pool of worker processes
+    :param tweets: The text of the tweets to tag
+    :param batch_size: How many tweets are tagged per tagger call. Default is 500
+    :param workers: How many processes should tag tweets. Default is 1 (No process pool)
+    :param executor: An existing pool from make_tag_pool() to tag with. Default is None (A pool is started if workers
+    is more than 1)
+    :return: A list with the (word, tag) pairs of each tweet, in the same order as tweets
+    """
+
+    if workers > 1:
+        # Keeps every worker busy when there are fewer tweets than workers * batch_size
+        batch_size = max(1, min(batch_size, -(-len(tweets) // workers)))
+
+    batches = [tweets[start:start + batch_size] for start in range(0, len(tweets), batch_size)]
+
+    if executor is not None and len(batches) > 1:
+        # map() returns results in the order the batches were submitted
+        tagged_batches = list(executor.map(tag_tweet_batch, batches))
+    elif workers > 1 and len(batches) > 1:
+        with make_tag_pool(workers) as executor:
+            tagged_batches = list(executor.map(tag_tweet_batch, batches))
+    else:
+        tagged_batches = [tag_tweet_batch(batch) for batch in batches]
+
+    return [tagged_tweet for batch in tagged_batches for tagged_tweet in batch]
+
+
+def select_pos_words(tweets: [], pos='both', batch_size=500, workers=1, cache=None, executor=None) -> [str]:
     """
     Selects all of the nouns out of a user's tweets
     :param pos: The part of string to select. Valid inputs are noun, adj, or both. Default is both
     :param tweets: An array of tweets to process
+    :param batch_size: How many tweets are tagged per tagger call. Default is 500
+    :param workers: How many processes should tag tweets. Default is 1
+    :param cache: An optional TagCache. Only tweets missing from the cache are tagged. Default is None (No cache)
+    :param executor: An optional pool from make_tag_pool() to tag with. Default is None
     :return: A list of nouns used in the provided tweets
     """
 
     # Can be nouns or adjectives
     ret_list = []
-    tweet_tokenizer = TweetTokenizer()
+    keep_word = make_pos_filter(pos)
+    tweets = [str(text) for text in tweets]
+    start_time = time.perf_counter()
 
-    for text in tweets:
-        token_sentences = tweet_tokenizer.tokenize(text)
-
-        for sentence in token_sentences:
-            words = nltk.word_tokenize(str(sentence))
-            for word, code in nltk.pos_tag(words):
-                if pos == 'noun':
-                    if code.startswith('NN') and word.isalnum() and len(word) > 1 and word != 'https':
-                        ret_list.append(word)
-                if pos == 'adj':
-                    if code.startswith('JJ') and word.isalnum() and len(word) > 1 and word != 'https':
-                        ret_list.append(word)
-                if pos == 'both':
-                    if (code.startswith('JJ') or code.startswith('NN')) and word.isalnum() and len(word) > 1 and \
-                            word != 'https':
-                        ret_list.append(word)
+    with metricsmanager.start_stage('tag', items=len(tweets)):
+        tagged = cache.get_many(tweets) if cache is not None else {}
+        # Each distinct text is only tagged once, even if it appears in several tweets
+        to_tag = list(dict.fromkeys(text for text in tweets if text not in tagged))
+
+        if len(to_tag) > 0:
+            new_tags = tag_tweets(to_tag, batch_size=batch_size, workers=workers, executor=executor)
+            new_tags = dict(zip(to_tag, new_tags))
+            tagged.update(new_tags)
+
+            if cache is not None:
+                cache.put_many(new_tags)
+
+        for text in tweets:
+            ret_list.extend(word for word, code in tagged[text] if keep_word(word, code))
+
+    elapsed = time.perf_counter() - start_time
+
+    if elapsed > 0:
+        logger.info(f'Tagged {len(to_tag)} of {len(tweets)} tweets with {workers} worker(s) in {round(elapsed, 3)}s '
+                    f'({round(len(tweets) / elapsed, 1)} tweets/sec)')
 
     return ret_list
@@ -0,0 +1,575 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger()
+
+# Requests that go to these hosts are sent to the fake API or recorded
+TWITTER_HOSTS = ('api.twitter.com', 'upload.twitter.com')
+
+# Requests allowed per rate limit window for each endpoint, matching Twitter's user auth limits
+ENDPOINT_LIMITS = {'/search/tweets': 180, '/users/show': 900, '/users/lookup': 900, '/statuses/user_timeline': 900,
+                   '/followers/ids': 15, '/friends/ids': 15, '/favorites/list': 75, '/statuses/lookup': 900,
+                   '/statuses/update': 300, '/application/rate_limit_status': 180}
+
+# Words used to write the text of synthetic tweets
+VOCABULARY = ['great', 'new', 'game', 'people', 'time', 'day', 'big', 'news', 'world', 'music', 'team', 'good',
+              'happy', 'city', 'weather', 'coffee', 'python', 'data', 'science', 'movie', 'love', 'best', 'week',
+              'school', 'election', 'market', 'video', 'photo', 'dog', 'cat', 'summer', 'winter', 'night', 'food',
+              'amazing', 'small', 'free', 'live', 'open', 'friends', 'the', 'a', 'is', 'and', 'to', 'of', 'with']
+
+_original_get_adapter = requests.Session.get_adapter
+
+
+def format_twitter_time(moment: datetime) -> str:
+    """
+    Formats a datetime the way Twitter formats created_at
+    :param moment: The datetime to format
+    :return: A string such as Wed Oct 10 20:19:24 +0000 2018
+    """
+
+    return moment.strftime('%a %b %d %H:%M:%S +0000 %Y')
+
+
+def endpoint_from_path(path: str) -> str:
+    """
+    Turns a request path into an endpoint name
+    :param path: A path such as /1.1/users/lookup.json
+    :return: The endpoint name, such as /users/lookup
+    """
+
+    if path.startswith('/1.1'):
+        path = path[len('/1.1'):]
+
+    return path.rsplit('.json', 1)[0]
+
+
+class FakeTwitter:
+    """
+    A synthetic Twitter made of users, their tweets, liked tweets, followers, and friends. The same seed always builds
+    the same data, so runs against it can be compared.
+    """
+
+    def __init__(self, users=200, tweets_per_user=200, favorites_per_user=50, network_size=150, protected_share=0.05,
+                 retweet_share=0.1, seed=0):
+        rng = random.Random(seed)
+        start_time = datetime(2020, 1, 1)
+
+        self.users = []
+        self.users_by_id = {}
+        self.users_by_name = {}
+        self.timelines = {}
+        self.favorites = {}
+        self.followers = {}
+        self.friends = {}
+
+        for index in range(users):
+            user = {'id': 1000 + index, 'id_str': str(1000 + index), 'screen_name': f'user{index}',
+                    'name': f'User {index}', 'protected': index > 0 and rng.random() < protected_share,
+                    'followers_count': rng.randint(0, 10000), 'created_at': format_twitter_time(start_time)}
+            self.users.append(user)
+            self.users_by_id[user['id']] = user
+            self.users_by_name[user['screen_name'].lower()] = user
+            self.timelines[user['id']] = []
+
+        self.tweets = []
+
+        for index in range(users * tweets_per_user):
+            user = self.users[rng.randrange(users)]
+            words = rng.choices(VOCABULARY, k=rng.randint(4, 20))
+            text = ' '.join(words)
+
+            if rng.random() < retweet_share:
+                text = f'RT @{rng.choice(self.users)["screen_name"]}: {text}'
+
+            tweet = {'id': 10 ** 9 + index, 'id_str': str(10 ** 9 + index), 'full_text': text, 'text': text,
+                     'favorite_count': int(rng.paretovariate(1.5)) - 1, 'retweet_count': int(rng.paretovariate(2)) - 1,
+                     'created_at': format_twitter_time(start_time + timedelta(minutes=7 * index)), 'user': user,
+                     'lang': 'en'}
+            self.tweets.append(tweet)
+            self.timelines[user['id']].append(tweet)
+
+        self.tweets_by_id = {tweet['id']: tweet for tweet in self.tweets}
+        # Newest first, like Twitter
+        self.tweets.reverse()
+
+        for user in self.users:
+            self.timelines[user['id']].reverse()
+            liked = rng.sample(self.tweets, min(favorites_per_user, len(self.tweets)))
+            self.favorites[user['id']] = sorted(liked, key=lambda tweet: tweet['id'], reverse=True)
+
+            others = [other['id'] for other in self.users if other['id'] != user['id']]
+            self.followers[user['id']] = rng.sample(others, min(network_size, len(others)))
+            self.friends[user['id']] = rng.sample(others, min(network_size, len(others)))
+
+    def find_user(self, params: dict):
+        """
+        Finds the user a request is about
+        :param params: The request's parameters. Uses user_id, screen_name, or id
+        :return: The user, or None if there is no such user
+        """
+
+        if params.get('user_id') is not None:
+            return self.users_by_id.get(int(params['user_id']))
+        if params.get('screen_name') is not None:
+            return self.users_by_name.get(params['screen_name'].lower())
+        if params.get('id') is not None:
+            identifier = params['id']
+
+            if identifier.isdigit() and int(identifier) in self.users_by_id:
+                return self.users_by_id[int(identifier)]
+
+            return self.users_by_name.get(identifier.lower())
+
+        return None
+
+    @staticmethod
+    def page_tweets(tweets: [], params: dict, default_count=20, max_count=200) -> []:
+        """
+        Selects one page of tweets the way Twitter's since_id/max_id paging does
+        :param tweets: Tweets sorted from newest to oldest
+        :param params: The request's parameters. Uses count, since_id, and max_id
+        :param default_count: The page size if count is not given
+        :param max_count: The largest page size allowed
+        :return: The tweets on the page
+        """
+
+        count = min(int(params.get('count', default_count)), max_count)
+        since_id = int(params.get('since_id', 0))
+        max_id = int(params['max_id']) if params.get('max_id') is not None else None
+        page = []
+
+        for tweet in tweets:
+            if max_id is not None and tweet['id'] > max_id:
+                continue
+            if tweet['id'] <= since_id or len(page) == count:
+                break
+
+            page.append(tweet)
+
+        return page
+
+    def handle(self, method: str, endpoint: str, params: dict) -> tuple:
+        """
+        Answers an API request
+        :param method: The HTTP method
+        :param endpoint: The endpoint name, such as /users/show
+        :param params: The request's parameters
+        :return: A tuple of the HTTP status code and the JSON response body
+        """
+
+        not_found = (404, {'errors': [{'code': 50, 'message': 'User not found.'}]})
+
+        if endpoint == '/users/show':
+            user = self.find_user(params)
+            return (200, user) if user is not None else not_found
+        elif endpoint == '/users/lookup':
+            if params.get('user_id'):
+                users = [self.users_by_id.get(int(user_id)) for user_id in params['user_id'].split(',')]
+            else:
+                users = [self.users_by_name.get(name.lower()) for name in params.get('screen_name', '').split(',')]
+
+            users = [user for user in users if user is not None]
+            return (200, users) if len(users) > 0 else (404, {'errors': [{'code': 17, 'message': 'No user matches.'}]})
+        elif endpoint in ('/statuses/user_timeline', '/favorites/list'):
+            user = self.find_user(params)
+
+            if user is None:
+                return not_found
+            if user['protected']:
+                return 401, {'request': endpoint, 'error': 'Not authorized.'}
+
+            tweets = self.timelines if endpoint == '/statuses/user_timeline' else self.favorites
+            return 200, self.page_tweets(tweets[user['id']], params)
+        elif endpoint == '/search/tweets':
+            tweets = self.tweets
+
+            if '-filter:retweets' in params.get('q', ''):
+                tweets = [tweet for tweet in tweets if not tweet['full_text'].startswith('RT')]
+
+            page = self.page_tweets(tweets, params, default_count=15, max_count=100)
+            return 200, {'statuses': page, 'search_metadata': {'count': len(page), 'query': params.get('q', '')}}
+        elif endpoint in ('/followers/ids', '/friends/ids'):
+            user = self.find_user(params)
+
+            if user is None:
+                return not_found
+
+            ids = (self.followers if endpoint == '/followers/ids' else self.friends)[user['id']]
+            start = max(int(params.get('cursor', -1)), 0)
+            count = int(params.get('count', 5000))
+            next_cursor = start + count if start + count < len(ids) else 0
+
+            return 200, {'ids': ids[start:start + count], 'next_cursor': next_cursor,
+                         'next_cursor_str': str(next_cursor), 'previous_cursor': 0, 'previous_cursor_str': '0'}
+        elif endpoint == '/statuses/lookup':
+            tweet_ids = [int(tweet_id) for tweet_id in params.get('id', '').split(',') if tweet_id != '']
+            return 200, [self.tweets_by_id[tweet_id] for tweet_id in tweet_ids if tweet_id in self.tweets_by_id]
+        elif endpoint == '/statuses/update':
+            text = params.get('status', '')
+            return 200, {'id': 1, 'id_str': '1', 'full_text': text, 'text': text, 'favorite_count': 0,
+                         'retweet_count': 0, 'created_at': format_twitter_time(datetime.utcnow()),
+                         'user': self.users[0]}
+
+        return 404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]}
+
+
+class RateLimits:
+    """
+    Per-endpoint request budgets that reset every window, reported in x-rate-limit headers like Twitter does
+    """
+
+    def __init__(self, window=15 * 60, limits=None):
+        self.window = window
+        self.limits = dict(ENDPOINT_LIMITS)
+        self.limits.update(limits or {})
+        self._used = {}
+        self._resets = {}
+        self._lock = threading.Lock()
+
+    def take(self, endpoint: str) -> tuple:
+        """
+        Uses one request of an endpoint's budget
+        :param endpoint: The endpoint name
+        :return: A tuple of whether the request is allowed and the rate limit headers for the response
+        """
+
+        limit = self.limits.get(endpoint, 900)
+
+        with self._lock:
+            now = time.time()
+
+            if now >= self._resets.get(endpoint, 0):
+                self._resets[endpoint] = now + self.window
+                self._used[endpoint] = 0
+
+            allowed = self._used[endpoint] < limit
+
+            if allowed:
+                self._used[endpoint] += 1
+
+            headers = {'x-rate-limit-limit': str(limit), 'x-rate-limit-remaining': str(limit - self._used[endpoint]),
+                       'x-rate-limit-reset': str(int(self._resets[endpoint]) + 1)}
+
+        return allowed, headers
+
+
+class Cassette:
+    """
+    Recorded API responses stored in a JSON file and keyed by method, path, and parameters
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = {}
+        self._lock = threading.Lock()
+
+        try:
+            with open(path) as file:
+                self.responses = json.load(file)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def make_key(method: str, path: str, params: dict) -> str:
+        """
+        Builds the key a response is recorded under
+        :param method: The HTTP method
+        :param path: The request path
+        :param params: The request's parameters
+        :return: The key as a string
+        """
+
+        return f'{method} {endpoint_from_path(path)}?{urlencode(sorted(params.items()))}'
+
+    def get(self, key: str):
+        """
+        Looks up a recorded response
+        :param key: The key of the request [See Cassette.make_key()]
+        :return: A tuple of the status code and JSON body, or None if the request was not recorded
+        """
+
+        with self._lock:
+            response = self.responses.get(key)
+
+        return None if response is None else (response['status'], response['body'])
+
+    def record(self, key: str, status: int, body):
+        """
+        Stores a response and saves the cassette file
+        :param key: The key of the request [See Cassette.make_key()]
+        :param status: The HTTP status code
+        :param body: The JSON response body
+        """
+
+        with self._lock:
+            self.responses[key] = {'status': status, 'body': body}
+
+            with open(self.path, 'w') as file:
+                json.dump(self.responses, file)
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """
+    Serves fake API requests. Recorded responses are replayed when the cassette has them, and all other requests are
+    answered with the server's synthetic data
+    """
+
+    def handle_request(self, method: str):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update(dict(parse_qsl(self.rfile.read(length).decode('utf-8'))))
+
+        endpoint = endpoint_from_path(url.path)
+
+        if fake.latency > 0 or fake.jitter > 0:
+            time.sleep(fake.latency + random.uniform(0, fake.jitter))
+
+        allowed, headers = fake.rate_limits.take(endpoint)
+        recorded = None
+
+        if fake.cassette is not None:
+            recorded = fake.cassette.get(Cassette.make_key(method, url.path, params))
+
+        if not allowed:
+            status, body = 429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}
+        elif recorded is not None:
+            status, body = recorded
+        else:
+            status, body = fake.twitter.handle(method, endpoint, params)
+
+        payload = json.dumps(body).encode('utf-8')
+        fake.requests += 1
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, format, *args):
+        logger.debug(f'Fake API: {format % args}')
+
+
+class FakeAPIServer:
+    """
+    A local HTTP server that acts like Twitter's v1.1 API. Requests can be delayed by a fixed latency plus random
+    jitter, and every endpoint has its own rate limit, so fetch code can be timed offline.
+    """
+
+    def __init__(self, twitter=None, latency=0.0, jitter=0.0, window=15 * 60, limits=None, cassette=None, port=0):
+        self.twitter = twitter if twitter is not None else FakeTwitter()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = RateLimits(window=window, limits=limits)
+        self.cassette = cassette
+        self.requests = 0
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), FakeAPIHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """
+        Starts serving requests on a background thread
+        :return: This server
+        """
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f'Fake API listening on {self.url}')
+
+        return self
+
+    def stop(self):
+        """
+        Stops the server
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Sends requests meant for Twitter to another server, such as a FakeAPIServer
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        request.url = self.base_url + url.path + (f'?{url.query}' if url.query else '')
+
+        return super().send(request, **kwargs)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Sends requests to Twitter as usual and records every response in a cassette for later replay
+    """
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        url = urlparse(request.url)
+        params = dict(parse_qsl(url.query))
+
+        if request.body and isinstance(request.body, (str, bytes)):
+            body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+            params.update(dict(parse_qsl(body)))
+
+        try:
+            self.cassette.record(Cassette.make_key(request.method, url.path, params), response.status_code,
+                                 response.json())
+        except ValueError:
+            logger.warning(f'Could not record the response of {request.url} because it is not JSON')
+
+        return response
+
+
+def install_adapter(adapter: HTTPAdapter):
+    """
+    Routes every request to Twitter's hosts through an adapter. This also covers the sessions tweepy has already made
+    :param adapter: The adapter to use, such as a RedirectAdapter or RecordingAdapter
+    """
+
+    def get_adapter(session, url):
+        if urlparse(url).hostname in TWITTER_HOSTS:
+            return adapter
+
+        return _original_get_adapter(session, url)
+
+    requests.Session.get_adapter = get_adapter
+
+
+def uninstall_adapter():
+    """
+    Sends requests to Twitter directly again
+    """
+
+    requests.Session.get_adapter = _original_get_adapter
+
+
+def run_offline(command: str, args: [], inputs: [], server=None, record_path=None) -> float:
+    """
+    Runs one tweetplot command with scripted answers to its prompts and times it from start to finish
+    :param command: The command to run. Valid types are topic, user, network
+    :param args: The args passed to tweetplot.process_command
+    :param inputs: The answers to give to the command's prompts, in order
+    :param server: A FakeAPIServer to send requests to. Ignored if record_path is given
+    :param record_path: If given, requests go to the real Twitter API and their responses are recorded to this file
+    :return: How long the command took in seconds
+    """
+
+    import sessionmanager
+    import tweetplot
+
+    answers = iter(inputs)
+
+    if record_path is not None:
+        install_adapter(RecordingAdapter(Cassette(record_path)))
+        tweetplot.login(tweetplot.load_account_data())
+    else:
+        install_adapter(RedirectAdapter(server.url))
+        sessionmanager.get_auth().set_access_token('offline', 'offline')
+
+    start_time = time.perf_counter()
+
+    try:
+        tweetplot.process_command(command, args, ask=lambda prompt='': next(answers))
+    finally:
+        elapsed = time.perf_counter() - start_time
+        uninstall_adapter()
+
+    sessionmanager.get_scheduler().log_stats()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a ttViz command against a local fake Twitter API, optionally '
+                                                 'replaying or recording real API responses.')
+    parser.add_argument('command', choices=['topic', 'user', 'network'])
+    parser.add_argument('--input', action='append', default=[], dest='inputs',
+                        help='An answer to one of the command\'s prompts. Repeat for each prompt')
+    parser.add_argument('--plot', action='store_true', help='Plot the results')
+    parser.add_argument('--name', default='', help='Save name for topic searches')
+    parser.add_argument('--user-mode', default='2', help='User search mode (1, 2, or 3)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random seconds of extra latency per request')
+    parser.add_argument('--window', type=float, default=15 * 60, help='Length of the rate limit window in seconds')
+    parser.add_argument('--users', type=int, default=200, help='Number of synthetic users')
+    parser.add_argument('--tweets-per-user', type=int, default=200, help='Number of synthetic tweets per user')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data')
+    parser.add_argument('--cassette', default=None, help='File of recorded responses to replay')
+    parser.add_argument('--record', action='store_true', help='Record real API responses into --cassette')
+    options = parser.parse_args()
+
+    import tweetplot
+
+    tweetplot.setup_logging()
+
+    if options.command == 'topic':
+        args = [options.plot, options.name]
+    elif options.command == 'user':
+        args = [options.user_mode, options.plot]
+    else:
+        args = [options.plot]
+
+    if options.record:
+        if options.cassette is None:
+            parser.error('--record needs a --cassette file to record to')
+
+        elapsed = run_offline(options.command, args, options.inputs, record_path=options.cassette)
+        print(f'Recorded {options.command} in {round(elapsed, 3)}s to {options.cassette}')
+    else:
+        cassette = Cassette(options.cassette) if options.cassette is not None else None
+        twitter = FakeTwitter(users=options.users, tweets_per_user=options.tweets_per_user, seed=options.seed)
+        server = FakeAPIServer(twitter, latency=options.latency, jitter=options.jitter, window=options.window,
+                               cassette=cassette).start()
+
+        try:
+            elapsed = run_offline(options.command, args, options.inputs, server=server)
+        finally:
+            server.stop()
+
+        print(f'{options.command} took {round(elapsed, 3)}s ({server.requests} API requests)')
+
+
+if __name__ == '__main__':
+    main()
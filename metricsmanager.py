@@ -0,0 +1,458 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak resident memory of stages is not reported
+    resource = None
+
+logger = logging.getLogger()
+
+# The stages the time of a run is split into. fetch is time spent in API requests and does not include rate limit waits
+STAGES = ['fetch', 'rate_limit_wait', 'save', 'load', 'tag', 'count', 'stats', 'plot']
+
+# Set TTVIZ_TRACE_MEMORY to 1 to measure the peak Python memory of each stage. Tracing makes runs noticeably slower
+trace_memory = os.getenv('TTVIZ_TRACE_MEMORY', '0') == '1'
+
+# Set TTVIZ_PROFILE to 1 to save a cProfile dump of the slowest stage of each run
+profile_stages = os.getenv('TTVIZ_PROFILE', '0') == '1'
+
+# How many functions of the slowest stage's profile are written to the log
+PROFILE_LINES = 20
+
+# The run entered by each thread. Pool threads record to the run they were handed with bind_run(), and to no run
+# otherwise
+_thread_run = threading.local()
+
+
+def make_metrics_path(file_name: str) -> str:
+    """
+    Generates the path to a file in the metrics directory, creating the directory if needed
+    :param file_name: The name of the metrics file
+    :return: The path to the metrics file as a string
+    """
+
+    metrics_dir = os.getcwd() + '/metrics/'
+
+    if os.path.exists(metrics_dir) is False:
+        try:
+            os.mkdir(metrics_dir)
+        except IOError:
+            print('Could not create directory: ' + metrics_dir)
+            logger.warning(f'Could not create metrics directory {metrics_dir}!')
+
+    return metrics_dir + file_name
+
+
+def count_items(result) -> int:
+    """
+    Counts the items returned by an API method
+    :param result: What the method returned. Cursor methods return a tuple of the results and the next cursors
+    :return: The length of a list of results, 0 for unparsed pages, otherwise 1
+    """
+
+    # Cursors paging by ID parse the raw page themselves, so their tweets are counted with add_items() where they arrive
+    if isinstance(result, (str, bytes)):
+        return 0
+
+    if isinstance(result, tuple) and len(result) > 0:
+        result = result[0]
+
+    return len(result) if isinstance(result, list) else 1
+
+
+def get_max_rss_mb():
+    """
+    Gets the peak resident memory of this process so far
+    :return: The peak in megabytes, or None if it cannot be read on this platform
+    """
+
+    if resource is None:
+        return None
+
+    # Linux reports kilobytes while macOS reports bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+class StageRecord:
+    """
+    The totals of one stage over a run. seconds counts the time the stage was running in at least one thread, while
+    busy_seconds adds up every call, so busy_seconds is the larger of the two when calls overlap across threads.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.busy_seconds = 0.0
+        self.calls = 0
+        self.items = 0
+        self.peak_mb = None
+        self.max_rss_mb = None
+
+        self._active = 0
+        self._active_since = 0.0
+
+    def to_dict(self) -> dict:
+        """
+        Gets the totals of the stage
+        :return: A dictionary of the stage's seconds, busy_seconds, calls, items, peak_mb, and max_rss_mb
+        """
+
+        return {'seconds': round(self.seconds, 6), 'busy_seconds': round(self.busy_seconds, 6), 'calls': self.calls,
+                'items': self.items, 'peak_mb': round(self.peak_mb, 3) if self.peak_mb is not None else None,
+                'max_rss_mb': round(self.max_rss_mb, 3) if self.max_rss_mb is not None else None}
+
+
+class StageTimer:
+    """
+    Times one call of a stage. Items processed during the call are counted with add(). A timer started while the same
+    stage is already running in its thread is not recorded on its own and passes its items to the outer timer.
+    """
+
+    def __init__(self, name: str, run=None, items=0, outer=None):
+        self.name = name
+        self.items = 0
+        self.start_time = time.perf_counter()
+        self.peak = 0
+        self.profiler = None
+
+        self._run = run
+        self._outer = outer
+
+        self.add(items)
+
+    def add(self, count: int):
+        """
+        Counts items processed by this call of the stage
+        :param count: How many items were processed
+        """
+
+        if self._outer is not None:
+            self._outer.add(count)
+        else:
+            self.items += count
+
+    def stop(self):
+        """
+        Stops the timer and adds it to its run. Stopping a timer more than once has no effect
+        """
+
+        if self._run is not None:
+            run = self._run
+            self._run = None
+            run.stop_stage(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class RunMetrics:
+    """
+    Records the wall time, item counts, and memory of every stage of one command. When the run finishes, the stages
+    are written to the log and to a JSON file in the metrics directory, along with an optional cProfile dump of the
+    slowest stage. Several runs can be open at once in different threads, each recording the stages of the thread that
+    entered it.
+    """
+
+    def __init__(self, command: str, trace_memory=False, profile=False):
+        self.command = command
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.started_at = datetime.now()
+        self.seconds = None
+        self.stages = {name: StageRecord(name) for name in STAGES}
+        self.profiles = {}
+
+        self._start_time = time.perf_counter()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracing = False
+        self._previous_run = None
+
+    def __enter__(self):
+        self._previous_run = getattr(_thread_run, 'run', None)
+        _thread_run.run = self
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _thread_run.run = self._previous_run
+        self.finish()
+
+    def _open_timers(self) -> dict:
+        """
+        Gets the timers running in the current thread
+        :return: A dictionary mapping stage names to their running timers
+        """
+
+        if not hasattr(self._local, 'timers'):
+            self._local.timers = {}
+
+        return self._local.timers
+
+    def _fold_peak(self):
+        """
+        Adds the traced memory peak since the last stage started to every running timer. Must hold the lock
+        """
+
+        peak = tracemalloc.get_traced_memory()[1]
+
+        for timer in self._running:
+            timer.peak = max(timer.peak, peak)
+
+    def start_stage(self, name: str, items=0) -> StageTimer:
+        """
+        Starts timing a call of a stage
+        :param name: The name of the stage, such as fetch or tag
+        :param items: How many items the call will process, if already known. Default is 0
+        :return: The call's StageTimer
+        """
+
+        open_timers = self._open_timers()
+
+        if name in open_timers:
+            return StageTimer(name, items=items, outer=open_timers[name])
+
+        timer = StageTimer(name, run=self, items=items)
+        open_timers[name] = timer
+
+        with self._lock:
+            stage = self.stages.setdefault(name, StageRecord(name))
+
+            if stage._active == 0:
+                stage._active_since = timer.start_time
+
+            stage._active += 1
+
+            if self.trace_memory and tracemalloc.is_tracing():
+                self._fold_peak()
+                tracemalloc.reset_peak()
+
+            self._running.add(timer)
+
+        # Only one profiler can run at a time, so only the outermost stages of the main thread are profiled
+        if self.profile and len(open_timers) == 1 and threading.current_thread() is threading.main_thread():
+            timer.profiler = self.profiles.setdefault(name, cProfile.Profile())
+
+            try:
+                timer.profiler.enable()
+            except ValueError:
+                # Another profiler is already running, such as python -m cProfile
+                timer.profiler = None
+
+        return timer
+
+    def stop_stage(self, timer: StageTimer):
+        """
+        Adds a finished call of a stage to the stage's totals
+        :param timer: The call's StageTimer
+        """
+
+        if timer.profiler is not None:
+            timer.profiler.disable()
+
+        stop_time = time.perf_counter()
+        self._open_timers().pop(timer.name, None)
+        max_rss = get_max_rss_mb()
+
+        with self._lock:
+            stage = self.stages[timer.name]
+            stage.calls += 1
+            stage.items += timer.items
+            stage.busy_seconds += stop_time - timer.start_time
+            stage._active -= 1
+
+            if stage._active == 0:
+                stage.seconds += stop_time - stage._active_since
+
+            if self.trace_memory and tracemalloc.is_tracing():
+                self._fold_peak()
+                stage.peak_mb = max(stage.peak_mb or 0, timer.peak / 2 ** 20)
+
+            if max_rss is not None:
+                stage.max_rss_mb = max_rss
+
+            self._running.discard(timer)
+
+    def add_items(self, name: str, count: int):
+        """
+        Counts items for a stage outside of a timed call
+        :param name: The name of the stage
+        :param count: How many items were processed
+        """
+
+        with self._lock:
+            self.stages.setdefault(name, StageRecord(name)).items += count
+
+    def slowest_stage(self):
+        """
+        Finds the stage that took the most time
+        :return: The stage's StageRecord, or None if no stage ran
+        """
+
+        ran = [stage for stage in self.stages.values() if stage.calls > 0]
+
+        return max(ran, key=lambda stage: stage.seconds) if len(ran) > 0 else None
+
+    def finish(self) -> str:
+        """
+        Ends the run, logs the time of each stage, and saves the metrics file
+        :return: The path to the metrics file
+        """
+
+        self.seconds = time.perf_counter() - self._start_time
+
+        if self._started_tracing:
+            tracemalloc.stop()
+
+        slowest = self.slowest_stage()
+        run_name = f'{self.command}_{self.started_at.strftime("%Y%m%d_%H%M%S_%f")}'
+        profile_file = None
+
+        logger.info(f'{self.command} run took {round(self.seconds, 3)}s')
+
+        for stage in self.stages.values():
+            if stage.calls > 0:
+                logger.info(f'{self.command} {stage.name}: {round(stage.seconds, 3)}s over {stage.calls} calls, '
+                            f'{stage.items} items, peak {stage.to_dict()["peak_mb"]} MB traced, '
+                            f'{stage.to_dict()["max_rss_mb"]} MB resident')
+
+        if slowest is not None and slowest.name in self.profiles:
+            profile_file = make_metrics_path(f'{run_name}_{slowest.name}.prof')
+            self.profiles[slowest.name].dump_stats(profile_file)
+
+            profile_text = io.StringIO()
+            pstats.Stats(self.profiles[slowest.name], stream=profile_text).sort_stats('cumulative').print_stats(
+                PROFILE_LINES)
+            logger.info(f'Profile of the {slowest.name} stage, saved to {profile_file}:\n{profile_text.getvalue()}')
+
+        metrics_file = make_metrics_path(f'{run_name}.json')
+        report = {'command': self.command, 'started_at': self.started_at.isoformat(timespec='seconds'),
+                  'seconds': round(self.seconds, 6), 'trace_memory': self.trace_memory,
+                  'slowest_stage': slowest.name if slowest is not None else None, 'profile': profile_file,
+                  'stages': {name: stage.to_dict() for name, stage in self.stages.items()}}
+
+        try:
+            with open(metrics_file, 'w') as file:
+                json.dump(report, file, indent=2)
+        except IOError as error:
+            print(f'Could not save run metrics because {error}')
+            logger.error(f'Could not save run metrics to {metrics_file} because {error}')
+
+        return metrics_file
+
+
+def get_current_run():
+    """
+    Finds the run that stages of the current thread are recorded to
+    :return: The run entered by or bound to this thread, or None if no run is being recorded
+    """
+
+    return getattr(_thread_run, 'run', None)
+
+
+def bind_run(func, run=None):
+    """
+    Wraps a function so its stages are recorded to a run no matter which thread calls it. Wrap functions when they are
+    handed to a pool thread, so their stages go to the run of the thread that submitted them
+    :param func: The function to wrap
+    :param run: The run to record to. Defaults to the current run of the calling thread
+    :return: The wrapped function, or func itself if no run is being recorded
+    """
+
+    if run is None:
+        run = get_current_run()
+
+    if run is None:
+        return func
+
+    @functools.wraps(func)
+    def bound_func(*args, **kwargs):
+        previous_run = getattr(_thread_run, 'run', None)
+        _thread_run.run = run
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _thread_run.run = previous_run
+
+    return bound_func
+
+
+def start_run(command: str) -> RunMetrics:
+    """
+    Creates the metrics of a command run. Use the result in a with block: stages are recorded while the block runs
+    and the metrics are saved when it ends
+    :param command: The command being run, such as topic or network
+    :return: The run's RunMetrics
+    """
+
+    return RunMetrics(command, trace_memory=trace_memory, profile=profile_stages)
+
+
+def start_stage(name: str, items=0) -> StageTimer:
+    """
+    Starts timing a call of a stage in the current run. The timer does nothing if no run is being recorded
+    :param name: The name of the stage, such as fetch or tag
+    :param items: How many items the call will process, if already known. Default is 0
+    :return: The call's StageTimer. Call stop() on it or use it in a with block
+    """
+
+    run = get_current_run()
+
+    if run is None:
+        return StageTimer(name, items=items)
+
+    return run.start_stage(name, items=items)
+
+
+def add_items(name: str, count: int):
+    """
+    Counts items for a stage of the current run outside of a timed call, such as tweets read from a cursor
+    :param name: The name of the stage, such as fetch
+    :param count: How many items were processed
+    """
+
+    run = get_current_run()
+
+    if run is not None:
+        run.add_items(name, count)
+
+
+def timed(name: str):
+    """
+    Decorator that times every call of a function as part of a stage
+    :param name: The name of the stage, such as stats
+    :return: The decorator
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            with start_stage(name):
+                return func(*args, **kwargs)
+
+        return timed_func
+
+    return decorator
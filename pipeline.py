@@ -0,0 +1,196 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import datamanager as dm
+import metricsmanager
+
+logger = logging.getLogger()
+
+
+class AnalysisPipeline:
+    """
+    Carries the tweets of one search through fetch, persist, extract, count, and plot while keeping them in memory.
+    Persisting runs on a background thread so saving to disk never holds up the analysis. Stages return the pipeline,
+    so they can be chained, and close() (Or leaving a with block) waits for all saves to finish.
+    """
+
+    def __init__(self, save_name: str, workers=1, cache=None, storage=None):
+        self.save_name = save_name
+        self.workers = workers
+        self.cache = cache
+        self.storage = dm.get_storage_format(storage)
+
+        self.frame = None
+        self.words = []
+        self.freq_frame = None
+
+        self._sink = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def fetch(self, fetcher, *args, **kwargs):
+        """
+        Gets tweets and converts them into the pipeline's dataframe
+        :param fetcher: A function returning an array of tweets, such as datamanager.search_tweets_for_query
+        :param args: Positional arguments for fetcher
+        :param kwargs: Keyword arguments for fetcher
+        :return: This pipeline
+        """
+
+        self.frame = dm.tweets_to_frame(fetcher(*args, **kwargs))
+
+        return self
+
+    def use_frame(self, frame: pd.DataFrame):
+        """
+        Uses an existing dataframe of tweets instead of fetching them
+        :param frame: A dataframe with at least a text column
+        :return: This pipeline
+        """
+
+        self.frame = frame
+
+        return self
+
+    def persist(self, append=False):
+        """
+        Saves the pipeline's tweets in the background
+        :param append: Should the tweets be added to an existing save instead of replacing it? Default is False
+        :return: This pipeline
+        """
+
+        save_file = dm.make_file_name_for_search(self.save_name, extension=dm.STORAGE_FORMATS[self.storage])
+        self._submit(dm.write_tweet_frame, self.frame, save_file, storage=self.storage, append=append)
+        self._submit(dm.store_tweets, self.frame, tag=self.save_name)
+
+        return self
+
+    def extract(self, pos='both'):
+        """
+        Selects the words with the given part of speech from the pipeline's tweets
+        :param pos: The part of speech to select. Valid inputs are noun, adj, or both. Default is both
+        :return: This pipeline
+        """
+
+        self.words = dm.select_pos_words(self.frame['text'].tolist(), pos=pos, workers=self.workers, cache=self.cache)
+
+        return self
+
+    def count(self, save=True):
+        """
+        Builds the frequency frame of the extracted words
+        :param save: Should the frequency frame be saved in the background? Default is True
+        :return: This pipeline
+        """
+
+        self.freq_frame = dm.build_frequency_frame(self.words)
+
+        if save:
+            self._submit(self.freq_frame.to_csv, dm.make_file_name_for_search(self.save_name, type='freq'))
+
+        return self
+
+    def count_stream(self, chunks, pos='both'):
+        """
+        Extracts and counts words from chunks of tweets as they arrive, so only one chunk is in memory at a time
+        :param chunks: An iterable of tweet dataframes, such as datamanager.stream_user_tweets()
+        :param pos: The part of speech to select. Valid inputs are noun, adj, or both. Default is both
+        :return: This pipeline
+        """
+
+        aggregator = dm.FrequencyAggregator()
+        # One pool tags every chunk, so worker processes only start and load the tagger once per stream
+        executor = dm.make_tag_pool(self.workers) if self.workers > 1 else None
+
+        try:
+            for chunk in chunks:
+                aggregator.update(dm.select_pos_words(chunk['text'].tolist(), pos=pos, workers=self.workers,
+                                                      cache=self.cache, executor=executor))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.freq_frame = aggregator.to_frame()
+
+        return self
+
+    def plot_bar(self, title: str, subject: str, min_freq=0):
+        """
+        Plots the most frequent words as a bar graph
+        :param title: The title of the plot
+        :param subject: The subject of the plot. Used to create the plot's save name
+        :param min_freq: Words used less than this many times are left out. Default is 0
+        :return: This pipeline
+        """
+
+        # Matplotlib is only loaded when something is plotted
+        from plotmaker import PlotMaker
+
+        plot_frame = self.freq_frame[self.freq_frame.freq >= min_freq]
+        PlotMaker(title, plot_frame).build_bar_plot('word', 'freq', subject)
+
+        return self
+
+    def plot_scatter(self, title: str, explanatory: str, response: str, subject: str, mode='auto'):
+        """
+        Plots two columns of the pipeline's tweets against each other with a linear model
+        :param title: The title of the plot
+        :param explanatory: The column to plot on the x-axis
+        :param response: The column to plot on the y-axis
+        :param subject: The subject of the plot. Used to create the plot's save name
+        :param mode: How to draw the points. Valid inputs are auto, points, hexbin, or sample. Default is auto
+        :return: This pipeline
+        """
+
+        from plotmaker import PlotMaker
+
+        PlotMaker(title, self.frame).build_scatter_plot(explanatory, response, subject, mode=mode)
+
+        return self
+
+    def _submit(self, func, *args, **kwargs):
+        """
+        Queues a save on the background thread
+        :param func: The function that writes to disk
+        :param args: Positional arguments for func
+        :param kwargs: Keyword arguments for func
+        """
+
+        # The save is recorded to the run of the thread that queued it, not to whichever run is open when it runs
+        self._pending.append(self._sink.submit(metricsmanager.bind_run(self._save), func, *args, **kwargs))
+
+    @staticmethod
+    def _save(func, *args, **kwargs):
+        """
+        Runs a save on the background thread as part of the run's save stage
+        :param func: The function that writes to disk
+        :param args: Positional arguments for func
+        :param kwargs: Keyword arguments for func
+        """
+
+        with metricsmanager.start_stage('save'):
+            return func(*args, **kwargs)
+
+    def close(self):
+        """
+        Waits for all queued saves to finish and reports any that failed
+        """
+
+        try:
+            for future in self._pending:
+                try:
+                    future.result()
+                except (IOError, ValueError) as error:
+                    print(f'Could not save results for {self.save_name} because {error}')
+                    logger.error(f'Could not save results for {self.save_name} because {error}')
+        finally:
+            # Other errors are raised to the caller, but the sink thread must still be stopped
+            self._pending = []
+            self._sink.shutdown()
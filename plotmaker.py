@@ -1,29 +1,107 @@
+import logging
 import os
-import random
-
-import matplotlib.pyplot as plt
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import matplotlib
+import matplotlib.style
 import numpy as np
 import pandas as pd
-from scipy.stats import linregress
+from matplotlib.figure import Figure
 
+import metricsmanager
 import statsmanager as sm
 
+logger = logging.getLogger()
+
+# The matplotlib style used for every plot. Applied once when this module is imported
+PLOT_STYLE = 'ggplot'
+
+# zlib compression level of saved plots. Low levels save much faster for slightly larger files
+PNG_COMPRESSION = 1
+
+# Set TTVIZ_HEADLESS to 1 to save plots without opening a window, such as on a server or in batch jobs
+headless_plots = os.getenv('TTVIZ_HEADLESS', '0') == '1'
+
+# Above this many points, build_scatter_plot draws a density plot instead of every point by default
+SCATTER_POINT_LIMIT = 20000
+
+# How many hexagons wide the density plots of large scatter plots are
+HEXBIN_GRIDSIZE = 60
+
+# How build_scatter_plot can draw its points
+SCATTER_MODES = ['auto', 'points', 'hexbin', 'sample']
+
+# The PlotMaker method that draws each kind of PlotJob
+PLOT_METHODS = {'bar': 'build_bar_plot', 'scatter': 'build_scatter_plot', 'box': 'build_boxplot',
+                'time': 'build_time_plot', 'heatmap': 'build_heatmap'}
+
+# Above this many lines, time plots leave out their legend because it would cover the plot
+LEGEND_LIMIT = 10
+
+# A plot to render with render_plots(). kind is bar, scatter, box, time, or heatmap, and args and kwargs are passed to
+# the kind's PlotMaker method
+PlotJob = namedtuple('PlotJob', ['kind', 'title', 'data', 'args', 'kwargs'])
+
+# The functions called with the path of each plot saved by a thread [See plotmaker.watch_saved_plots()]
+_plot_watchers = threading.local()
+
+# Styles are applied through matplotlib.style, so pyplot is only loaded when a plot is shown in a window
+matplotlib.style.use(PLOT_STYLE)
+
+if headless_plots:
+    # Without a window there is nothing for an interactive backend to do
+    matplotlib.use('Agg')
+
+
+def use_headless_plots():
+    """
+    Makes every later plot of this process save without opening a window, using the Agg backend
+    """
+
+    global headless_plots
+
+    headless_plots = True
+    matplotlib.use('Agg')
+
+
+def sample_points(x_vals: np.ndarray, y_vals: np.ndarray, limit: int, seed=0) -> tuple:
+    """
+    Downsamples points by splitting them into limit equally sized groups ordered by x and picking one random point from
+    each group, so every part of the x range keeps its share of points
+    :param x_vals: The x values of the points
+    :param y_vals: The y values of the points
+    :param limit: The most points to keep
+    :param seed: Seed for picking points. The same seed always keeps the same points. Default is 0
+    :return: A tuple of the kept x values and y values. All points are kept if there are no more than limit
+    """
+
+    if len(x_vals) <= limit:
+        return x_vals, y_vals
+
+    order = np.argsort(x_vals, kind='stable')
+    group_size = len(x_vals) / limit
+    offsets = np.random.default_rng(seed).random(limit)
+    picked = order[((np.arange(limit) + offsets) * group_size).astype(np.int64)]
+
+    return x_vals[picked], y_vals[picked]
+
 
 class PlotMaker:
     """
-    Generates visualizations of specified data. Requires a specified title and data.
+    Generates visualizations of specified data. Requires a specified title and data. Every plot is drawn on its own
+    figure, which is closed once the plot has been saved and shown. In headless mode figures are created without
+    pyplot, so nothing is shown and no global plotting state is shared between plots.
     """
 
-    def __init__(self, plot_title: str, plot_data: pd.DataFrame, plot_caption=''):
+    def __init__(self, plot_title: str, plot_data: pd.DataFrame, plot_caption='', headless=None):
         self.title = plot_title
         self.caption = plot_caption
         self.data = plot_data
-
-        styles = ['ggplot', 'fivethirtyeight', 'classic', 'bmh', 'seaborn-dark']
-        style = random.choice(styles)
-
-        assert isinstance(style, str)
-        plt.style.use('ggplot')
+        self.headless = headless if headless is not None else headless_plots
 
     @staticmethod
     def make_file_name_for_plot(subject: str) -> str:
@@ -38,81 +116,160 @@ class PlotMaker:
         if os.path.exists(path) is not True:
             try:
                 os.mkdir(path)
+            except FileExistsError:
+                # Another process rendering a plot about the same subject made it first
+                pass
             except IOError:
                 print(f'Could not make path {path} !')
 
         return file_name
 
-    def build_scatter_plot(self, explanatory: str, response: str, subject: str, do_reg=True, do_save=True):
+    def new_figure(self) -> tuple:
         """
-        Creates a scatter plot using the user specified data and explanatory/response variables
-        Explanatory and response variables should be column names in the dataframe. do_reg determines if linear
-        regression should be ran
-        :param explanatory: The name of the explanatory variable (x variable) for the plot
-        :param response: The name of the response variable (y variable) for the plot
-        :param subject: The subject of the plot. Is used to create the plot's save name
-        :param do_reg: Whether or not to perform linear regression. Defautl is True.
-        :param do_save: Whether or not to save an image of the plot. Default is True.
+        Creates the figure and axes of a new plot
+        :return: A tuple of the figure and its axes
         """
 
-        print(self.title)
-        explan_var = self.data[explanatory]
-        response_var = self.data[response]
+        if self.headless:
+            figure = Figure()
+        else:
+            import matplotlib.pyplot as plt
 
-        plt.scatter(explan_var, response_var)
+            figure = plt.figure()
 
-        plt.title(self.title)
-        plt.xlabel(explanatory.capitalize())
-        plt.ylabel(response.capitalize())
+        return figure, figure.add_subplot()
 
-        if explan_var.empty is not True and response_var.empty is not True:
-            if do_reg:
-                lin_model = linregress(explan_var, response_var)
-                slope = lin_model.slope
-                intercept = lin_model.intercept
+    @staticmethod
+    def save_figure(figure: Figure, file_name: str):
+        """
+        Saves a figure as an image
+        :param figure: The figure to save
+        :param file_name: The path of the image
+        :return: The path of the image, or None if it could not be saved
+        """
 
-                r_val = round(lin_model.rvalue, 4)
-                r_sq = round(r_val ** 2, 4)
-                p_val = round(lin_model.pvalue, 4)
-                std_err = round(lin_model.stderr, 4)
+        try:
+            figure.savefig(file_name, dpi=150, pil_kwargs={'compress_level': PNG_COMPRESSION})
+        except FileNotFoundError as error:
+            print(f'Could not find {error.filename}! Check directory name?')
+            return None
 
-                actual_vals = response_var.tolist()
-                explan_list = explan_var.tolist()
+        for watcher in getattr(_plot_watchers, 'callbacks', []):
+            watcher(file_name)
 
-                resid_frame = sm.calculate_resids(slope, intercept, actual_vals, x_vals=explan_list)
-                over_est = []
-                under_est = []
+        return file_name
 
-                for value in resid_frame['resid']:
-                    if value > 0:
-                        over_est.append(value)
-                    elif value < 0:
-                        under_est.append(value)
+    def show_figure(self, figure: Figure):
+        """
+        Shows a figure unless running headless, then closes it
+        :param figure: The figure to show
+        """
 
-                avg_over_est = round(np.mean(over_est), 4)
-                avg_under_est = round(np.mean(under_est), 4)
-                avg_resid = round(resid_frame['resid'].mean(), 4)
+        if not self.headless:
+            import matplotlib.pyplot as plt
 
-                fig_cap = f'r: {r_val} r^2: {r_sq} p-value: {p_val} std error: {std_err}\n ' \
-                          f'Avg Overestimate: {avg_over_est} Avg Underestimate: {avg_under_est} ' \
-                          f'Avg residual: {avg_resid}'
+            plt.show()
 
-                plt.plot(explan_var, slope * explan_var + intercept, color='red')
-                plt.figtext(0.05, 0.005, fig_cap, wrap=True, horizontalalignment='left', fontsize=10)
-                # The plot needs to be made a bit taller to fit the caption
-                plt.gcf().set_size_inches(11, 7)
+        self.close_figure(figure)
 
-            if do_save:
-                file_name = self.make_file_name_for_plot(subject)
-                try:
-                    plt.savefig(file_name, dpi=150)
-                except FileNotFoundError as error:
-                    print(f'Could not find {error.filename}! Check directory name?')
+    def close_figure(self, figure: Figure):
+        """
+        Closes a figure so its memory is freed and it is not drawn on again
+        :param figure: The figure to close
+        """
 
-            plt.show()
+        if self.headless:
+            figure.clear()
+        else:
+            import matplotlib.pyplot as plt
+
+            plt.close(figure)
+
+    def build_scatter_plot(self, explanatory: str, response: str, subject: str, do_reg=True, do_save=True,
+                           mode='auto'):
+        """
+        Creates a scatter plot using the user specified data and explanatory/response variables
+        Explanatory and response variables should be column names in the dataframe. do_reg determines if linear
+        regression should be ran. Large datasets are drawn as a density plot or a sample of their points, but the
+        regression always uses every point
+        :param explanatory: The name of the explanatory variable (x variable) for the plot
+        :param response: The name of the response variable (y variable) for the plot
+        :param subject: The subject of the plot. Is used to create the plot's save name
+        :param do_reg: Whether or not to perform linear regression. Defautl is True.
+        :param do_save: Whether or not to save an image of the plot. Default is True.
+        :param mode: How to draw the points. Valid inputs are points (Every point), hexbin (Density of points),
+        sample (At most SCATTER_POINT_LIMIT points), or auto (hexbin above SCATTER_POINT_LIMIT points, otherwise
+        points). Default is auto
+        :return: The path of the saved image, or None if it was not saved
+        """
+
+        if mode not in SCATTER_MODES:
+            raise ValueError(f'Invalid scatter plot mode {mode}! Valid modes are {", ".join(SCATTER_MODES)}')
+
+        file_name = None
+
+        # Time spent looking at the plot is not counted in the plot stage
+        with metricsmanager.start_stage('plot', items=len(self.data)):
+            print(self.title)
+            explan_var = self.data[explanatory]
+            response_var = self.data[response]
+            has_data = explan_var.empty is not True and response_var.empty is not True
+
+            if mode == 'auto':
+                mode = 'hexbin' if len(explan_var) > SCATTER_POINT_LIMIT else 'points'
+
+            figure, axes = self.new_figure()
+
+            if mode == 'hexbin' and has_data:
+                density = axes.hexbin(explan_var.to_numpy(dtype=float), response_var.to_numpy(dtype=float),
+                                      gridsize=HEXBIN_GRIDSIZE, bins='log', mincnt=1, cmap='viridis')
+                figure.colorbar(density, ax=axes, label='Tweets')
+            elif mode == 'sample':
+                axes.scatter(*sample_points(explan_var.to_numpy(), response_var.to_numpy(), SCATTER_POINT_LIMIT))
+            else:
+                axes.scatter(explan_var, response_var)
+
+            axes.set_title(self.title)
+            axes.set_xlabel(explanatory.capitalize())
+            axes.set_ylabel(response.capitalize())
+
+            if has_data:
+                if do_reg:
+                    summary = sm.summarize_regression(explan_var, response_var)
+                    slope = summary.slope
+                    intercept = summary.intercept
+
+                    r_val = round(summary.r_val, 4)
+                    r_sq = round(r_val ** 2, 4)
+                    p_val = round(summary.p_val, 4)
+                    std_err = round(summary.std_err, 4)
+
+                    avg_over_est = round(summary.avg_over_est, 4)
+                    avg_under_est = round(summary.avg_under_est, 4)
+                    avg_resid = round(summary.avg_resid, 4)
+
+                    fig_cap = f'r: {r_val} r^2: {r_sq} p-value: {p_val} std error: {std_err}\n ' \
+                              f'Avg Overestimate: {avg_over_est} Avg Underestimate: {avg_under_est} ' \
+                              f'Avg residual: {avg_resid}'
+
+                    # A line only needs its end points, no matter how many points were fitted
+                    line_x = np.array([explan_var.min(), explan_var.max()], dtype=float)
+                    axes.plot(line_x, slope * line_x + intercept, color='red')
+                    figure.text(0.05, 0.005, fig_cap, wrap=True, horizontalalignment='left', fontsize=10)
+                    # The plot needs to be made a bit taller to fit the caption
+                    figure.set_size_inches(11, 7)
+
+                if do_save:
+                    file_name = self.save_figure(figure, self.make_file_name_for_plot(subject))
+
+        if has_data:
+            self.show_figure(figure)
         else:
+            self.close_figure(figure)
             print("No tweets about this topic!")
 
+        return file_name
+
     def build_bar_plot(self, x_var: str, y_var: str, subject: str, do_save=True):
         """
         Creates a bar plot using the user specified data, the name of the variable to be plotted
@@ -121,8 +278,11 @@ class PlotMaker:
         :param y_var: The heights of the bars to plot
         :param subject: The subject of the bar graph. Used to create image name.
         :param do_save: Whether or not to save an image of the plot. Default is True
+        :return: The path of the saved image, or None if it was not saved
         """
 
+        file_name = None
+
         print(self.title)
         if len(self.data[x_var]) > 10:
             # Selects the first 10 rows (first list), then the first two columns(second list)
@@ -136,22 +296,22 @@ class PlotMaker:
         if x_vals.empty is True or heights.empty is True:
             print("No tweets about this topic or not enough data!")
         else:
-            plt.bar(x=x_vals, height=heights)
-            plt.title(self.title)
-            plt.xlabel(x_var.capitalize())
-            plt.ylabel(y_var.capitalize())
+            with metricsmanager.start_stage('plot', items=len(x_vals)):
+                figure, axes = self.new_figure()
+                axes.bar(x=x_vals, height=heights)
+                axes.set_title(self.title)
+                axes.set_xlabel(x_var.capitalize())
+                axes.set_ylabel(y_var.capitalize())
 
-            # Ensures that all the words on the bar graph render properly
-            plt.gcf().set_size_inches(11, 5)
+                # Ensures that all the words on the bar graph render properly
+                figure.set_size_inches(11, 5)
 
-            if do_save:
-                file_name = self.make_file_name_for_plot(subject)
-                try:
-                    plt.savefig(file_name, dpi=150)
-                except FileNotFoundError as error:
-                    print(f'Could not find {error.filename}! Check directory name?')
+                if do_save:
+                    file_name = self.save_figure(figure, self.make_file_name_for_plot(subject))
 
-            plt.show()
+            self.show_figure(figure)
+
+        return file_name
 
     def build_boxplot(self, save_name: str, do_save=True, xlabels=[], stats=[]):
         """
@@ -160,28 +320,168 @@ class PlotMaker:
         :param xlabels: Optional labels for the x-axis
         :param save_name: The basic name of the plot to be saved
         :param do_save: Whether or not the plot is saved
+        :return: The path of the saved image, or None if it was not saved
         """
 
+        file_name = None
         green_diamond = dict(markerfacecolor='green', marker='D')
 
-        plt.boxplot(self.data, flierprops=green_diamond)
-        plt.title(self.title)
-        plt.xlabel("Category")
-        plt.ylabel("Count")
-
-        if xlabels is not []:
-            # Calling plt.xticks() with no args returns a tuple of the x-axis tick locations and there labels
-            # Here we keep the locations the same, but replace the x labels with the specified ones using plt.xticks().
-            locations, labels = plt.xticks()
-            plt.xticks(locations, xlabels)
-            # Ensures that all the words on the boxplot's x-axis render properly
-            plt.gcf().set_size_inches(11, 5)
-
-        if do_save:
-            file_name = self.make_file_name_for_plot(save_name)
-            try:
-                plt.savefig(file_name, dpi=150)
-            except FileNotFoundError as error:
-                print(f'Could not find {error.filename}! Check directory name?')
+        with metricsmanager.start_stage('plot', items=len(self.data)):
+            figure, axes = self.new_figure()
+            axes.boxplot(self.data, flierprops=green_diamond)
+            axes.set_title(self.title)
+            axes.set_xlabel("Category")
+            axes.set_ylabel("Count")
+
+            if len(xlabels) > 0:
+                # Keeps the locations of the ticks the same, but replaces their labels with the specified ones
+                axes.set_xticks(axes.get_xticks())
+                axes.set_xticklabels(xlabels)
+                # Ensures that all the words on the boxplot's x-axis render properly
+                figure.set_size_inches(11, 5)
+
+            if do_save:
+                file_name = self.save_figure(figure, self.make_file_name_for_plot(save_name))
+
+        self.show_figure(figure)
+
+        return file_name
+
+    def build_time_plot(self, time_var: str, y_var: str, subject: str, by=None, do_save=True, xlabel='', ylabel=''):
+        """
+        Creates a line plot of a value over time, such as the tweets per day from timemanager.bucket_activity()
+        :param time_var: The name of the column of times to plot along the x-axis
+        :param y_var: The name of the column of values to plot
+        :param subject: The subject of the plot. Used to create the plot's save name
+        :param by: Optional column to draw one line for each group of, such as screen_name. Default is None (One line)
+        :param do_save: Whether or not to save an image of the plot. Default is True
+        :param xlabel: Optional label for the x-axis. Defaults to the name of time_var
+        :param ylabel: Optional label for the y-axis. Defaults to the name of y_var
+        :return: The path of the saved image, or None if it was not saved
+        """
+
+        file_name = None
+
+        print(self.title)
+
+        if len(self.data) == 0:
+            print('No tweets about this topic or not enough data!')
+            return file_name
+
+        with metricsmanager.start_stage('plot', items=len(self.data)):
+            if by is not None:
+                # One column per group, so every line is drawn by a single call
+                lines = self.data.pivot(index=time_var, columns=by, values=y_var)
+            else:
+                lines = self.data.set_index(time_var)[[y_var]]
+
+            figure, axes = self.new_figure()
+            axes.plot(lines.index.to_numpy(), lines.to_numpy())
+            axes.set_title(self.title)
+            axes.set_xlabel(xlabel if xlabel != '' else time_var.replace('_', ' ').capitalize())
+            axes.set_ylabel(ylabel if ylabel != '' else y_var.replace('_', ' ').capitalize())
+
+            if by is not None and lines.shape[1] <= LEGEND_LIMIT:
+                axes.legend([str(group) for group in lines.columns])
+
+            # Dates along the x-axis are slanted so they do not overlap
+            figure.autofmt_xdate()
+            figure.set_size_inches(11, 5)
+
+            if do_save:
+                file_name = self.save_figure(figure, self.make_file_name_for_plot(subject))
+
+        self.show_figure(figure)
+
+        return file_name
+
+    def build_heatmap(self, subject: str, do_save=True, xlabel='', ylabel='', value_label=''):
+        """
+        Creates a heatmap of a table of values, such as the tweets in each hour of each day of the week from
+        timemanager.weekly_profile(). The rows and columns of the data are used as the labels of the axes
+        :param subject: The subject of the heatmap. Used to create the plot's save name
+        :param do_save: Whether or not to save an image of the plot. Default is True
+        :param xlabel: Optional label for the x-axis
+        :param ylabel: Optional label for the y-axis
+        :param value_label: Optional label for the color bar
+        :return: The path of the saved image, or None if it was not saved
+        """
+
+        file_name = None
+
+        with metricsmanager.start_stage('plot', items=self.data.size):
+            figure, axes = self.new_figure()
+            cells = axes.imshow(self.data.to_numpy(dtype=float), aspect='auto', cmap='viridis')
+            figure.colorbar(cells, ax=axes, label=value_label)
+            # The grid of the plot style would be drawn across the cells
+            axes.grid(False)
+            axes.set_title(self.title)
+            axes.set_xlabel(xlabel)
+            axes.set_ylabel(ylabel)
+            axes.set_xticks(range(self.data.shape[1]))
+            axes.set_xticklabels([str(column) for column in self.data.columns])
+            axes.set_yticks(range(self.data.shape[0]))
+            axes.set_yticklabels([str(row) for row in self.data.index])
+            figure.set_size_inches(11, 5)
+
+            if do_save:
+                file_name = self.save_figure(figure, self.make_file_name_for_plot(subject))
+
+        self.show_figure(figure)
+
+        return file_name
+
+
+@contextmanager
+def watch_saved_plots(callback):
+    """
+    Calls a function with the path of every plot the current thread saves while the with block runs
+    :param callback: A function that takes the path of a saved plot
+    """
+
+    if not hasattr(_plot_watchers, 'callbacks'):
+        _plot_watchers.callbacks = []
+
+    _plot_watchers.callbacks.append(callback)
+
+    try:
+        yield
+    finally:
+        _plot_watchers.callbacks.remove(callback)
+
+
+def render_plot(job: PlotJob):
+    """
+    Renders one plot headlessly. Used by render_plots() in worker processes
+    :param job: The PlotJob to render
+    :return: The path of the saved image, or None if it was not saved
+    """
+
+    plotter = PlotMaker(job.title, job.data, headless=True)
+
+    return getattr(plotter, PLOT_METHODS[job.kind])(*job.args, **job.kwargs)
+
+
+def render_plots(jobs: [PlotJob], workers=1) -> []:
+    """
+    Renders many plots headlessly, optionally spread across several processes
+    :param jobs: The PlotJobs to render
+    :param workers: How many processes should render plots. Default is 1
+    :return: The paths of the saved images, in the same order as jobs
+    """
+
+    start_time = time.perf_counter()
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            file_names = list(executor.map(render_plot, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        file_names = [render_plot(job) for job in jobs]
+
+    elapsed = time.perf_counter() - start_time
+
+    if elapsed > 0:
+        logger.info(f'Rendered {len(jobs)} plots with {workers} worker(s) in {round(elapsed, 3)}s '
+                    f'({round(len(jobs) / elapsed, 1)} plots/sec)')
 
-        plt.show()
+    return file_names
@@ -0,0 +1,296 @@
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import tweepy as tw
+
+import metricsmanager
+
+logger = logging.getLogger()
+
+# Priorities for queued requests. Lower values are sent first when an endpoint's budget frees up
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+# Twitter's rate limit window in seconds. Used until an endpoint's response headers say otherwise
+RATE_WINDOW = 15 * 60
+
+# The shortest time in seconds to wait after being rate limited, in case the reported reset time has already passed
+MIN_BACKOFF = 5
+
+
+def endpoint_from_url(url: str) -> str:
+    """
+    Turns the URL of an API request into the endpoint name used by the scheduler
+    :param url: The full request URL, such as https://api.twitter.com/1.1/users/lookup.json?user_id=1
+    :return: The endpoint name, such as /users/lookup
+    """
+
+    path = urlparse(url).path
+
+    if path.startswith('/1.1'):
+        path = path[len('/1.1'):]
+
+    return path.rsplit('.json', 1)[0]
+
+
+class EndpointBudget:
+    """
+    The remaining requests and reset time of one endpoint along with the requests waiting for it. The limit and
+    remaining requests are None until the endpoint's response headers report them.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.limit = None
+        self.remaining = None
+        self.reset = 0
+        self.condition = threading.Condition()
+        self.queue = []
+
+        self.calls = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.rate_limited = 0
+
+
+class ThreadResponseAPI(tw.API):
+    """
+    Tweepy API client that keeps last_response separately for every thread. Tweepy records each response on the shared
+    client, so with several threads sending requests the last response is often another thread's. Since a request is
+    sent on the thread that called it, each thread here only sees the response of its own latest request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._responses = threading.local()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def last_response(self):
+        return getattr(self._responses, 'response', None)
+
+    @last_response.setter
+    def last_response(self, response):
+        self._responses.response = response
+
+
+class RateScheduler:
+    """
+    Sends API requests within each endpoint's rate limit. Budgets are tracked separately for every endpoint using the
+    x-rate-limit headers of responses, so requests to endpoints with budget left keep going while an exhausted endpoint
+    cools down. Requests waiting on the same endpoint are released in order of priority. The api should be a
+    ThreadResponseAPI, so each request is matched with its own response. With a plain tweepy API, requests made from
+    several threads at once may update budgets from another thread's response.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.budgets = {}
+        self._lock = threading.Lock()
+        self._tickets = itertools.count()
+
+    def get_budget(self, endpoint: str) -> EndpointBudget:
+        """
+        Gets the budget of an endpoint, creating it on first use
+        :param endpoint: The endpoint name, such as /users/lookup
+        :return: The endpoint's EndpointBudget
+        """
+
+        with self._lock:
+            if endpoint not in self.budgets:
+                self.budgets[endpoint] = EndpointBudget(endpoint)
+
+            return self.budgets[endpoint]
+
+    def call(self, endpoint: str, method, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Sends a request once the endpoint has budget for it, retrying after the reset time if it was rate limited
+        :param endpoint: The endpoint name, such as /statuses/user_timeline
+        :param method: The tweepy API method to call
+        :param args: Positional arguments for method
+        :param priority: Where the request goes in the endpoint's queue. Default is PRIORITY_NORMAL
+        :param kwargs: Keyword arguments for method
+        :return: Whatever method returns
+        """
+
+        budget = self.get_budget(endpoint)
+
+        while True:
+            self._acquire(budget, priority)
+            # A request that fails before getting a response leaves the previous response behind, which is not reused
+            previous = getattr(self.api, 'last_response', None)
+            response = None
+
+            try:
+                with metricsmanager.start_stage('fetch') as timer:
+                    result = method(*args, **kwargs)
+                    timer.add(metricsmanager.count_items(result))
+            except tw.TweepError as error:
+                response = getattr(error, 'response', None)
+
+                if isinstance(error, tw.RateLimitError):
+                    self._exhaust(budget, response)
+                    continue
+
+                raise
+            finally:
+                if response is None and getattr(self.api, 'last_response', None) is not previous:
+                    response = self.api.last_response
+
+                self._update_from_response(response)
+
+            return result
+
+    def wrap(self, endpoint: str, method, priority=PRIORITY_NORMAL):
+        """
+        Wraps an API method so every call goes through the scheduler. The wrapper can be passed to tweepy.Cursor
+        :param endpoint: The endpoint name, such as /search/tweets
+        :param method: The tweepy API method to wrap
+        :param priority: The priority of the wrapper's requests. Default is PRIORITY_NORMAL
+        :return: The wrapped method
+        """
+
+        # functools.wraps also copies pagination_mode, which tweepy.Cursor needs
+        @functools.wraps(method)
+        def scheduled(*args, **kwargs):
+            # Cursors paging by ID call the method with create=True to build a request without sending it
+            if kwargs.get('create'):
+                return method(*args, **kwargs)
+
+            return self.call(endpoint, method, *args, priority=priority, **kwargs)
+
+        return scheduled
+
+    def _acquire(self, budget: EndpointBudget, priority: int):
+        """
+        Blocks until the request is first in its endpoint's queue and the endpoint has budget left
+        :param budget: The endpoint's budget
+        :param priority: The priority of the request
+        """
+
+        ticket = (priority, next(self._tickets))
+        start_time = time.perf_counter()
+        waited = False
+        wait_timer = None
+
+        with budget.condition:
+            heapq.heappush(budget.queue, ticket)
+
+            while True:
+                now = time.time()
+
+                if budget.remaining is not None and budget.remaining <= 0 and now >= budget.reset:
+                    # A new window has started, so the budget is unknown until the next response reports it
+                    budget.remaining = None
+
+                has_budget = budget.remaining is None or budget.remaining > 0
+
+                if budget.queue[0] == ticket and has_budget:
+                    break
+
+                if not waited:
+                    waited = True
+                    wait_timer = metricsmanager.start_stage('rate_limit_wait', items=1)
+
+                if not has_budget:
+                    # Waits are capped so a reset that moves while the request sleeps is picked up
+                    budget.condition.wait(timeout=min(max(budget.reset - now, 0.01), 1.0))
+                else:
+                    budget.condition.wait()
+
+            heapq.heappop(budget.queue)
+
+            if budget.remaining is not None:
+                budget.remaining -= 1
+
+            budget.calls += 1
+
+            if waited:
+                budget.waits += 1
+                budget.wait_seconds += time.perf_counter() - start_time
+                wait_timer.stop()
+
+            budget.condition.notify_all()
+
+    def _exhaust(self, budget: EndpointBudget, response):
+        """
+        Marks an endpoint as out of budget after it rate limited a request
+        :param budget: The endpoint's budget
+        :param response: The response of the rate limited request. Can be None
+        """
+
+        reset = None
+
+        if response is not None and response.headers.get('x-rate-limit-reset') is not None:
+            reset = int(response.headers['x-rate-limit-reset'])
+
+        with budget.condition:
+            budget.remaining = 0
+            budget.reset = reset if reset is not None else time.time() + RATE_WINDOW
+            budget.reset = max(budget.reset, time.time() + MIN_BACKOFF)
+            budget.rate_limited += 1
+
+        print(f'Rate limit reached for {budget.endpoint}! Waiting until it resets...')
+        logger.warning(f'Rate limit reached for {budget.endpoint}. Requests will resume at '
+                       f'{time.strftime("%H:%M:%S", time.localtime(budget.reset))}')
+
+    def _update_from_response(self, response):
+        """
+        Updates an endpoint's budget from the x-rate-limit headers of a response
+        :param response: The most recent API response. Can be None
+        """
+
+        if response is None or response.headers.get('x-rate-limit-remaining') is None:
+            return
+
+        budget = self.get_budget(endpoint_from_url(response.url))
+        remaining = int(response.headers['x-rate-limit-remaining'])
+        reset = int(response.headers.get('x-rate-limit-reset', budget.reset))
+
+        with budget.condition:
+            if response.headers.get('x-rate-limit-limit') is not None:
+                budget.limit = int(response.headers['x-rate-limit-limit'])
+
+            if budget.remaining is None or reset > budget.reset:
+                budget.remaining = remaining
+                budget.reset = reset
+            else:
+                # Requests still in flight have already been taken off the local count
+                budget.remaining = min(budget.remaining, remaining)
+
+            budget.condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Gets the request and waiting counters of every endpoint
+        :return: A dictionary mapping each endpoint to its calls, waits, wait_seconds, and rate_limited counts
+        """
+
+        with self._lock:
+            budgets = list(self.budgets.values())
+
+        return {budget.endpoint: {'calls': budget.calls, 'waits': budget.waits,
+                                  'wait_seconds': round(budget.wait_seconds, 3), 'rate_limited': budget.rate_limited}
+                for budget in budgets}
+
+    def total_wait_seconds(self) -> float:
+        """
+        Gets the total time requests have spent waiting for budget
+        :return: The waiting time in seconds across all endpoints
+        """
+
+        return sum(endpoint_stats['wait_seconds'] for endpoint_stats in self.stats().values())
+
+    def log_stats(self):
+        """
+        Writes the counters of every endpoint to the log
+        """
+
+        for endpoint, endpoint_stats in self.stats().items():
+            logger.info(f'{endpoint}: {endpoint_stats["calls"]} calls, {endpoint_stats["waits"]} waited for '
+                        f'{endpoint_stats["wait_seconds"]}s, rate limited {endpoint_stats["rate_limited"]} times')
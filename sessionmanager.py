@@ -0,0 +1,63 @@
+import logging
+import os
+import threading
+
+import tweepy as tw
+
+import ratemanager
+
+logger = logging.getLogger()
+
+_auth = None
+_api = None
+_scheduler = None
+
+# Jobs in several threads can ask for the session at once, and there must only ever be one scheduler
+_session_lock = threading.RLock()
+
+
+def get_auth() -> tw.OAuthHandler:
+    """
+    Creates the OAuth handler from the CONSUMER_KEY and CONSUMER_SECRET settings once and reuses it for later calls
+    :return: The shared OAuthHandler. Access tokens are set by tweetplot.login()
+    """
+
+    global _auth
+
+    with _session_lock:
+        if _auth is None:
+            _auth = tw.OAuthHandler(str(os.getenv('CONSUMER_KEY')), str(os.getenv('CONSUMER_SECRET')))
+
+    return _auth
+
+
+def get_api() -> tw.API:
+    """
+    Creates the Twitter API client once and reuses it for later calls
+    :return: The shared tweepy API
+    """
+
+    global _api
+
+    with _session_lock:
+        if _api is None:
+            # Rate limits are handled per endpoint by the scheduler instead of tweepy, which would stall every
+            # endpoint at once. Responses are kept per thread, so the scheduler reads the one of its own request
+            _api = ratemanager.ThreadResponseAPI(get_auth(), wait_on_rate_limit=False)
+
+    return _api
+
+
+def get_scheduler() -> ratemanager.RateScheduler:
+    """
+    Creates the rate limit scheduler of the shared API client once and reuses it for later calls
+    :return: The shared RateScheduler
+    """
+
+    global _scheduler
+
+    with _session_lock:
+        if _scheduler is None:
+            _scheduler = ratemanager.RateScheduler(get_api())
+
+    return _scheduler
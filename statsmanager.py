@@ -1,8 +1,14 @@
+from collections import namedtuple
+
 import numpy as np
 import pandas as pd
-import scipy.stats as stats
+
+import metricsmanager
+
+# scipy.stats takes about half a second to import, so it is imported inside the functions that use it
 
 
+@metricsmanager.timed('stats')
 def is_normal_dist(data):
     """
     Uses scipy's normality test to determine whether a distribution of data is normal. Only valid when n > 20
@@ -10,6 +16,8 @@ def is_normal_dist(data):
     :return: True if the p value for the test is less than 0.05, False otherwise
     """
 
+    from scipy import stats
+
     # if len(data) < 20:
     #     print('Kurtosis test is not valid for n < 20, so normal test cannot be run!')
     #
@@ -28,6 +36,7 @@ def is_normal_dist(data):
         return False
 
 
+@metricsmanager.timed('stats')
 def do_t_test(data1: pd.DataFrame, data2: pd.DataFrame, mode='interactions', tail='two') -> tuple:
     """
     Uses Welch's t-test on the indicated variables. Scipy by default does a two-sided test, so changes to the p-value
@@ -40,6 +49,8 @@ def do_t_test(data1: pd.DataFrame, data2: pd.DataFrame, mode='interactions', tai
     :return: A tuple of the p value and test statistic. Number of each may vary by mode.
     """
 
+    from scipy import stats
+
     if mode == 'interactions':
         # For favorites
         fav_stat, fav_p_val = stats.ttest_ind(data1['favorites'], data2['favorites'], equal_var=False,
@@ -97,6 +108,17 @@ def format_tweet_from_stats(data: tuple, test_type='t', opt_data=[]) -> str:
                    f', {rt_stat} (Retweets)'
 
 
+# The interactions summarized by summarize_interactions() and compared by welch_pairwise()
+INTERACTION_COLUMNS = ['favorites', 'retweets']
+
+# The results of fitting a line to data with summarize_regression(). fitted and resid are NumPy arrays, avg_over_est is
+# the mean of the positive residuals, and avg_under_est is the mean of the negative residuals
+RegressionSummary = namedtuple('RegressionSummary', ['slope', 'intercept', 'r_val', 'r_sq', 'p_val', 'std_err',
+                                                     'fitted', 'resid', 'avg_over_est', 'avg_under_est',
+                                                     'avg_resid'])
+
+
+@metricsmanager.timed('stats')
 def calculate_resids(slope: float, intercept: float, actuals: [], interval=[], x_vals=[]) -> pd.DataFrame:
     """
     Calculates the residuals of a linear fit given the slope and intercpet of the fitted line
@@ -108,7 +130,10 @@ def calculate_resids(slope: float, intercept: float, actuals: [], interval=[], x
     :param intercept: The intercept of the fitted line
     :return: A pandas dataframe containing the columns 'fitted', 'actual', 'resid'
     """
-    if len(interval) == 2:
+
+    if len(x_vals) > 0:
+        x_vals = np.asarray(x_vals, dtype=float)
+    elif len(interval) == 2:
         start_int = interval[0]
         end_int = interval[1]
 
@@ -116,35 +141,267 @@ def calculate_resids(slope: float, intercept: float, actuals: [], interval=[], x
             raise ValueError('The start value of the interval must be lower than the end value of the interval!')
         if type(start_int) != int or type(end_int) != int:
             raise TypeError('Interval start and end points must be integers!')
-        else:
-            # Numpy by default creates a half-open interval, so for integer values adding one to the end gets the entire
-            # interval
-            end_int += 1
-    elif interval is [] and x_vals is not []:
-        pass
+
+        # Numpy by default creates a half-open interval, so for integer values adding one to the end gets the entire
+        # interval
+        x_vals = np.arange(start=start_int, stop=end_int + 1)
     else:
-        pass
-    # raise ValueError('Invalid number of inputs in interval! Must have one starting and one ending value!')
-    if interval is [] and x_vals is []:
         raise SyntaxError('Either an interval or x values are required!')
 
-    fitted_vals = []
+    actuals = np.asarray(actuals, dtype=float)
+    fitted_vals = slope * x_vals + intercept
+
+    return pd.DataFrame({'fitted': fitted_vals, 'actual': actuals, 'resid': actuals - fitted_vals})
+
+
+@metricsmanager.timed('stats')
+def summarize_regression(x_vals, y_vals) -> RegressionSummary:
+    """
+    Fits a least squares line to data and calculates its fitted values, residuals, and fit statistics in one pass
+    :param x_vals: The explanatory (x) values. Can be a list, NumPy array, or pandas series
+    :param y_vals: The response (y) values. Must be the same length as x_vals
+    :return: A RegressionSummary of the fit. The means of empty groups of residuals are NaN
+    """
+
+    from scipy import stats
+
+    x_vals = np.asarray(x_vals, dtype=float)
+    y_vals = np.asarray(y_vals, dtype=float)
+
+    lin_model = stats.linregress(x_vals, y_vals)
+    fitted_vals = lin_model.slope * x_vals + lin_model.intercept
+    resids = y_vals - fitted_vals
+
+    over_est = resids[resids > 0]
+    under_est = resids[resids < 0]
+
+    return RegressionSummary(slope=lin_model.slope, intercept=lin_model.intercept, r_val=lin_model.rvalue,
+                             r_sq=lin_model.rvalue ** 2, p_val=lin_model.pvalue, std_err=lin_model.stderr,
+                             fitted=fitted_vals, resid=resids,
+                             avg_over_est=over_est.mean() if over_est.size > 0 else np.nan,
+                             avg_under_est=under_est.mean() if under_est.size > 0 else np.nan,
+                             avg_resid=resids.mean() if resids.size > 0 else np.nan)
+
+
+def summarize_interactions(frame: pd.DataFrame, by=None) -> pd.DataFrame:
+    """
+    Calculates the sufficient statistics of the favorites and retweets of tweets, which is everything a Welch t-test
+    needs. Missing values are left out
+    :param frame: A dataframe of tweets with favorites and retweets columns
+    :param by: Optional column to summarize each group of, such as screen_name. Default is None (One summary)
+    :return: A dataframe with one row per group and the columns <column>_n, <column>_mean, and <column>_var for each
+    of INTERACTION_COLUMNS
+    """
+
+    groups = frame.groupby(by, observed=True) if by is not None else frame.groupby(lambda index: 0)
+    summary = groups[INTERACTION_COLUMNS].agg(['count', 'mean', 'var'])
+    summary.columns = [f'{column}_{stat.replace("count", "n")}' for column, stat in summary.columns]
+
+    return summary
+
+
+class RunningStats:
+    """
+    Count, mean, and variance of a stream of values, kept with Welford's algorithm so values never have to be stored.
+    A batch of values is reduced to its own count, mean, and sum of squared deviations and folded in with the parallel
+    form of the algorithm, which is also how the states of separate workers are combined with merge(). Missing values
+    are left out.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = int(count)
+        self.mean = float(mean)
+        # Sum of squared deviations from the mean
+        self.m2 = float(m2)
+
+    def update(self, values):
+        """
+        Adds values to the running statistics
+        :param values: An array-like of numbers
+        :return: These statistics, so calls can be chained
+        """
+
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+
+        if len(values) > 0:
+            batch_mean = values.mean()
+            self.merge(RunningStats(len(values), batch_mean, np.square(values - batch_mean).sum()))
+
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values of other running statistics to these ones
+        :param other: The RunningStats to merge
+        :return: These statistics, so calls can be chained
+        """
+
+        total = self.count + other.count
+
+        if other.count > 0:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / total
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+            self.count = total
+
+        return self
 
-    if x_vals is not []:
-        for x in x_vals:
-            value = (slope * x) + intercept
+    @property
+    def variance(self) -> float:
+        """
+        The sample variance (ddof=1) of the values, or NaN if there are fewer than 2
+        """
 
-            fitted_vals.append(value)
+        return self.m2 / (self.count - 1) if self.count > 1 else float('nan')
+
+
+class InteractionStats:
+    """
+    Running statistics of the favorites and retweets of a tweet dataset. They are updated as tweets are saved, so
+    summaries for welch_pairwise() never need the tweets themselves.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = {column: RunningStats() for column in INTERACTION_COLUMNS}
+
+        if columns is not None:
+            self.columns.update(columns)
+
+    def update(self, frame: pd.DataFrame):
+        """
+        Adds tweets to the running statistics
+        :param frame: A dataframe of tweets with favorites and retweets columns
+        :return: These statistics, so calls can be chained
+        """
+
+        for column, running in self.columns.items():
+            running.update(frame[column].to_numpy())
+
+        return self
+
+    def merge(self, other):
+        """
+        Adds the tweets of other interaction statistics, such as those of another worker, to these ones
+        :param other: The InteractionStats to merge
+        :return: These statistics, so calls can be chained
+        """
+
+        for column, running in self.columns.items():
+            running.merge(other.columns[column])
+
+        return self
+
+    def summary(self) -> dict:
+        """
+        Gets the statistics in the form made by summarize_interactions()
+        :return: A dictionary with <column>_n, <column>_mean, and <column>_var for each of INTERACTION_COLUMNS
+        """
+
+        summary = {}
+
+        for column, running in self.columns.items():
+            summary.update({f'{column}_n': running.count, f'{column}_mean': running.mean if running.count > 0
+                            else float('nan'), f'{column}_var': running.variance})
+
+        return summary
+
+    def to_dict(self) -> dict:
+        """
+        Gets the state of the statistics for saving
+        :return: A dictionary mapping each column to its count, mean, and m2
+        """
+
+        return {column: {'count': running.count, 'mean': running.mean, 'm2': running.m2}
+                for column, running in self.columns.items()}
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        """
+        Restores statistics saved with to_dict()
+        :param state: A dictionary mapping each column to its count, mean, and m2
+        :return: The InteractionStats
+        """
+
+        return cls({column: RunningStats(**values) for column, values in state.items()})
+
+
+def adjust_p_values(p_vals: np.ndarray, correction='holm') -> np.ndarray:
+    """
+    Corrects p-values for making several comparisons at once
+    :param p_vals: The uncorrected p-values
+    :param correction: The correction to use. Valid inputs are holm, bonferroni, bh (Benjamini-Hochberg false discovery
+    rate), or None (No correction). Default is holm
+    :return: The corrected p-values, in the same order as p_vals. NaN p-values stay NaN
+    """
+
+    p_vals = np.asarray(p_vals, dtype=float)
+
+    if correction is not None and correction not in ('holm', 'bonferroni', 'bh'):
+        raise ValueError(f'Unknown p-value correction {correction}! Valid corrections are holm, bonferroni, and bh')
+
+    # Tests that could not be run (Such as a group with fewer than 2 tweets) have NaN p-values. They stay NaN and are
+    # not counted as comparisons, so they cannot change the other corrected p-values
+    tested = ~np.isnan(p_vals)
+    count = int(tested.sum())
+    corrected = p_vals.copy()
+
+    if correction is None or count == 0:
+        return corrected
+
+    ranked_vals = p_vals[tested]
+
+    if correction == 'bonferroni':
+        corrected[tested] = np.minimum(ranked_vals * count, 1.0)
+        return corrected
+
+    order = np.argsort(ranked_vals)
+    ranked = ranked_vals[order]
+
+    if correction == 'holm':
+        adjusted = np.maximum.accumulate((count - np.arange(count)) * ranked)
     else:
-        for x in np.arange(start=start_int, stop=end_int):
-            value = (slope * x) + intercept
+        adjusted = np.minimum.accumulate((ranked * count / np.arange(1, count + 1))[::-1])[::-1]
+
+    tested_adj = np.empty(count)
+    tested_adj[order] = np.minimum(adjusted, 1.0)
+    corrected[tested] = tested_adj
+
+    return corrected
+
+
+@metricsmanager.timed('stats')
+def welch_pairwise(summaries: pd.DataFrame, column='favorites', correction='holm', alpha=0.05) -> pd.DataFrame:
+    """
+    Runs two-sided Welch's t-tests between every pair of groups at once using only their summary statistics
+    :param summaries: A dataframe from summarize_interactions(), indexed by group such as screen name
+    :param column: The interaction to compare. Valid inputs are favorites or retweets. Default is favorites
+    :param correction: The multiple comparison correction [See statsmanager.adjust_p_values()]. Default is holm
+    :param alpha: The significance level applied to the corrected p-values. Default is 0.05
+    :return: A dataframe with one row per pair and the columns user1, user2, t_stat, df, p_val, p_adj, and
+    significant. A positive t_stat means user1 has the higher mean
+    """
+
+    from scipy import stats
 
-            fitted_vals.append(value)
+    counts = summaries[f'{column}_n'].to_numpy(dtype=float)
+    means = summaries[f'{column}_mean'].to_numpy(dtype=float)
+    variances = summaries[f'{column}_var'].to_numpy(dtype=float)
+    first, second = np.triu_indices(len(summaries), k=1)
 
-    resids = np.subtract(actuals, fitted_vals)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        first_err = variances[first] / counts[first]
+        second_err = variances[second] / counts[second]
+        std_err = np.sqrt(first_err + second_err)
 
-    data = {'fitted': fitted_vals, 'actual': actuals, 'resid': resids}
+        t_stats = (means[first] - means[second]) / std_err
+        # Welch-Satterthwaite degrees of freedom
+        dfs = (first_err + second_err) ** 2 / (first_err ** 2 / (counts[first] - 1) +
+                                                second_err ** 2 / (counts[second] - 1))
+        p_vals = 2 * stats.t.sf(np.abs(t_stats), dfs)
 
-    # print(len(fitted_vals), len(actuals), len(resids))
+    p_adj = adjust_p_values(p_vals, correction)
+    names = summaries.index.to_numpy()
 
-    return pd.DataFrame(data)
+    return pd.DataFrame({'user1': names[first], 'user2': names[second], 't_stat': t_stats, 'df': dfs,
+                         'p_val': p_vals, 'p_adj': p_adj, 'significant': ~np.isnan(p_adj) & (p_adj < alpha)})
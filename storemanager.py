@@ -0,0 +1,168 @@
+import logging
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+import cachemanager
+
+logger = logging.getLogger()
+
+# The columns of the tweets table, in the same order as a tweet dataframe [See datamanager.tweets_to_frame()]
+TWEET_COLUMNS = ['tweet_ID', 'text', 'favorites', 'retweets', 'screen_name', 'tweet_times']
+
+# Format tweet times are stored in. Times in this format sort in the same order as the times themselves
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# How long a connection waits for another thread or process to finish writing, in seconds
+BUSY_TIMEOUT = 30
+
+
+class TweetStore:
+    """
+    SQLite store of every tweet saved by any search, keyed by tweet ID. A tweet found by several searches is stored
+    once, and the searches that found it are kept as tags. Tweets are indexed by screen name, time, and tag, so subsets
+    can be loaded without reading every saved file. The store runs in WAL mode, so it can be read while another thread
+    or process writes to it.
+    """
+
+    def __init__(self, path=''):
+        self.path = path if path != '' else cachemanager.make_cache_path('tweet_store.sqlite')
+
+        with closing(self.connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript('CREATE TABLE IF NOT EXISTS tweets (tweet_ID INTEGER PRIMARY KEY, text TEXT NOT NULL, '
+                               'favorites INTEGER NOT NULL, retweets INTEGER NOT NULL, screen_name TEXT NOT NULL, '
+                               'tweet_times TEXT NOT NULL);'
+                               'CREATE TABLE IF NOT EXISTS tweet_tags (tag TEXT NOT NULL, tweet_ID INTEGER NOT NULL, '
+                               'PRIMARY KEY (tag, tweet_ID)) WITHOUT ROWID;'
+                               'CREATE INDEX IF NOT EXISTS tweets_by_screen_name ON tweets '
+                               '(screen_name COLLATE NOCASE);'
+                               'CREATE INDEX IF NOT EXISTS tweets_by_time ON tweets (tweet_times);'
+                               'CREATE INDEX IF NOT EXISTS tags_by_tweet ON tweet_tags (tweet_ID);')
+            conn.commit()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens a connection to the store
+        :return: The connection. Close it when done
+        """
+
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        # Safe in WAL mode, and much faster than waiting for every commit to reach the disk
+        conn.execute('PRAGMA synchronous=NORMAL')
+
+        return conn
+
+    @staticmethod
+    def make_tag(tag: str) -> str:
+        """
+        Normalizes the name of a search into a tag
+        :param tag: The name of the search, such as a topic or username
+        :return: The lowercased tag
+        """
+
+        return str(tag).lower()
+
+    def upsert(self, frame: pd.DataFrame, tag=None) -> int:
+        """
+        Adds tweets to the store. Tweets that are already stored have their text, favorites, and retweets updated
+        :param frame: A dataframe of tweets with the columns in TWEET_COLUMNS
+        :param tag: The name of the search that found the tweets, or a list of names. Default is None (No tag)
+        :return: How many tweets were added or updated
+        """
+
+        if len(frame) == 0:
+            return 0
+
+        tags = [] if tag is None else [tag] if isinstance(tag, str) else list(tag)
+
+        rows = frame[TWEET_COLUMNS].assign(tweet_times=pd.to_datetime(frame['tweet_times']).dt.strftime(TIME_FORMAT))
+        rows = list(rows.astype({'tweet_ID': 'int64', 'favorites': 'int64', 'retweets': 'int64',
+                                 'screen_name': 'str'}).itertuples(index=False, name=None))
+        rows = [(int(tweet_id), str(text), int(favorites), int(retweets), screen_name, times)
+                for tweet_id, text, favorites, retweets, screen_name, times in rows]
+
+        with closing(self.connect()) as conn:
+            conn.executemany('INSERT INTO tweets VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (tweet_ID) DO UPDATE SET '
+                             'text = excluded.text, favorites = excluded.favorites, retweets = excluded.retweets',
+                             rows)
+
+            for tag_name in tags:
+                conn.executemany('INSERT OR IGNORE INTO tweet_tags VALUES (?, ?)',
+                                 [(self.make_tag(tag_name), row[0]) for row in rows])
+
+            conn.commit()
+
+        return len(rows)
+
+    def _make_filter(self, screen_name=None, tag=None, since=None, until=None) -> tuple:
+        """
+        Builds the WHERE clause of a query
+        :param screen_name: Only tweets by this user. Not case sensitive
+        :param tag: Only tweets found by this search
+        :param since: Only tweets posted at or after this time
+        :param until: Only tweets posted before this time
+        :return: A tuple of the clause (Empty if there are no filters) and its parameters
+        """
+
+        conditions = []
+        params = []
+
+        if screen_name is not None:
+            conditions.append('screen_name = ? COLLATE NOCASE')
+            params.append(str(screen_name))
+
+        if tag is not None:
+            conditions.append('tweet_ID IN (SELECT tweet_ID FROM tweet_tags WHERE tag = ?)')
+            params.append(self.make_tag(tag))
+
+        if since is not None:
+            conditions.append('tweet_times >= ?')
+            params.append(pd.Timestamp(since).strftime(TIME_FORMAT))
+
+        if until is not None:
+            conditions.append('tweet_times < ?')
+            params.append(pd.Timestamp(until).strftime(TIME_FORMAT))
+
+        clause = ' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''
+
+        return clause, params
+
+    def query(self, screen_name=None, tag=None, since=None, until=None, columns=None, limit=None) -> pd.DataFrame:
+        """
+        Loads the stored tweets that match every given filter, newest first
+        :param screen_name: Only tweets by this user. Not case sensitive. Default is None (Any user)
+        :param tag: Only tweets found by this search. Default is None (Any search)
+        :param since: Only tweets posted at or after this time. Default is None
+        :param until: Only tweets posted before this time. Default is None
+        :param columns: Optional list of columns to load. Default is None (All of TWEET_COLUMNS)
+        :param limit: The most tweets to load. Default is None (No limit)
+        :return: A dataframe of the matching tweets. Columns are not typed [See datamanager.type_tweet_frame()]
+        """
+
+        columns = TWEET_COLUMNS if columns is None else columns
+        unknown = [column for column in columns if column not in TWEET_COLUMNS]
+
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown tweet columns {", ".join(unknown)}! Valid columns are '
+                             f'{", ".join(TWEET_COLUMNS)}')
+
+        clause, params = self._make_filter(screen_name, tag, since, until)
+        sql = f'SELECT {", ".join(columns)} FROM tweets{clause} ORDER BY tweet_ID DESC'
+
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+
+        with closing(self.connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def count(self) -> int:
+        """
+        Counts the stored tweets
+        :return: The number of tweets in the store
+        """
+
+        with closing(self.connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM tweets').fetchone()[0]
@@ -0,0 +1,17 @@
+import cachemanager
+
+
+def test_user_cache_finds_ids_given_as_strings():
+    cache = cachemanager.UserCache()
+    cache.put(cachemanager.CachedUser(12345, 'Alice', False))
+
+    assert cache.get('12345') == cache.get(12345) == cache.get('alice')
+    assert cache.get('12345').screen_name == 'Alice'
+
+
+def test_user_cache_keeps_all_digit_screen_names_apart_from_ids():
+    cache = cachemanager.UserCache()
+    cache.put(cachemanager.CachedUser(1, '12345', False))
+
+    assert cache.get(12345) is None
+    assert cache.get(1).screen_name == '12345'
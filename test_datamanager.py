@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+import datamanager as dm
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Saves and caches are made relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dm, '_summary_cache', None)
+
+    return tmp_path
+
+
+def make_frame(rows: []) -> pd.DataFrame:
+    frame = pd.DataFrame(rows, columns=['tweet_ID', 'text', 'favorites', 'retweets', 'screen_name', 'tweet_times'])
+
+    return dm.type_tweet_frame(frame)
+
+
+def test_interaction_summary_of_user_leaves_out_retweets_and_likes(workdir):
+    frame = make_frame([(1, 'own tweet', 10, 2, 'Alice', '2020-01-01 12:00:00'),
+                        (2, 'another one', 20, 4, 'Alice', '2020-01-01 13:00:00'),
+                        (3, 'RT @bob: shared', 900, 300, 'Alice', '2020-01-01 14:00:00'),
+                        (4, 'liked tweet', 5000, 1000, 'bob', '2020-01-01 15:00:00')])
+    dm.write_tweet_frame(frame, dm.make_file_name_for_search('alice'), storage='csv')
+
+    summary = dm.get_interaction_summary('alice', storage='csv', user='alice')
+
+    assert summary['favorites_n'] == 2
+    assert summary['favorites_mean'] == 15
+    assert dm.get_interaction_summary('alice', storage='csv')['favorites_n'] == 4
+
+
+def test_bounded_merge_keeps_counts_as_overestimates():
+    first = dm.FrequencyAggregator(capacity=2).update(['x'] * 5 + ['y'] * 3)
+    second = dm.FrequencyAggregator(capacity=2).update(['x'] * 2 + ['z'] * 4 + ['w'] * 4)
+    true_counts = {'x': 7, 'y': 3, 'z': 4, 'w': 4}
+
+    first.merge(second)
+
+    assert first.total == 18
+    assert first.counts['x'] >= true_counts['x']
+
+    for word, count in first.counts.items():
+        assert count - first.errors[word] <= true_counts[word] <= count
+
+
+@pytest.mark.parametrize('rows, columns', [({'tweet_ID': [1], 'text': ['baseline save']}, ['favorites', 'retweets']),
+                                           ({'tweet_ID': [1, 2], 'favorites': [1, None]}, None)])
+def test_unloadable_files_give_none(tmp_path, rows, columns):
+    save_file = str(tmp_path / 'broken_tweets.csv')
+    pd.DataFrame(rows).to_csv(save_file, index=False)
+
+    assert dm.get_dataframe_from_file(save_file, columns=columns) is None
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import statsmanager as sm
+
+
+@pytest.mark.parametrize('correction, expected', [('holm', [0.02, np.nan, 0.04]),
+                                                  ('bonferroni', [0.02, np.nan, 0.08]),
+                                                  ('bh', [0.02, np.nan, 0.04])])
+def test_adjust_p_values_leaves_nan_out(correction, expected):
+    corrected = sm.adjust_p_values([0.01, np.nan, 0.04], correction)
+
+    np.testing.assert_allclose(corrected, expected)
+
+
+def test_welch_pairwise_never_marks_untestable_pairs_significant():
+    summaries = pd.DataFrame({'favorites_n': [50, 50, 1], 'favorites_mean': [1.0, 30.0, 5.0],
+                              'favorites_var': [1.0, 1.0, np.nan]}, index=['user1', 'user2', 'user3'])
+
+    results = sm.welch_pairwise(summaries, column='favorites').set_index(['user1', 'user2'])
+
+    assert results.loc[('user1', 'user2'), 'significant']
+    assert np.isnan(results.loc[('user1', 'user3'), 'p_adj'])
+    assert not results.loc[('user1', 'user3'), 'significant']
+    assert not results.loc[('user2', 'user3'), 'significant']
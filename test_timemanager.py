@@ -0,0 +1,27 @@
+import pandas as pd
+
+import datamanager as dm
+import timemanager as tm
+
+
+def test_parse_tweet_times_converts_mixed_offsets_to_naive_utc():
+    times = pd.Series(['2020-01-01 12:00:00+00:00', '2020-01-01 14:00:00+02:00', '2020-01-01 07:00:00-05:00',
+                       'not a time'])
+
+    parsed = tm.parse_tweet_times(times)
+
+    assert parsed.dt.tz is None
+    assert parsed[:3].tolist() == [pd.Timestamp('2020-01-01 12:00:00')] * 3
+    assert pd.isna(parsed[3])
+
+
+def test_saved_tweets_with_mixed_offsets_load_as_naive_utc(tmp_path):
+    save_file = str(tmp_path / 'mixed_tweets.csv')
+    pd.DataFrame({'tweet_ID': [1, 2], 'text': ['first', 'second'], 'favorites': [1, 2], 'retweets': [0, 1],
+                  'screen_name': ['alice', 'alice'],
+                  'tweet_times': ['2020-01-01 12:00:00+00:00', '2020-01-01 14:00:00+02:00']}).to_csv(save_file)
+
+    frame = dm.get_dataframe_from_file(save_file)
+
+    assert frame['tweet_times'].dt.tz is None
+    assert frame['tweet_times'].tolist() == [pd.Timestamp('2020-01-01 12:00:00')] * 2
@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+
+import metricsmanager
+
+# Length of each kind of time bucket. Week buckets start on Mondays
+TIME_BUCKETS = {'hour': np.timedelta64(1, 'h'), 'day': np.timedelta64(1, 'D'), 'week': np.timedelta64(7, 'D')}
+
+# How many buckets the rolling windows of each kind of bucket cover by default: a day of hours, a week of days, and
+# about a month of weeks
+ROLLING_WINDOWS = {'hour': 24, 'day': 7, 'week': 4}
+
+# The values calculated for every time bucket. Rates are the mean favorites or retweets per tweet
+ACTIVITY_COLUMNS = ['tweets', 'favorites', 'retweets', 'favorites_rate', 'retweets_rate']
+
+# Names of the days of the week, in the order of the rows of weekly_profile()
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# 1970-01-01, the first day of datetime64, was a Thursday. Adding this many days before dividing by 7 puts Mondays at 0
+EPOCH_WEEKDAY = 3
+
+
+def parse_tweet_times(times: pd.Series) -> pd.Series:
+    """
+    Parses tweet times into datetimes. Times that are already datetimes, such as the ones in a frame loaded by
+    datamanager, are returned as they are, so times are only ever parsed once
+    :param times: The tweet_times column of a tweet dataframe
+    :return: The times as timezone-naive UTC datetimes. Times that cannot be parsed become NaT
+    """
+
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        # Parsing as UTC lets times with different offsets share one column. Times without an offset are already UTC
+        times = pd.to_datetime(times, errors='coerce', utc=True)
+
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_convert('UTC').dt.tz_localize(None)
+
+    return times
+
+
+def _check_bucket(bucket: str):
+    """
+    Raises an error for unknown kinds of time buckets
+    :param bucket: The kind of bucket
+    """
+
+    if bucket not in TIME_BUCKETS:
+        raise ValueError(f'Invalid time bucket {bucket}! Valid buckets are {", ".join(TIME_BUCKETS.keys())}')
+
+
+def _count_buckets(frame: pd.DataFrame, bucket: str, by=None) -> tuple:
+    """
+    Counts the tweets, favorites, and retweets of every time bucket of every group with np.bincount, so no Python code
+    runs per tweet. Every bucket between the first and last tweet is counted, even when it is empty
+    :param frame: A dataframe of tweets with tweet_times, favorites, and retweets columns
+    :param bucket: The kind of time bucket. Valid inputs are hour, day, or week
+    :param by: Optional column to count each group of separately, such as screen_name. Default is None (One group)
+    :return: A tuple of the group names (None without by), the start of each bucket, and 2D arrays of tweets,
+    favorites, and retweets with one row per group and one column per bucket. None if there are no tweets
+    """
+
+    _check_bucket(bucket)
+
+    times = parse_tweet_times(frame['tweet_times']).to_numpy(dtype='datetime64[ns]')
+    has_time = ~np.isnat(times)
+
+    if has_time.all():
+        # Skips copying every column just to drop nothing
+        has_time = slice(None)
+
+    times = times[has_time]
+
+    if len(times) == 0:
+        return None
+
+    step = TIME_BUCKETS[bucket].astype('timedelta64[ns]')
+    first = times.min().astype('datetime64[D]')
+
+    if bucket == 'week':
+        first = first - ((first.astype(np.int64) + EPOCH_WEEKDAY) % 7)
+    elif bucket == 'hour':
+        first = times.min().astype('datetime64[h]')
+
+    first = first.astype('datetime64[ns]')
+    # Integer division of nanoseconds is several times faster than dividing datetimes
+    bucket_index = (times.view(np.int64) - first.astype(np.int64)) // step.astype(np.int64)
+    bucket_count = int(bucket_index.max()) + 1
+
+    if by is not None:
+        # Categorical columns, such as screen_name, are factorized from their codes without reading any strings. Missing
+        # names are kept as a group of their own
+        group_codes, groups = pd.factorize(frame[by], sort=True, use_na_sentinel=False)
+        group_codes = group_codes[has_time]
+        groups = np.asarray(groups)
+    else:
+        group_codes, groups = 0, None
+
+    group_count = len(groups) if groups is not None else 1
+    cells = group_codes * bucket_count + bucket_index
+    size = group_count * bucket_count
+    shape = (group_count, bucket_count)
+
+    tweets = np.bincount(cells, minlength=size).reshape(shape)
+    favorites = np.bincount(cells, weights=frame['favorites'].to_numpy(dtype=float)[has_time], minlength=size)
+    retweets = np.bincount(cells, weights=frame['retweets'].to_numpy(dtype=float)[has_time], minlength=size)
+    starts = first + np.arange(bucket_count) * step
+
+    return groups, starts, tweets, favorites.reshape(shape), retweets.reshape(shape)
+
+
+def _make_activity_frame(groups, starts: np.ndarray, tweets: np.ndarray, favorites: np.ndarray,
+                         retweets: np.ndarray, by=None, fill=True) -> pd.DataFrame:
+    """
+    Flattens the 2D arrays of _count_buckets() into a dataframe with one row per group and bucket
+    :param groups: The group names, or None if there is one group
+    :param starts: The start of each bucket
+    :param tweets: 2D array of tweets
+    :param favorites: 2D array of favorites
+    :param retweets: 2D array of retweets
+    :param by: The name of the group column. Default is None (No group column)
+    :param fill: Should buckets without tweets be kept? Default is True
+    :return: A dataframe with the by column (If given), a bucket column, and ACTIVITY_COLUMNS
+    """
+
+    bucket_count = len(starts)
+    tweets, favorites, retweets = tweets.ravel(), favorites.ravel(), retweets.ravel()
+
+    if fill:
+        cells = np.arange(len(tweets))
+    else:
+        # Only the cells with tweets are turned into rows, which matters for long spans of hours with many groups
+        cells = np.flatnonzero(tweets)
+
+    group_index, bucket_index = np.divmod(cells, bucket_count)
+
+    tweets, favorites, retweets = tweets[cells], favorites[cells], retweets[cells]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        favorites_rate = np.where(tweets > 0, favorites / tweets, np.nan)
+        retweets_rate = np.where(tweets > 0, retweets / tweets, np.nan)
+
+    columns = {'bucket': starts[bucket_index], 'tweets': tweets, 'favorites': np.rint(favorites).astype(np.int64),
+               'retweets': np.rint(retweets).astype(np.int64), 'favorites_rate': favorites_rate,
+               'retweets_rate': retweets_rate}
+
+    if by is not None:
+        columns = {by: groups[group_index], **columns}
+
+    activity = pd.DataFrame(columns)
+
+    return activity
+
+
+def _empty_activity_frame(by=None) -> pd.DataFrame:
+    """
+    Makes an activity dataframe without any rows
+    :param by: The name of the group column. Default is None (No group column)
+    :return: An empty dataframe with the columns of bucket_activity()
+    """
+
+    columns = ([by] if by is not None else []) + ['bucket'] + ACTIVITY_COLUMNS
+
+    return pd.DataFrame({column: [] for column in columns})
+
+
+@metricsmanager.timed('stats')
+def bucket_activity(frame: pd.DataFrame, bucket='day', by=None, fill=True) -> pd.DataFrame:
+    """
+    Counts the tweets, favorites, and retweets posted in each hour, day, or week, and the favorites and retweets per
+    tweet of each bucket
+    :param frame: A dataframe of tweets with tweet_times, favorites, and retweets columns
+    :param bucket: The kind of time bucket. Valid inputs are hour, day, or week. Default is day
+    :param by: Optional column to count each group of separately, such as screen_name. Default is None (One group)
+    :param fill: Should buckets without tweets be kept, so every group has every bucket? Default is True
+    :return: A dataframe with the by column (If given), the start time of each bucket, and ACTIVITY_COLUMNS. Rates are
+    NaN for buckets without tweets
+    """
+
+    counts = _count_buckets(frame, bucket, by=by)
+
+    if counts is None:
+        return _empty_activity_frame(by)
+
+    return _make_activity_frame(*counts, by=by, fill=fill)
+
+
+@metricsmanager.timed('stats')
+def rolling_activity(frame: pd.DataFrame, window=7, bucket='day', by=None) -> pd.DataFrame:
+    """
+    Totals tweets, favorites, and retweets over a rolling window of buckets, such as the last 7 days, which smooths out
+    quiet and busy buckets. Windows are summed with cumulative sums, so longer windows take no longer
+    :param frame: A dataframe of tweets with tweet_times, favorites, and retweets columns
+    :param window: How many buckets each window covers. Default is 7
+    :param bucket: The kind of time bucket. Valid inputs are hour, day, or week. Default is day
+    :param by: Optional column to roll each group of separately, such as screen_name. Default is None (One group)
+    :return: A dataframe like bucket_activity(), where each bucket holds the totals of the window ending with it.
+    Windows near the first bucket cover fewer buckets
+    """
+
+    if window < 1:
+        raise ValueError('A rolling window must cover at least 1 bucket!')
+
+    counts = _count_buckets(frame, bucket, by=by)
+
+    if counts is None:
+        return _empty_activity_frame(by)
+
+    groups, starts, *totals = counts
+    rolled = []
+
+    for total in totals:
+        sums = np.cumsum(total, axis=1)
+        sums[:, window:] = sums[:, window:] - sums[:, :-window]
+        rolled.append(sums)
+
+    return _make_activity_frame(groups, starts, *rolled, by=by)
+
+
+@metricsmanager.timed('stats')
+def weekly_profile(frame: pd.DataFrame, value='tweets') -> pd.DataFrame:
+    """
+    Totals activity by day of the week and hour of the day, which shows when tweets are posted and when they do best
+    :param frame: A dataframe of tweets with tweet_times, favorites, and retweets columns
+    :param value: What to total. Valid inputs are any of ACTIVITY_COLUMNS. Default is tweets
+    :return: A dataframe with a row for each of WEEKDAYS and a column for each hour from 0 to 23
+    """
+
+    if value not in ACTIVITY_COLUMNS:
+        raise ValueError(f'Invalid value {value}! Valid values are {", ".join(ACTIVITY_COLUMNS)}')
+
+    times = parse_tweet_times(frame['tweet_times']).to_numpy(dtype='datetime64[ns]')
+    has_time = ~np.isnat(times)
+    hours = times[has_time].astype('datetime64[h]').astype(np.int64)
+    cells = ((hours // 24 + EPOCH_WEEKDAY) % 7) * 24 + hours % 24
+
+    tweets = np.bincount(cells, minlength=7 * 24).astype(float)
+
+    if value == 'tweets':
+        totals = tweets
+    else:
+        column = value.replace('_rate', '')
+        totals = np.bincount(cells, weights=frame[column].to_numpy(dtype=float)[has_time], minlength=7 * 24)
+
+        if value.endswith('_rate'):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                totals = np.where(tweets > 0, totals / tweets, np.nan)
+
+    return pd.DataFrame(totals.reshape(7, 24), index=WEEKDAYS, columns=range(24))
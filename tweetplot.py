@@ -6,31 +6,36 @@ import pandas as pd
 import tweepy as tw
 
 import datamanager as dm
+import metricsmanager
+import sessionmanager
 import statsmanager as sm
-from plotmaker import PlotMaker
+import timemanager as tm
+from pipeline import AnalysisPipeline
 
-consumer_key = str(os.getenv('CONSUMER_KEY'))
-consumer_secret = str(os.getenv('CONSUMER_SECRET'))
+# Number of processes used to tag tweets. Set TTVIZ_WORKERS to use more than one core
+worker_count = int(os.getenv('TTVIZ_WORKERS', '1'))
 
-access_token = str(os.getenv('ACCESS_TOKEN'))
-access_secret = str(os.getenv('ACCESS_SECRET'))
+log_format = '%(levelname)s | %(asctime)s | %(message)s'
 
-auth = tw.OAuthHandler(consumer_key, consumer_secret)
+logger = logging.getLogger()
 
-api = tw.API(auth, wait_on_rate_limit=True)
 
-log_path = os.getcwd() + '/logs/ttViz_log.log'
-log_format = '%(levelname)s | %(asctime)s | %(message)s'
+def setup_logging():
+    """
+    Sends log messages to logs/ttViz_log.log, replacing the log of the last run. Called by the command line entry
+    points so that importing ttViz's modules never touches the log
+    """
 
-if os.path.exists(os.getcwd() + '/logs/') is not True:
-    try:
-        os.mkdir("logs")
-    except IOError as error:
-        print(f'Could not create log directory {os.getcwd()}/logs/ ! Logging info will be unavailable!')
+    log_dir = os.getcwd() + '/logs/'
 
-logging.basicConfig(filename=log_path, level=logging.DEBUG, filemode='w', format=log_format)
+    if os.path.exists(log_dir) is not True:
+        try:
+            os.mkdir(log_dir)
+        except IOError:
+            print(f'Could not create log directory {log_dir} ! Logging info will be unavailable!')
+            return
 
-logger = logging.getLogger()
+    logging.basicConfig(filename=log_dir + 'ttViz_log.log', level=logging.DEBUG, filemode='w', format=log_format)
 
 
 def load_account_data() -> pd.DataFrame:
@@ -56,6 +61,8 @@ def login(account_data: pd.DataFrame):
     :param account_data: Dataframe with the account access token and secret. Can be None
     """
 
+    auth = sessionmanager.get_auth()
+
     if account_data is None or account_data.empty:
         try:
             redirect_url = auth.get_authorization_url()
@@ -102,6 +109,7 @@ def post_tweet(text: str, with_image=True, image_name=''):
     """
 
     image_path = make_path_for_image(image_name)
+    api = sessionmanager.get_api()
 
     if with_image:
         api.update_with_media(image_path, status=text)
@@ -113,30 +121,52 @@ def post_tweet(text: str, with_image=True, image_name=''):
             logger.error(f'Could not update status because {error.response}')
 
 
-def repeat_menu():
+def repeat_menu() -> bool:
     """
     Asks the user if the software should be ran again
+    :return: True if it should, False otherwise
     """
 
     if input('Run again?: ').capitalize().startswith('Y'):
-        main()
-    else:
-        print('Exiting...')
+        return True
+
+    print('Exiting...')
 
+    return False
 
-def process_command(command: str, args=[]):
+
+def process_command(command: str, args=[], workers=None, ask=input):
     """
-    Handles incoming user commands
-    :param command: A string indicating the command type. Valid types are topic, user, network, tweet
+    Handles incoming user commands, recording the time spent in each stage of the command to the log and metrics/
+    :param command: A string indicating the command type. Valid types are topic, user, network, tweet, stats, time
     :param args: Any additional information required to execute the command. Optional
+    :param workers: How many processes should tag tweets. Defaults to the TTVIZ_WORKERS setting
+    :param ask: Function that takes a prompt and returns the answer, such as a username. Default is input
     :return: Varies by command
     """
 
+    with metricsmanager.start_run(command):
+        return run_command(command, args, workers, ask=ask)
+
+
+def run_command(command: str, args=[], workers=None, ask=input):
+    """
+    Runs a user command without recording metrics
+    :param command: A string indicating the command type. Valid types are topic, user, network, tweet, stats, time
+    :param args: Any additional information required to execute the command. Optional
+    :param workers: How many processes should tag tweets. Defaults to the TTVIZ_WORKERS setting
+    :param ask: Function that takes a prompt and returns the answer, such as a username. Default is input
+    :return: Varies by command
+    """
+
+    if workers is None:
+        workers = worker_count
+
     if command == 'topic':
-        topic = input('Select a topic to search: ')
+        topic = ask('Select a topic to search: ')
         save_name = topic
         assigned_name = args[1]
-        tweet_limit = input('Input the maximum number of tweets to get (Leave blank for 100): ')
+        tweet_limit = ask('Input the maximum number of tweets to get (Leave blank for 100): ')
 
         if tweet_limit != '':
             try:
@@ -154,112 +184,107 @@ def process_command(command: str, args=[]):
         if assigned_name != '':
             save_name = assigned_name
 
-        topics_tweets_whole = dm.search_tweets_for_query(query=topic, limit=tweet_limit)
-        dm.save_tweets(save_name, to_save=topics_tweets_whole)
-        topic_tweets_text = dm.load_tweet_text(topic)
         should_plot = args[0]
 
-        topic_tweets_stripped = dm.select_pos_words(topic_tweets_text)
-        freq_file_name = dm.make_file_name_for_search(save_name, type='freq')
-        topic_tweets_frame = dm.build_frequency_frame(topic_tweets_stripped)
-
-        topic_tweets_frame.to_csv(freq_file_name)
+        with AnalysisPipeline(save_name, workers=workers, cache=dm.get_tag_cache()) as pipeline:
+            pipeline.fetch(dm.search_tweets_for_query, query=topic, limit=tweet_limit).persist().extract().count()
 
-        plot_tweets = topic_tweets_frame[topic_tweets_frame.freq >= 3]
-        plotter = PlotMaker(f'Frequency of Words Used When Tweeting About {save_name.title()}', plot_tweets)
-
-        if should_plot:
-            plotter.build_bar_plot('word', 'freq', topic)
+            if should_plot:
+                pipeline.plot_bar(f'Frequency of Words Used When Tweeting About {save_name.title()}', topic,
+                                  min_freq=3)
 
     elif command == 'user':
-        username = input('Input username: ')
-        user_tweets = dm.get_tweets_for_user(username)
+        username = ask('Input username: ')
         user_mode = args[0]
         should_plot = args[1]
+        sync = len(args) > 2 and args[2]
 
-        if user_mode == '1':
-            user_frame = dm.build_user_frame(username)
-            whole_tweets = dm.load_tweet_text(username, from_file=False, frame=user_frame)
-            stripped_tweets = dm.select_pos_words(whole_tweets)
-            freq_frame = dm.build_frequency_frame(stripped_tweets)
-        elif user_mode == '2':
-            dm.save_tweets(username, to_save=user_tweets)
-            tweet_text = dm.load_tweet_text(username)
-            stripped_text = dm.select_pos_words(tweet_text)
-            user_tweet_frame = dm.build_frequency_frame(stripped_text)
-            user_tweet_frame = user_tweet_frame[user_tweet_frame.freq > 3]
-        elif user_mode == '3':
-            dm.save_tweets(username, to_save=user_tweets)
-            ut_frame = pd.read_csv(dm.make_file_name_for_search(username))
-
-        if should_plot:
+        with AnalysisPipeline(username, workers=workers, cache=dm.get_tag_cache()) as pipeline:
             if user_mode == '1':
-                title = f'Frequency of Words on {username}s profile'
-                plotter = PlotMaker(title, freq_frame)
-                plotter.build_bar_plot('word', 'freq', username)
-            elif user_mode == '2':
-                title = f'Frequency of Words in {username}s tweets'
-                plotter = PlotMaker(title, user_tweet_frame)
-                plotter.build_bar_plot('word', 'freq', f'{username}s tweets')
-            elif user_mode == '3':
-                title = f'Retweets as a function of favorites for {username}'
-                plotter = PlotMaker(title, ut_frame)
-                plotter.build_scatter_plot('favorites', 'retweets', username)
+                pipeline.count_stream(dm.stream_user_tweets(username))
+
+                if should_plot:
+                    pipeline.plot_bar(f'Frequency of Words on {username}s profile', username)
+            elif user_mode == '2' or user_mode == '3':
+                if sync:
+                    # Syncing saves the merged tweets itself
+                    user_frame = dm.sync_user_tweets(username)
+                else:
+                    user_frame = dm.get_tweets_for_user(username)
+
+                if isinstance(user_frame, str) and user_frame == 'PRIVATE':
+                    return
+
+                if sync:
+                    pipeline.use_frame(user_frame)
+                else:
+                    pipeline.use_frame(dm.tweets_to_frame(user_frame)).persist()
+
+                if user_mode == '2':
+                    pipeline.extract().count(save=False)
+
+                    if should_plot:
+                        pipeline.plot_bar(f'Frequency of Words in {username}s tweets', f'{username}s tweets',
+                                          min_freq=4)
+                elif should_plot:
+                    pipeline.plot_scatter(f'Retweets as a function of favorites for {username}', 'favorites',
+                                          'retweets', username)
     elif command == 'network':
-        username = input('Input username: ')
-        net_frame = dm.search_network(username)
+        username = ask('Input username: ')
+        net_frame = dm.search_network(username, workers=workers, cache=dm.get_tag_cache())
         should_plot = args[0]
-        plotter = PlotMaker(f'Frequency of Words in {username}s network', net_frame)
 
         if should_plot:
-            plotter.build_bar_plot('word', 'freq', username)
+            # Matplotlib is only loaded when something is plotted
+            from plotmaker import PlotMaker
+
+            PlotMaker(f'Frequency of Words in {username}s network', net_frame).build_bar_plot('word', 'freq', username)
     elif command == 'tweet':
-        post_text = input('Entire the text for your post: ')
-        graph_name = input('Select a graph to post: ')
+        post_text = ask('Entire the text for your post: ')
+        graph_name = ask('Select a graph to post: ')
 
         if len(post_text) > 280:
             print('Post is too long! Try again')
         else:
             post_tweet(post_text, image_name=graph_name)
-    else:
-        print(f'Unknown command: {command}')
-
-
-def main():
-    account_data = load_account_data()
-    login(account_data)
+    elif command == 'stats':
+        user1 = ask('Input first users username: ')
+        user2 = ask('Input second users username: ')
+        should_plot = args[0]
+        reuse = len(args) > 1 and args[1]
 
-    mode = input('Select search mode: Topic (1), User (2), Network (3), post a tweet (4), or do test stats (5): ')
-    should_plot = input('Plot results?: ').lower().startswith('y') is True
+        if user1.lower() == user2.lower():
+            print(f'Cannot compare {user1} with themselves! Input two different usernames')
+            return
 
-    if mode == '1':
-        assigned_name = input('Assign a unique name to this search? (Blank for default): ')
-        process_command('topic', [should_plot, assigned_name])
+        for username in (user1, user2):
+            # Saved tweets are only fetched again when asked to or when the user has none of their own
+            if reuse and dm.get_interaction_summary(username, user=username) is not None:
+                continue
 
-    elif mode == '2':
-        user_mode = input('Entire profile (1), profile tweets (2), like/retweet relationship (3)?: ')
+            user_tweets = dm.get_tweets_for_user(username)
 
-        process_command('user', [user_mode, should_plot])
-    elif mode == '3':
-        process_command('network', [should_plot])
-    elif mode == '4':
-        process_command('tweet', args=[])
-    elif mode == '5':
-        user1 = input('Input first users username: ')
-        user2 = input('Input second users username: ')
+            if isinstance(user_tweets, str) and user_tweets == 'PRIVATE':
+                return
 
-        user1_tweets = dm.get_tweets_for_user(user1)
-        user2_tweets = dm.get_tweets_for_user(user2)
+            dm.save_tweets(username, to_save=user_tweets)
 
-        dm.save_tweets(user1, to_save=user1_tweets)
-        dm.save_tweets(user2, to_save=user2_tweets)
+        # A user stream also saves retweets and liked tweets under the username, which are not the user's own tweets
+        summaries = dm.load_interaction_summaries([user1, user2], own_tweets=True)
 
-        user1_data = pd.read_csv(dm.make_file_name_for_search(user1))
-        user2_data = pd.read_csv(dm.make_file_name_for_search(user2))
+        if len(summaries) < 2:
+            return
 
-        fav_stat, fav_pval, rt_stat, rt_pval = sm.do_t_test(user1_data, user2_data)
+        fav_test = sm.welch_pairwise(summaries, column='favorites', correction=None).iloc[0]
+        rt_test = sm.welch_pairwise(summaries, column='retweets', correction=None).iloc[0]
+        fav_stat, fav_pval, rt_stat, rt_pval = fav_test.t_stat, fav_test.p_val, rt_test.t_stat, rt_test.p_val
 
         if should_plot:
+            from plotmaker import PlotMaker
+
+            columns = sm.INTERACTION_COLUMNS + ['screen_name', 'text']
+            user1_data = dm.select_own_tweets(dm.load_tweet_frame(user1, columns=columns), user1)
+            user2_data = dm.select_own_tweets(dm.load_tweet_frame(user2, columns=columns), user2)
             comb_data = [user1_data['favorites'], user1_data['retweets'], user2_data['favorites'],
                          user2_data['retweets']]
 
@@ -275,11 +300,114 @@ def main():
 
         test_tweet = sm.format_tweet_from_stats((fav_stat, fav_pval, rt_stat, rt_pval), opt_data=[user1, user2])
         print(test_tweet)
+    elif command == 'time':
+        searches = ask('Input the names of saved searches (Separate with commas): ')
+        save_names = [name.strip() for name in searches.split(',') if name.strip() != '']
+        bucket = ask('Count tweets by hour, day, or week? (Leave blank for day): ').strip().lower()
+        should_plot = args[0]
+
+        if bucket == '':
+            bucket = 'day'
+        elif bucket not in tm.TIME_BUCKETS:
+            print(f'Invalid input {bucket}! Defaulting to day')
+            bucket = 'day'
+
+        frames = {}
+
+        for save_name in save_names:
+            saved_tweets = dm.load_tweet_frame(save_name, columns=['tweet_times', 'favorites', 'retweets'])
+
+            if saved_tweets is not None:
+                frames[save_name] = saved_tweets
+
+        if len(frames) == 0:
+            print('No saved tweets to analyze!')
+            return
+
+        # One frame with a search column, so every search is counted by the same vectorized pass
+        tweets = pd.concat(frames, names=['search']).reset_index(level='search')
+        tweets['search'] = tweets['search'].astype('category')
+
+        activity = tm.bucket_activity(tweets, bucket=bucket, by='search')
+        rolling = tm.rolling_activity(tweets, window=tm.ROLLING_WINDOWS[bucket], bucket=bucket, by='search')
+
+        for save_name in frames.keys():
+            activity[activity['search'] == save_name].drop(columns='search').to_csv(
+                dm.make_file_name_for_search(save_name, type=f'{bucket}_activity'), index=False)
+
+        print(activity[activity['tweets'] > 0])
+
+        if should_plot:
+            from plotmaker import PlotMaker
+
+            subject = '_'.join(frames.keys())
+            window = tm.ROLLING_WINDOWS[bucket]
+
+            PlotMaker(f'Tweets per {bucket} ({window} {bucket} rolling total)', rolling).build_time_plot(
+                'bucket', 'tweets', f'{subject}_{bucket}_tweets', by='search', xlabel='Time (UTC)')
+            PlotMaker(f'Favorites per tweet ({window} {bucket} rolling mean)', rolling).build_time_plot(
+                'bucket', 'favorites_rate', f'{subject}_{bucket}_favorites', by='search', xlabel='Time (UTC)',
+                ylabel='Favorites per tweet')
+            PlotMaker('Tweets by day of the week and hour (UTC)', tm.weekly_profile(tweets)).build_heatmap(
+                f'{subject}_weekly', xlabel='Hour', value_label='Tweets')
     else:
-        print('Invalid input!')
-        main()
+        print(f'Unknown command: {command}')
+
+
+def run_menu():
+    """
+    Asks the user for a command and runs it, asking again until the input is valid
+    """
+
+    mode = ''
+
+    while mode not in ('1', '2', '3', '4', '5', '6'):
+        mode = input('Select search mode: Topic (1), User (2), Network (3), post a tweet (4), do test stats (5), or '
+                     'analyze tweet times (6): ')
+        should_plot = input('Plot results?: ').lower().startswith('y') is True
+
+        if mode == '1':
+            assigned_name = input('Assign a unique name to this search? (Blank for default): ')
+            process_command('topic', [should_plot, assigned_name])
+        elif mode == '2':
+            user_mode = input('Entire profile (1), profile tweets (2), like/retweet relationship (3)?: ')
+            sync = False
+
+            if user_mode == '2' or user_mode == '3':
+                sync = input('Only get tweets posted since the last search? (Y/N): ').lower().startswith('y') is True
+
+            process_command('user', [user_mode, should_plot, sync])
+        elif mode == '3':
+            process_command('network', [should_plot])
+        elif mode == '4':
+            process_command('tweet', args=[])
+        elif mode == '5':
+            reuse = input('Reuse saved tweets when available? (Y/N): ').lower().startswith('y') is True
+            process_command('stats', [should_plot, reuse])
+        elif mode == '6':
+            process_command('time', [should_plot])
+        else:
+            print('Invalid input!')
+
+
+def main():
+    setup_logging()
+
+    # Logging in once covers every run of the session
+    account_data = load_account_data()
+    login(account_data)
+    run_again = True
+
+    while run_again:
+        try:
+            run_menu()
+        except tw.TweepError as error:
+            # Such as a user that does not exist. The error was already printed, so the user can try again
+            logger.error(f'Command stopped because {error}')
 
-    repeat_menu()
+        sessionmanager.get_scheduler().log_stats()
+        dm.get_user_cache().log_stats()
+        run_again = repeat_menu()
 
 
 if __name__ == '__main__':